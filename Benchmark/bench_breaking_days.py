@@ -0,0 +1,66 @@
+""" Runtime of the nightly breaking-days job against member count
+
+    python -m Benchmark.bench_breaking_days --sizes 1000 10000 50000
+"""
+import argparse
+import random
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from Benchmark.common import sqlite_session, timed
+# pylint: disable=wrong-import-order
+import models
+from CRUD.challenge import apply_breaking_days
+
+TIMEZONES = ["Australia/Sydney", "Australia/Melbourne", "Australia/Perth"]
+
+
+def seed(db, member_count: int, posted_ratio: float) -> set:
+    """ Insert users, challenges and members; return today's posted pairs """
+    user_count = max(1, member_count // 3)
+    db.execute(insert(models.User), [
+        {"id": user_id, "firebase_uid": f"uid{user_id}", "name": f"user{user_id}",
+         "username": f"user{user_id}", "user_timezone": random.choice(TIMEZONES),
+         "created_time": datetime.now()}
+        for user_id in range(1, user_count + 1)
+    ])
+    db.execute(insert(models.Challenge), [
+        {"id": challenge_id, "title": "bench", "description": "bench", "duration": 30,
+         "breaking_days": 5, "challenge_owner_id": (challenge_id % user_count) + 1,
+         "created_time": datetime.now()}
+        for challenge_id in range(1, member_count + 1)
+    ])
+    members = [
+        {"challenge_id": challenge_id, "user_id": (challenge_id % user_count) + 1,
+         "breaking_days_left": random.choice([-1, 0, 1, 3, 5]),
+         "is_challenge_finished": False, "days_left": random.randint(0, 30)}
+        for challenge_id in range(1, member_count + 1)
+    ]
+    db.execute(insert(models.GroupChallengeMembers), members)
+    db.commit()
+    return {f"{member['challenge_id']}_{member['user_id']}"
+            for member in members if random.random() < posted_ratio}
+
+
+def main():
+    """ Seed each size into a fresh database and time one job run """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 50000])
+    parser.add_argument("--posted-ratio", type=float, default=0.5)
+    args = parser.parse_args()
+
+    print(f"{'members':>10} {'seconds':>10} {'break posts':>12} {'failed':>8}")
+    for size in args.sizes:
+        db = sqlite_session()
+        posted = seed(db, size, args.posted_ratio)
+        elapsed, summary = timed(apply_breaking_days, db, TIMEZONES, posted)
+        break_posts = sum(item["break_posts"] for item in summary.values())
+        failed = sum(item["failed_challenges"] for item in summary.values())
+        print(f"{size:>10} {elapsed:>10.3f} {break_posts:>12} {failed:>8}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+""" Per-request overhead of the metrics and query counting middleware
+
+Serves the same trivial routes through the bare app, through
+QueryCountMiddleware, and through both middleware as main.py stacks them.
+Requests are driven through the ASGI interface directly, so the difference
+between the rows is the middleware's own cost. The stacks take turns for
+--rounds rounds and the best round of each is reported.
+
+    python -m Benchmark.bench_metrics_overhead --requests 5000 --rounds 5
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+import Benchmark.common  # noqa: F401  pylint: disable=unused-import
+# pylint: disable=wrong-import-order
+from metrics import MetricsMiddleware
+from query_counter import QueryCountMiddleware
+
+
+def build_app() -> FastAPI:
+    """ A sync and an async route with a path parameter, like most of the API """
+    app = FastAPI()
+
+    @app.get("/async/{item_id}")
+    async def async_item(item_id: int):
+        return {"id": item_id}
+
+    @app.get("/sync/{item_id}")
+    def sync_item(item_id: int):
+        return {"id": item_id}
+
+    return app
+
+
+# as in production: no X-Query-* headers
+STACKS = {
+    "bare": lambda app: app,
+    "query counter": lambda app: QueryCountMiddleware(app, headers=False),
+    "metrics + query counter": lambda app: QueryCountMiddleware(
+        MetricsMiddleware(app), headers=False),
+}
+
+
+async def serve(app, path: str, requests: int) -> float:
+    """ Seconds to serve path requests times """
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+             "method": "GET", "scheme": "http", "path": path, "raw_path": path.encode(),
+             "root_path": "", "query_string": b"", "headers": [],
+             "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(_message):
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return time.perf_counter() - start
+
+
+def main():
+    """ Serve both routes through every middleware stack """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'route':>8} {'stack':>24} {'us/request':>11} {'overhead us':>12}")
+    for route in ("async", "sync"):
+        apps = {name: wrap(build_app()) for name, wrap in STACKS.items()}
+        best = dict.fromkeys(apps, float("inf"))
+        # the stacks take turns and keep their best round, so machine noise
+        # hits every stack alike
+        for _ in range(args.rounds):
+            for name, app in apps.items():
+                seconds = asyncio.run(serve(app, f"/{route}/1", args.requests))
+                best[name] = min(best[name], seconds / args.requests * 1e6)
+        for name, per_request in best.items():
+            print(f"{route:>8} {name:>24} {per_request:>11.1f} "
+                  f"{per_request - best['bare']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+""" Per-stage runtime of the r1 nightly Redis job against the chunk size
+
+A chunk size of 1 costs one round trip per row and per lookup, like the job
+did before it was pipelined. The Redis database given by --redis-url is
+flushed before every run.
+
+    python -m Benchmark.bench_r1_automation --posts 50000 --chunk-sizes 1 1000
+"""
+import argparse
+import random
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from Benchmark.common import sqlite_session
+# pylint: disable=wrong-import-order
+import models
+import r1_automation
+from redis_client import create_redis_client
+
+
+def seed(db, post_count: int):
+    """ Insert users, challenges, members, posts and reactions """
+    user_count = max(1, post_count // 20)
+    challenge_count = max(1, post_count // 10)
+    db.execute(insert(models.User), [
+        {"id": user_id, "firebase_uid": f"uid{user_id}", "name": f"user{user_id}",
+         "username": f"user{user_id}", "user_timezone": "Australia/Sydney",
+         "created_time": datetime.now()}
+        for user_id in range(1, user_count + 1)
+    ])
+    db.execute(insert(models.Emoji), [{"emoji_image": "🔥", "name": "fire"}])
+    db.execute(insert(models.Challenge), [
+        {"id": challenge_id, "title": "bench", "description": "bench", "duration": 30,
+         "breaking_days": 5, "is_public": True, "category": str(challenge_id % 5),
+         "challenge_owner_id": (challenge_id % user_count) + 1,
+         "created_time": datetime.now()}
+        for challenge_id in range(1, challenge_count + 1)
+    ])
+    db.execute(insert(models.GroupChallengeMembers), [
+        {"challenge_id": challenge_id, "user_id": (challenge_id % user_count) + 1,
+         "breaking_days_left": 5, "days_left": 30}
+        for challenge_id in range(1, challenge_count + 1)
+    ])
+    db.execute(insert(models.Post), [
+        {"id": post_id, "user_id": random.randint(1, user_count),
+         "challenge_id": random.randint(1, challenge_count),
+         "written_text": "bench", "created_time": datetime.now()}
+        for post_id in range(1, post_count + 1)
+    ])
+    db.execute(insert(models.UserReactionLog), [
+        {"post_id": random.randint(1, post_count), "user_id": random.randint(1, user_count),
+         "emoji_image": "🔥", "is_cancelled": random.random() < 0.1,
+         "created_datetime": datetime.now()}
+        for _ in range(post_count)
+    ])
+    db.commit()
+
+
+def main():
+    """ Run the job stages once per chunk size on the same seeded database """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--chunk-sizes", type=int, nargs="+", default=[1, 1000])
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    db = sqlite_session()
+    seed(db, args.posts)
+    r1_automation.session = db
+    r1_automation.r = create_redis_client(args.redis_url)
+
+    for chunk_size in args.chunk_sizes:
+        r1_automation.r.flushdb()
+        r1_automation.CHUNK_SIZE = chunk_size
+        print(f"\nchunk size {chunk_size}")
+        report = r1_automation.run_stages([
+            r1_automation.add_new_ongoing_challenges_to_redis,
+            r1_automation.update_challenge_distribution_for_users,
+            r1_automation.classify_new_posts,
+            r1_automation.process_recent_reaction_data,
+        ])
+        r1_automation.print_timing_report(report)
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+""" Throughput and lost updates of reaction taps, row update vs Redis counters
+
+Threads tap the same few reactions, as a popular post gets them. The row
+path is how update_count worked before the Redis counters: read the
+post_reaction row, add one in Python and commit, on a session per thread.
+The Redis path is reaction_counts.tap, then one flush_reaction_counts. Both
+report taps per second and how many taps the final post_reaction counts
+lost. The Redis database given by --redis-url is flushed first; the rows
+live in a SQLite file unless --database-url names another database.
+
+    python -m Benchmark.bench_reaction_counts --threads 16 --taps 4000
+"""
+import argparse
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import Benchmark.common  # noqa: F401  pylint: disable=unused-import
+# pylint: disable=wrong-import-order
+import CRUD.reaction_counts as reaction_counts
+import models
+from Benchmark.common import timed
+from database import Base
+from redis_client import create_redis_client
+
+EMOJIS = ("🔥", "👍")
+
+
+def seed(session_factory, posts: int):
+    """ A user, a challenge and posts with a zero count for every emoji """
+    db = session_factory()
+    for emoji_image in EMOJIS:
+        db.add(models.Emoji(emoji_image=emoji_image, name=emoji_image))
+    db.add(models.User(id=1, firebase_uid="uid1", name="name1", username="user1",
+                       user_timezone="Australia/Sydney"))
+    db.add(models.Challenge(id=1, title="t", description="d", duration=30,
+                            breaking_days=3, challenge_owner_id=1))
+    for post_id in range(1, posts + 1):
+        db.add(models.Post(id=post_id, user_id=1, challenge_id=1, written_text="post"))
+        for emoji_image in EMOJIS:
+            db.add(models.PostReaction(post_id=post_id, emoji_image=emoji_image, count=0))
+    db.commit()
+    db.close()
+
+
+def reset(session_factory):
+    """ Zero every count again """
+    db = session_factory()
+    db.query(models.PostReaction).update({models.PostReaction.count: 0})
+    db.commit()
+    db.close()
+
+
+def total_count(session_factory) -> int:
+    """ Sum of every post_reaction count """
+    db = session_factory()
+    try:
+        return sum(count for (count,) in db.query(models.PostReaction.count))
+    finally:
+        db.close()
+
+
+def row_tap(session_factory, post_id: int, emoji_image: str) -> bool:
+    """ The former update_count: read, add one and commit; False when it failed """
+    db = session_factory()
+    try:
+        reaction = db.query(models.PostReaction).filter(
+            models.PostReaction.post_id == post_id,
+            models.PostReaction.emoji_image == emoji_image).first()
+        reaction.count += 1
+        db.commit()
+        return True
+    except Exception:  # pylint: disable=broad-except
+        db.rollback()
+        return False
+    finally:
+        db.close()
+
+
+def redis_tap(_session_factory, post_id: int, emoji_image: str) -> bool:
+    """ reaction_counts.tap on seeded totals """
+    return reaction_counts.tap(post_id, emoji_image, 1) is not None
+
+
+def run(tap, session_factory, threads: int, taps: int, posts: int) -> tuple:
+    """ (seconds, failed taps) of taps spread over posts and emojis by threads """
+    targets = [(index % posts + 1, EMOJIS[index % len(EMOJIS)]) for index in range(taps)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        seconds, results = timed(lambda: list(pool.map(
+            lambda target: tap(session_factory, *target), targets)))
+    return seconds, results.count(False)
+
+
+def main():
+    """ Tap through both paths and compare """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--taps", type=int, default=4000)
+    parser.add_argument("--posts", type=int, default=4)
+    parser.add_argument("--database-url")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.database_url or f"sqlite:///{os.path.join(directory, 'reactions.db')}"
+        engine = create_engine(url, pool_size=args.threads, max_overflow=0)
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        seed(session_factory, args.posts)
+
+        client = create_redis_client(args.redis_url)
+        client.flushdb()
+        reaction_counts.redis_client = client
+
+        print(f"{'path':>6} {'taps/s':>10} {'failed':>7} {'lost':>6}")
+        seconds, failed = run(row_tap, session_factory, args.threads, args.taps, args.posts)
+        lost = args.taps - failed - total_count(session_factory)
+        print(f"{'row':>6} {args.taps / seconds:>10.0f} {failed:>7} {lost:>6}")
+
+        reset(session_factory)
+        db = session_factory()
+        for post_id in range(1, args.posts + 1):
+            reaction_counts.get_reaction_counts(db, post_id)
+        reaction_counts.flush_reaction_counts(db)
+        seconds, failed = run(redis_tap, session_factory, args.threads, args.taps, args.posts)
+        flush_seconds, _ = timed(reaction_counts.flush_reaction_counts, db)
+        db.close()
+        lost = args.taps - failed - total_count(session_factory)
+        print(f"{'redis':>6} {args.taps / seconds:>10.0f} {failed:>7} {lost:>6}"
+              f"   (flush {flush_seconds * 1000:.1f} ms)")
+        client.flushdb()
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+""" Redis round trips and latency of one online recommendation request
+
+Compares the per-call candidate filtering /GetRecommendedPosts used to run
+(kept below as the baseline) with the pipelined Router.post.get_recommended_post.
+The Redis database given by --redis-url is flushed and seeded first.
+
+    python -m Benchmark.bench_recommendation --posts 5000 --requests 200
+"""
+import argparse
+import random
+import statistics
+import time
+
+
+import Benchmark.common  # noqa: F401  pylint: disable=unused-import
+# pylint: disable=wrong-import-order
+import Router.post as post_router
+from Benchmark.common import RoundTripCounter, percentile
+from r1_automation import byte_to_utf8, contribution_key
+from redis_client import create_redis_client
+
+
+def legacy_recommended_post(r, user_id: int) -> list:
+    """ The per-call filtering the endpoint ran before it was pipelined """
+    post_pool = []
+    recent_posts = r.hkeys('post_clg_pair')
+    recent_posts = random.sample(recent_posts, min(len(recent_posts), 200))
+    top3 = post_router.top3categories(user_id)
+    for post_id in recent_posts:
+        clg_id = r.hget('post_clg_pair', post_id)
+        category = int(byte_to_utf8(r.hget(
+            'on_clg_info', clg_id), str_split_symbol=',')[0])
+        if category not in top3:
+            interacted_post = r.sismember(f'{user_id}_liked_posts', post_id)
+            interacted_clg = r.zscore(f'{user_id}_clgs_preference', clg_id)
+            if not interacted_post or interacted_clg:
+                post_pool.append(int(byte_to_utf8(post_id)))
+
+    for category_code in post_router.top3categories(user_id):
+        raw_post_pool = r.zrangebyscore(
+            f'recent_posts_for_category{category_code}', 0, float('inf'))
+        raw_post_pool = [int(post) for post in raw_post_pool]
+        for post_id in random.sample(raw_post_pool, min(len(raw_post_pool), 100)):
+            if not r.sismember(f'{user_id}_liked_posts', post_id):
+                post_pool.append(post_id)
+    return post_pool
+
+
+def seed(r, post_count: int, user_count: int):
+    """ Fill the keys the recommender reads with random data """
+    r.flushdb()
+    challenge_count = max(1, post_count // 10)
+    pipe = r.pipeline(transaction=False)
+    pipe.hset('on_clg_info', mapping={
+        challenge_id: f'{challenge_id % 5},True,30,2099-01-01'
+        for challenge_id in range(1, challenge_count + 1)})
+    pairs = {post_id: random.randint(1, challenge_count)
+             for post_id in range(1, post_count + 1)}
+    pipe.hset('post_clg_pair', mapping=pairs)
+    for post_id, challenge_id in pairs.items():
+        pipe.zadd(f'recent_posts_for_category{challenge_id % 5}', {post_id: 7})
+    for user_id in range(1, user_count + 1):
+        pipe.hset(contribution_key(user_id),
+                  mapping={category: random.randint(0, 50) for category in range(5)})
+        pipe.sadd(f'{user_id}_liked_posts', *random.sample(range(1, post_count + 1), 50))
+        pipe.zadd(f'{user_id}_clgs_preference', {
+            challenge_id: 1 for challenge_id in random.sample(
+                range(1, challenge_count + 1), min(20, challenge_count))})
+    pipe.execute()
+
+
+def measure(recommend, r, user_count: int, requests: int) -> dict:
+    """ Run requests for random users; return round trips and latency """
+    latencies = []
+    with RoundTripCounter() as counter:
+        for _ in range(requests):
+            start = time.perf_counter()
+            recommend(r, random.randint(1, user_count))
+            latencies.append((time.perf_counter() - start) * 1000)
+    return {"round_trips": counter.count / requests,
+            "mean_ms": statistics.mean(latencies),
+            "p95_ms": percentile(latencies, 95)}
+
+
+def main():
+    """ Seed Redis once and measure both implementations """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    r = create_redis_client(args.redis_url)
+    post_router.r = r
+    seed(r, args.posts, args.users)
+
+    implementations = {
+        "per-call": legacy_recommended_post,
+        "pipelined": lambda _, user_id: post_router.get_recommended_post(user_id),
+    }
+    print(f"{'implementation':>15} {'round trips':>12} {'mean ms':>10} {'p95 ms':>10}")
+    for name, recommend in implementations.items():
+        result = measure(recommend, r, args.users, args.requests)
+        print(f"{name:>15} {result['round_trips']:>12.1f} "
+              f"{result['mean_ms']:>10.2f} {result['p95_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+""" Redis footprint and decode cost of on_clg_info and user_contribution
+
+Both hashes are written once with the legacy comma-joined values and once
+with redis_codec, and every value is decoded the way the automation reads
+it. Memory is MEMORY USAGE of the hash when the server supports it, and the
+raw bytes of the stored values either way. The Redis database given by
+--redis-url is flushed first.
+
+    python -m Benchmark.bench_redis_codec --challenges 20000 --users 100000
+"""
+import argparse
+import datetime
+import random
+
+import redis
+
+import Benchmark.common  # noqa: F401  pylint: disable=unused-import
+# pylint: disable=wrong-import-order
+from Benchmark.common import timed
+from r1_automation import byte_to_utf8
+from redis_client import create_redis_client
+from redis_codec import (decode_clg_info, decode_contribution, encode_clg_info,
+                         encode_contribution)
+
+
+def legacy_clg_info(value: bytes) -> tuple:
+    """ How on_clg_info values were read before the codec """
+    category, is_public, duration, done_by = byte_to_utf8(value, str_split_symbol=',')
+    return (category, is_public, duration,
+            datetime.datetime.strptime(done_by, '%Y-%m-%d').date())
+
+
+def legacy_contribution(value: bytes) -> list:
+    """ How user_contribution values were read before the codec """
+    return byte_to_utf8(value, str_split_symbol=',')
+
+
+def random_data(challenge_count: int, user_count: int) -> tuple:
+    """ Random challenge details and contributions shaped like production """
+    today = datetime.date.today()
+    clg_info = {
+        challenge_id: (random.randint(0, 4), random.random() < 0.7, random.choice([7, 14, 30, 60]),
+                       today + datetime.timedelta(days=random.randint(0, 60)))
+        for challenge_id in range(1, challenge_count + 1)}
+    contributions = {
+        user_id: [random.randint(0, 90) if random.random() < 0.4 else 0 for _ in range(5)]
+        for user_id in range(1, user_count + 1)}
+    return clg_info, contributions
+
+
+def memory_usage(client, key: str):
+    """ MEMORY USAGE of a key, or None when the server does not support it """
+    try:
+        return client.memory_usage(key, samples=0)
+    except redis.ResponseError:
+        return None
+
+
+def store_and_measure(client, key: str, values: dict, decode) -> dict:
+    """ Write a hash, read it back, and time decoding every value """
+    client.delete(key)
+    fields = list(values)
+    for start in range(0, len(fields), 10000):
+        client.hset(key, mapping={field: values[field] for field in fields[start:start + 10000]})
+    stored = client.hvals(key)
+    seconds, _ = timed(lambda: [decode(value) for value in stored])
+    return {"memory": memory_usage(client, key),
+            "value_bytes": sum(len(value) for value in stored),
+            "decode_us": seconds / len(stored) * 1e6}
+
+
+def main():
+    """ Compare both encodings of both hashes """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--challenges", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    client = create_redis_client(args.redis_url)
+    client.flushdb()
+    clg_info, contributions = random_data(args.challenges, args.users)
+
+    cases = [
+        ("on_clg_info", "legacy", legacy_clg_info, {
+            challenge_id: f'{category},{int(is_public)},{duration},{done_by:%Y-%m-%d}'
+            for challenge_id, (category, is_public, duration, done_by) in clg_info.items()}),
+        ("on_clg_info", "codec", decode_clg_info, {
+            challenge_id: encode_clg_info(*details) for challenge_id, details in clg_info.items()}),
+        ("user_contribution", "legacy", legacy_contribution, {
+            user_id: ','.join(map(str, contribution))
+            for user_id, contribution in contributions.items()}),
+        ("user_contribution", "codec", decode_contribution, {
+            user_id: encode_contribution(contribution)
+            for user_id, contribution in contributions.items()}),
+    ]
+    print(f"{'hash':>18} {'encoding':>9} {'MEMORY USAGE':>13} {'value bytes':>12} "
+          f"{'decode us':>10}")
+    for key, encoding, decode, values in cases:
+        result = store_and_measure(client, key, values, decode)
+        memory = "n/a" if result["memory"] is None else result["memory"]
+        print(f"{key:>18} {encoding:>9} {memory:>13} {result['value_bytes']:>12} "
+              f"{result['decode_us']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+""" Peak RSS of a bulk job reading GroupChallengeMembers, against row count
+
+Each size is seeded into a SQLite file and every mode runs in a fresh
+process, so the reported growth is the job's own peak RSS over the RSS
+after imports (Linux ru_maxrss, in MB).
+
+    all     db.query(GroupChallengeMembers).all(), the old pattern
+    stream  database.stream_rows over a two-column select
+
+    python -m Benchmark.bench_stream_memory --sizes 100000 1000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import insert, select
+
+from Benchmark.common import sqlite_session, timed
+# pylint: disable=wrong-import-order
+import models
+from database import chunked, stream_rows
+
+MODES = ["all", "stream"]
+
+
+def seed(path: str, member_count: int):
+    """ Write member_count challenge members into a SQLite file """
+    db = sqlite_session(path)
+    for rows in chunked(range(member_count), 50000):
+        db.execute(insert(models.GroupChallengeMembers), [
+            {"challenge_id": index // 3 + 1, "user_id": index % 3 + 1,
+             "breaking_days_left": 2, "is_challenge_finished": False, "days_left": 30}
+            for index in rows
+        ])
+    db.commit()
+    db.close()
+
+
+def run_job(path: str, mode: str) -> int:
+    """ Count unfinished members the way a reminder job would """
+    db = sqlite_session(path)
+    members = models.GroupChallengeMembers
+    count = 0
+    if mode == "all":
+        for member in db.query(members).all():
+            if not member.is_challenge_finished:
+                count += 1
+    else:
+        statement = select(members.challenge_id, members.user_id)\
+            .where(members.is_challenge_finished.is_(False))
+        for chunk in stream_rows(db, statement):
+            count += len(chunk)
+    db.close()
+    return count
+
+
+def child(path: str, mode: str):
+    """ Run one job in this process and print its peak RSS growth as JSON """
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    elapsed, rows = timed(run_job, path, mode)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"rows": rows, "seconds": elapsed,
+                      "growth_mb": (peak_kb - baseline_kb) / 1024}))
+
+
+def main():
+    """ Seed each size once and run every mode against it in a fresh process """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--child", nargs=2, metavar=("PATH", "MODE"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    print(f"{'rows':>10} {'mode':>8} {'seconds':>10} {'peak RSS growth MB':>20}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            path = os.path.join(tmp_dir, f"members_{size}.db")
+            seed(path, size)
+            for mode in MODES:
+                output = subprocess.run(
+                    [sys.executable, "-m", "Benchmark.bench_stream_memory",
+                     "--child", path, mode],
+                    check=True, capture_output=True, text=True).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+                print(f"{result['rows']:>10} {mode:>8} {result['seconds']:>10.2f} "
+                      f"{result['growth_mb']:>20.1f}")
+
+
+if __name__ == "__main__":
+    main()
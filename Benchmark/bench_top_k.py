@@ -0,0 +1,69 @@
+""" Top-3 category ranking for a batch of users: NumPy against a Python loop
+
+The Python loop sorts each user's categories separately, which is what the
+per-request implementations did. With --redis-url the users are also
+written to their user_contribution:{id} hashes on that Redis database (which
+is flushed) and loaded back with recommender_scoring.load_contributions.
+
+    python -m Benchmark.bench_top_k --users 100000
+"""
+import argparse
+import random
+
+import numpy as np
+
+import Benchmark.common  # noqa: F401  pylint: disable=unused-import
+# pylint: disable=wrong-import-order
+import r1_automation
+import recommender_scoring
+from Benchmark.common import timed
+from redis_client import create_redis_client
+
+
+def python_top3(contributions: list) -> list:
+    """ Per-user ranking with random tie-breaking and random top-up """
+    ranked = []
+    for contribution in contributions:
+        categories = list(range(len(contribution)))
+        random.shuffle(categories)
+        contributed = sorted((category for category in categories if contribution[category] > 0),
+                             key=lambda category: -contribution[category])[:3]
+        others = [category for category in categories if category not in contributed]
+        ranked.append(contributed + others[:3 - len(contributed)])
+    return ranked
+
+
+def main():
+    """ Rank the same random contributions both ways """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--redis-url", default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # most users contribute to a few categories only
+    contributions = rng.integers(0, 60, size=(args.users, 5)) * \
+        (rng.random((args.users, 5)) < 0.4)
+
+    python_seconds, _ = timed(python_top3, contributions.tolist())
+    numpy_seconds, _ = timed(recommender_scoring.top_k_categories, contributions)
+    print(f"{'users':>10} {'python s':>10} {'numpy s':>10} {'speedup':>8}")
+    print(f"{args.users:>10} {python_seconds:>10.3f} {numpy_seconds:>10.3f} "
+          f"{python_seconds / numpy_seconds:>8.0f}x")
+
+    if args.redis_url:
+        client = create_redis_client(args.redis_url)
+        client.flushdb()
+        recommender_scoring.r = client
+        user_ids = list(range(1, args.users + 1))
+        pipe = client.pipeline(transaction=False)
+        for user_id, row in zip(user_ids, contributions.tolist()):
+            pipe.hset(r1_automation.contribution_key(user_id), mapping=dict(enumerate(row)))
+        pipe.execute()
+        load_seconds, loaded = timed(recommender_scoring.load_contributions, user_ids)
+        assert (loaded == contributions).all()
+        print(f"loading {args.users} users with pipelined HMGET: {load_seconds:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
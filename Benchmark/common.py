@@ -0,0 +1,80 @@
+""" Shared setup for the benchmark scripts
+
+Run the benchmarks from the repository root, e.g.
+    python -m Benchmark.bench_breaking_days
+"""
+import os
+import time
+
+# database.py reads these at import time; benchmarks never touch the real database
+os.environ.setdefault("DATABASE_USER", "benchmark")
+os.environ.setdefault("DATABASE_PASSWORD", "benchmark")
+os.environ.setdefault("DATABASE_HOST", "localhost")
+os.environ.setdefault("DATABASE_NAME", "benchmark")
+
+# pylint: disable=wrong-import-position
+import redis
+from redis.client import Pipeline
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+
+
+def sqlite_session(path: str = None):
+    """ Create a fresh SQLite database with every table and return a session """
+    if path:
+        engine = create_engine(f"sqlite:///{path}")
+    else:
+        engine = create_engine("sqlite://", poolclass=StaticPool,
+                               connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def timed(func, *args, **kwargs):
+    """ Call func and return (elapsed seconds, result) """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def percentile(samples: list, pct: float) -> float:
+    """ Nearest-rank percentile of a list of numbers """
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class RoundTripCounter:
+    """ Count Redis round trips (direct commands and pipeline flushes) and commands """
+
+    def __init__(self):
+        self.count = 0
+        self.commands = 0
+        self._execute_command = redis.Redis.execute_command
+        self._execute_pipeline = Pipeline.execute
+
+    def __enter__(self):
+        counter = self
+
+        def execute_command(client, *args, **kwargs):
+            counter.count += 1
+            counter.commands += 1
+            return counter._execute_command(client, *args, **kwargs)
+
+        def execute_pipeline(pipe, *args, **kwargs):
+            counter.count += 1
+            counter.commands += len(pipe.command_stack)
+            return counter._execute_pipeline(pipe, *args, **kwargs)
+
+        redis.Redis.execute_command = execute_command
+        Pipeline.execute = execute_pipeline
+        return self
+
+    def __exit__(self, *exc):
+        redis.Redis.execute_command = self._execute_command
+        Pipeline.execute = self._execute_pipeline
@@ -0,0 +1,258 @@
+""" Offline evaluation and latency harness for the recommenders
+
+Generates synthetic users, challenges, members, posts and reaction logs in
+which every user prefers a few challenge categories. The latest reactions
+are held out. Only the others go to the database (SQLite in memory, or
+--database-url) before the recommender's automation pipeline is run against
+the Redis database given by --redis-url, which is flushed. Candidate
+generation is then timed for every evaluated user and scored against their
+held-out reactions:
+
+    router  Router.automation stages + Router.post.get_recommended_post
+    r2      r1_automation stages + r2_user_request.get_recommended_post
+
+hit rate is the share of users with at least one held-out post among their
+candidates, recall the share of held-out reactions recovered. The random
+row draws the same number of candidates uniformly from all public posts.
+
+    python -m Benchmark.eval_recommendation --users 1000 --posts 10000
+"""
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+import Benchmark.common  # noqa: F401  pylint: disable=unused-import
+# pylint: disable=wrong-import-order
+import CRUD.popular_posts as popular_posts_crud
+import models
+import r1_automation
+import r2_user_request
+import recommender_scoring
+import Router.automation as automation_router
+import Router.post as post_router
+from Benchmark.common import RoundTripCounter, percentile, sqlite_session
+from database import Base
+from redis_client import create_redis_client
+
+CATEGORIES = 5
+EMOJI = "🔥"
+
+
+def database_session(url: str = None):
+    """ Session on a fresh database with every table, SQLite in memory by default """
+    if not url:
+        return sqlite_session()
+    engine = create_engine(url)
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def generate(args, rng: np.random.Generator) -> dict:
+    """ Synthetic rows for every table the recommenders read, as insert() parameters
+
+    Every user draws a category preference from a Dirichlet distribution,
+    joins challenges and reacts to public posts following it.
+    """
+    start = datetime.now() - timedelta(days=args.days)
+    preference = rng.dirichlet([0.3] * CATEGORIES, size=args.users)
+
+    users = [{"id": user_id, "firebase_uid": f"uid{user_id}", "name": f"user{user_id}",
+              "username": f"user{user_id}", "user_timezone": "Australia/Sydney",
+              "created_time": start} for user_id in range(1, args.users + 1)]
+
+    categories = rng.integers(0, CATEGORIES, size=args.challenges)
+    is_public = rng.random(args.challenges) < 0.8
+    challenges = [{"id": index + 1, "title": "eval", "description": "eval", "duration": 60,
+                   "breaking_days": 5, "is_public": bool(is_public[index]),
+                   "category": str(categories[index]),
+                   "challenge_owner_id": int(rng.integers(1, args.users + 1)),
+                   "created_time": start} for index in range(args.challenges)]
+
+    # every user joins a few challenges of the categories they like
+    members = {}
+    for user_index in range(args.users):
+        weights = preference[user_index][categories]
+        for index in rng.choice(args.challenges, size=min(3, args.challenges), replace=False,
+                                p=weights / weights.sum()):
+            members[(int(index) + 1, user_index + 1)] = {
+                "challenge_id": int(index) + 1, "user_id": user_index + 1,
+                "breaking_days_left": 5, "days_left": 60}
+
+    member_list = list(members)
+    post_rows, post_categories = [], []
+    for post_id in range(1, args.posts + 1):
+        challenge_id, user_id = member_list[int(rng.integers(len(member_list)))]
+        post_rows.append({"id": post_id, "user_id": user_id, "challenge_id": challenge_id,
+                          "written_text": "eval", "created_time": start + timedelta(
+                              seconds=float(rng.random()) * args.days * 86400)})
+        post_categories.append(categories[challenge_id - 1])
+    post_categories = np.array(post_categories)
+    public_posts = np.array([row["id"] for row in post_rows
+                             if is_public[row["challenge_id"] - 1]])
+    posts_by_category = [public_posts[post_categories[public_posts - 1] == category]
+                         for category in range(CATEGORIES)]
+
+    reactions = []
+    reactors = rng.integers(1, args.users + 1, size=args.reactions)
+    for user_id in reactors:
+        category = rng.choice(CATEGORIES, p=preference[user_id - 1])
+        pool = posts_by_category[category] if len(posts_by_category[category]) else public_posts
+        post_id = int(pool[rng.integers(len(pool))])
+        created = max(post_rows[post_id - 1]["created_time"], start) + timedelta(
+            seconds=float(rng.random()) * 86400)
+        reactions.append({"post_id": post_id, "user_id": int(user_id), "emoji_image": EMOJI,
+                          "is_cancelled": False, "created_datetime": created})
+    reactions.sort(key=lambda row: row["created_datetime"])
+
+    return {"users": users, "challenges": challenges, "members": list(members.values()),
+            "posts": post_rows, "reactions": reactions, "public_posts": public_posts.tolist()}
+
+
+def split_reactions(reactions: list, holdout: float) -> tuple:
+    """ (training reactions, {user_id: held-out post ids}) split by time """
+    cut = int(len(reactions) * (1 - holdout))
+    held_out = {}
+    for row in reactions[cut:]:
+        held_out.setdefault(row["user_id"], set()).add(row["post_id"])
+    return reactions[:cut], held_out
+
+
+def load(db, data: dict, training: list):
+    """ Insert the synthetic rows and the training reactions """
+    db.execute(insert(models.User), data["users"])
+    db.execute(insert(models.Emoji), [{"emoji_image": EMOJI, "name": "fire"}])
+    db.execute(insert(models.Challenge), data["challenges"])
+    db.execute(insert(models.GroupChallengeMembers), data["members"])
+    db.execute(insert(models.Post), data["posts"])
+    db.execute(insert(models.UserReactionLog), training)
+    db.commit()
+
+
+def use_redis(client, db):
+    """ Point every module the recommenders use at the benchmark Redis and database """
+    r1_automation.r = client
+    r1_automation.session = db
+    r2_user_request.r = client
+    r2_user_request.session = db
+    recommender_scoring.r = client
+    post_router.r = client
+    automation_router.redis_client = client
+    popular_posts_crud.redis_client = client
+
+
+def prepare_router(db):
+    """ The stages /UpdateRecommendation runs, after registering the challenges """
+    automation_router.add_new_ongoing_challenges_to_redis(db)
+    automation_router.update_challenge_distribution_for_users(db)
+    automation_router.classify_new_posts_by_challenge_category(db)
+    automation_router.process_recent_reaction_data(db)
+
+
+def prepare_r2(_db):
+    """ The stages of the nightly r1 job """
+    r1_automation.run_stages([
+        r1_automation.add_new_ongoing_challenges_to_redis,
+        r1_automation.update_challenge_distribution_for_users,
+        r1_automation.classify_new_posts,
+        r1_automation.process_recent_reaction_data,
+        r1_automation.rebuild_popular_posts,
+    ])
+
+
+RECOMMENDERS = {
+    "router": (prepare_router, post_router.get_recommended_post),
+    "r2": (prepare_r2, r2_user_request.get_recommended_post),
+}
+
+
+def evaluate(recommend, user_ids: list, held_out: dict, public_posts: list,
+             rng: random.Random) -> dict:
+    """ Time candidate generation per user and score it against held-out reactions """
+    latencies, round_trips, commands, sizes = [], [], [], []
+    hits = recovered = random_hits = random_recovered = 0
+    recommended = set()
+    for user_id in user_ids:
+        with RoundTripCounter() as counter:
+            start = time.perf_counter()
+            candidates = set(recommend(user_id))
+            latencies.append((time.perf_counter() - start) * 1000)
+        round_trips.append(counter.count)
+        commands.append(counter.commands)
+        sizes.append(len(candidates))
+        recommended |= candidates
+
+        found = len(candidates & held_out[user_id])
+        hits += found > 0
+        recovered += found
+        baseline = set(rng.sample(public_posts, min(len(candidates), len(public_posts))))
+        found = len(baseline & held_out[user_id])
+        random_hits += found > 0
+        random_recovered += found
+
+    held_out_count = sum(len(held_out[user_id]) for user_id in user_ids)
+    return {"p50_ms": percentile(latencies, 50), "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "round_trips": statistics.mean(round_trips), "commands": statistics.mean(commands),
+            "candidates": statistics.mean(sizes), "hit_rate": hits / len(user_ids),
+            "recall": recovered / held_out_count, "coverage": len(recommended) / len(public_posts),
+            "random_hit_rate": random_hits / len(user_ids),
+            "random_recall": random_recovered / held_out_count}
+
+
+def main():
+    """ Generate, load, run the pipelines and report every recommender """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--challenges", type=int, default=100)
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--reactions", type=int, default=20000)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--eval-users", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--recommenders", nargs="+", default=list(RECOMMENDERS),
+                        choices=list(RECOMMENDERS))
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    data = generate(args, np.random.default_rng(args.seed))
+    training, held_out = split_reactions(data["reactions"], args.holdout)
+    db = database_session(args.database_url)
+    load(db, data, training)
+    client = create_redis_client(args.redis_url)
+    use_redis(client, db)
+
+    eval_users = sorted(held_out)[:args.eval_users]
+    print(f"{len(data['users'])} users, {len(data['challenges'])} challenges, "
+          f"{len(data['posts'])} posts, {len(training)} training and "
+          f"{len(data['reactions']) - len(training)} held-out reactions, "
+          f"{len(eval_users)} users evaluated\n")
+    print(f"{'recommender':>12} {'prepare s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'trips':>6} {'cmds':>6} {'cands':>6} {'hit rate':>9} {'recall':>7} "
+          f"{'coverage':>9} {'random hit':>11} {'random rec':>11}")
+    for name in args.recommenders:
+        prepare, recommend = RECOMMENDERS[name]
+        client.flushdb()
+        start = time.perf_counter()
+        prepare(db)
+        prepare_seconds = time.perf_counter() - start
+        result = evaluate(recommend, eval_users, held_out, data["public_posts"],
+                          random.Random(args.seed))
+        print(f"{name:>12} {prepare_seconds:>10.2f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['round_trips']:>6.1f} "
+              f"{result['commands']:>6.0f} {result['candidates']:>6.0f} "
+              f"{result['hit_rate']:>9.3f} {result['recall']:>7.3f} {result['coverage']:>9.3f} "
+              f"{result['random_hit_rate']:>11.3f} {result['random_recall']:>11.3f}")
+
+
+if __name__ == "__main__":
+    main()
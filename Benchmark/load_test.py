@@ -0,0 +1,73 @@
+""" Concurrent load test reporting latency percentiles per endpoint
+
+Start the API (e.g. `MODE=test uvicorn main:app --workers 1`) and run
+
+    python -m Benchmark.load_test --base-url http://localhost:8000 \
+        --path /GetChallengeDetailsPartB/1 --path /GetPost/1 --concurrency 50
+
+Run it once against the previous build and once against the current one to
+compare p99 latency before and after a change. Pass --token when the server
+is not running with MODE=test. Without Postgres, serve each build with
+Benchmark.serve_sqlite; README.md has the numbers of the async database layer.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from Benchmark.common import percentile
+
+
+def run_load(base_url: str, paths: list, total_requests: int, concurrency: int,
+             token: str = None) -> dict:
+    """ Fire total_requests spread across paths; return latencies (ms) per path """
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def one_request(index: int):
+        path = paths[index % len(paths)]
+        start = time.perf_counter()
+        response = session.get(f"{base_url}{path}", headers=headers, timeout=60)
+        return path, (time.perf_counter() - start) * 1000, response.status_code
+
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for path, elapsed_ms, status_code in pool.map(one_request, range(total_requests)):
+            latencies[path].append(elapsed_ms)
+            if status_code >= 500:
+                errors[path] += 1
+    return {"latencies": latencies, "errors": errors}
+
+
+def main():
+    """ Run the load test and print a latency table """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--path", action="append", dest="paths", required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--token", default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = run_load(args.base_url, args.paths, args.requests,
+                      args.concurrency, args.token)
+    wall = time.perf_counter() - start
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"{args.requests / wall:.1f} req/s")
+    print(f"{'path':<45} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'5xx':>5}")
+    for path, samples in result["latencies"].items():
+        print(f"{path:<45} {percentile(samples, 50):>9.1f} "
+              f"{percentile(samples, 95):>9.1f} {percentile(samples, 99):>9.1f} "
+              f"{result['errors'][path]:>5}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+""" Serve the API on a seeded SQLite file, for load tests without Postgres
+
+get_db (and get_async_db, where the build has it) are pointed at a SQLite
+file seeded with one challenge, its members, posts and reactions. Every SQL
+statement first sleeps --statement-latency-ms, standing in for the round
+trip to Postgres: on the sync engine that sleep holds whichever thread runs
+the endpoint, on the async engine it runs in aiosqlite's thread and leaves
+the event loop free. Redis is the one configured for the API.
+
+    python -m Benchmark.serve_sqlite --port 8000 --posts 200
+    python -m Benchmark.load_test --path /GetPost/1 --path /GetChallenge/1
+
+Check out another build (git worktree) and run its copy of this script on
+another port to compare the two under the same load.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import Benchmark.common  # noqa: F401  pylint: disable=unused-import
+# pylint: disable=wrong-import-order
+import uvicorn
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+import models
+from main import app
+
+
+def seed(session_factory, posts: int, members: int):
+    """ One challenge with members, and posts with a content and two reactions """
+    db = session_factory()
+    db.add(models.Emoji(emoji_image="🔥", name="fire"))
+    db.add(models.Emoji(emoji_image="👍", name="thumbs up"))
+    for user_id in range(1, members + 1):
+        db.add(models.User(id=user_id, firebase_uid=f"uid{user_id}", name=f"name{user_id}",
+                           username=f"user{user_id}", user_timezone="Australia/Sydney"))
+    db.add(models.Challenge(id=1, title="t", description="d", duration=30,
+                            breaking_days=3, is_public=True, category=0,
+                            cover_location="cover", challenge_owner_id=1))
+    for user_id in range(1, members + 1):
+        db.add(models.GroupChallengeMembers(challenge_id=1, user_id=user_id,
+                                            breaking_days_left=3, days_left=30))
+    now = datetime.now()
+    for post_id in range(1, posts + 1):
+        db.add(models.Post(id=post_id, user_id=(post_id % members) + 1, challenge_id=1,
+                           written_text=f"post {post_id}", created_time=now,
+                           start_time=now, end_time=now))
+        db.add(models.PostContent(post_id=post_id, image_location=f"img{post_id}"))
+        db.add(models.PostReaction(post_id=post_id, emoji_image="🔥", count=post_id))
+        db.add(models.PostReaction(post_id=post_id, emoji_image="👍", count=1))
+    db.commit()
+    db.close()
+
+
+def add_statement_latency(engine, seconds: float):
+    """ Sleep before every statement the engine runs """
+    def before_cursor_execute(*_args):
+        time.sleep(seconds)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def main():
+    """ Seed the database, override the session dependencies and serve """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--members", type=int, default=5)
+    parser.add_argument("--statement-latency-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "api.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False},
+                           pool_size=40, max_overflow=0)
+    database.Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    seed(session_factory, args.posts, args.members)
+    add_statement_latency(engine, args.statement_latency_ms / 1000)
+
+    def get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[database.get_db] = get_db
+    if hasattr(database, "get_async_db"):
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        add_statement_latency(async_engine.sync_engine, args.statement_latency_ms / 1000)
+        async_session_factory = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        async def get_async_db():
+            async with async_session_factory() as db:
+                yield db
+
+        app.dependency_overrides[database.get_async_db] = get_async_db
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import CRUD.user as crud_user
@@ -38,6 +40,13 @@ def get_blocked_user_list(db:Session, blocker_user_id:int):
         final_user_id_list.append(user.blocked_user_id)
     return final_user_id_list
 
+async def get_blocked_user_list_async(db: AsyncSession, blocker_user_id: int):
+    """ Read blocked user id list by blocker user id """
+    result = await db.execute(
+        select(models.BlockedUserList.blocked_user_id)
+        .where(models.BlockedUserList.blocker_user_id == blocker_user_id))
+    return list(result.scalars().all())
+
 def delete_blocked_user(db:Session, blocker_user_id:int, blocked_user_id: int):
     """ Delete blocked user relationship by blocker user id & blocked user id """
     db_blocked_user = db.query(models.BlockedUserList)\
@@ -5,16 +5,18 @@ from typing import List
 
 import pytz
 from fastapi import HTTPException, status
-from sqlalchemy import func
+from sqlalchemy import (Column, Integer, MetaData, Table, and_, exists,
+                        func, insert, select, update)
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import CRUD.course as course_crud
-import CRUD.post_content as post_content_crud
-import CRUD.post_reaction as reaction_crud
+import CRUD.reaction_counts as counts_crud
 import models
 import schemas
 from CRUD.course import read_course_by_id
-from CRUD.user import read_user_by_id
+from CRUD.user import read_user_by_id, read_user_by_id_async
+from database import chunked, load, stream_rows
 from redis_client import redis_client
 
 TIMEZONE_MAPPING = {
@@ -24,6 +26,18 @@ TIMEZONE_MAPPING = {
     "Beijing": ["Asia/Shanghai"]
 }
 
+BREAK_POST_TEXT = "I have a break today!"
+DISCOVER_PAGE_SIZE = 20
+MAX_DISCOVER_PAGE_SIZE = 100
+
+# Today's posted (challenge_id, user_id) pairs, loaded from Redis per job run
+posted_today_table = Table(
+    "posted_today", MetaData(),
+    Column("challenge_id", Integer, primary_key=True),
+    Column("user_id", Integer, primary_key=True),
+    prefixes=["TEMPORARY"],
+)
+
 
 def create_challenge(db: Session, challenge: schemas.ChallengeCreate):
     """ Create a new challenge """
@@ -69,8 +83,28 @@ def get_challenge(db: Session, challenge_id: int):
     Raises:
         HTTPException: challenge not found
     """
-    challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == challenge_id).first()
+    challenge = load(db, models.Challenge, challenge_id)
+    if challenge is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
+    return challenge
+
+
+async def get_challenge_async(db: AsyncSession, challenge_id: int):
+    """read challenge by id
+
+    Args:
+        challenge_id: id of challenge
+
+    Returns:
+        challenge
+
+    Raises:
+        HTTPException: challenge not found
+    """
+    result = await db.execute(
+        select(models.Challenge).where(models.Challenge.id == challenge_id))
+    challenge = result.scalars().first()
     if challenge is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
@@ -119,12 +153,22 @@ def get_challenge_by_user_id_and_challenge_id(db: Session, user_id: int, challen
     return current_challenge
 
 
-def update_breaking_days_for_specific_challenges(db: Session, timezone_str: str):
-    """ Update breaking days for all challenges """
-    timezones = TIMEZONE_MAPPING.get(
-        timezone_str[0], ["UTC"])  # Get the current date string
-    current_time = datetime.now(pytz.timezone(
-        timezones[0]))    # Get the current time
+def update_breaking_days_for_specific_challenges(db: Session, timezone_str):
+    """ Update breaking days for all challenges
+
+    Args:
+        timezone_str: user timezone, or list of user timezones, to process
+
+    Returns:
+        summary: number of break posts created and challenges failed per timezone
+    """
+    if isinstance(timezone_str, str):
+        # a mapping key such as "Sydney", or a full timezone name
+        user_timezones = TIMEZONE_MAPPING.get(timezone_str, [timezone_str])
+    else:
+        user_timezones = list(timezone_str)
+    # the timezones of one bucket share a date, so the first one gives today
+    current_time = datetime.now(pytz.timezone(user_timezones[0]))
     current_date_str = current_time.strftime(
         '%Y-%m-%d')        # Get the current date string
 
@@ -132,57 +176,98 @@ def update_breaking_days_for_specific_challenges(db: Session, timezone_str: str)
     redis_key = f"posted_challenges:{current_date_str}"
     posted_combinations = {combo.decode('utf-8')
                            for combo in redis_client.smembers(redis_key)}
-    # Get all challenges
-    all_challenge_members = db.query(models.GroupChallengeMembers).all()
-
-    # Iterate over all group_challenge_members
-    for group_member in all_challenge_members:
-        challenge_id = group_member.challenge_id
-        # Generates a composite key to check if it exists in Redis
-        combo_key = f"{challenge_id}_{group_member.user_id}"
-        check_user_timezone = db.query(models.User)\
-            .filter(models.User.id == group_member.user_id).first()
-
-        # If the composite key is not in the Redis set,
-        # reduce breaking_days_left, days_left, and generate a post record for the user
-        if combo_key not in posted_combinations:
-            if check_user_timezone.user_timezone in timezone_str:
-                if group_member.breaking_days_left > 0:
-                    if group_member.days_left > 0:
-                        group_member.breaking_days_left -= 1
-                        group_member.days_left -= 1
-                        # generate a post record for the user called "I have a break"
-                        db_post = models.Post(
-                            user_id=group_member.user_id,
-                            challenge_id=challenge_id,
-                            created_time=(datetime.now() - timedelta(days=1)),
-                            # change the start time to today at 23:59:59
-                            start_time=(datetime.now() - timedelta(days=1))\
-                            .replace(hour=23, minute=59, second=59),
-                            end_time=(datetime.now() - timedelta(days=1))\
-                            .replace(hour=23, minute=59, second=59),
-                            written_text="I have a break today!",
-                        )
-                        db.add(db_post)
-                        db.commit()
-
-            # If breaking_days_left is -1, mark the challenge as failed
-            elif group_member.breaking_days_left == -1:
-                challenge_to_completed = db.query(models.Challenge)\
-                    .filter_by(id=challenge_id).first()
-                challenge_to_finished = db.query(models.GroupChallengeMembers)\
-                    .filter_by(challenge_id=challenge_id)\
-                    .filter_by(user_id=group_member.user_id).first()
-                marking_condition = challenge_to_completed and \
-                    not challenge_to_completed.is_completed and \
-                    not challenge_to_finished.is_challenge_finished
-                if marking_condition:
-                    challenge_to_finished.is_challenge_finished = True
-                    challenge_to_completed.finished_time = datetime.now()
-                    db.commit()
-
-    # Commit all changes to the database
-    db.commit()
+
+    return apply_breaking_days(db, user_timezones, posted_combinations)
+
+
+def apply_breaking_days(db: Session, user_timezones: List[str], posted_combinations: set):
+    """ Set-based breaking days update, committed once per timezone bucket
+
+    Members who did not post today spend one breaking day and get an
+    "I have a break today!" post; members already at -1 breaking days
+    have their challenge marked as failed.
+
+    Args:
+        user_timezones: user timezones to process, one bucket each
+        posted_combinations: "{challenge_id}_{user_id}" pairs that posted today
+
+    Returns:
+        summary: number of break posts created and challenges failed per timezone
+    """
+    yesterday = datetime.now() - timedelta(days=1)
+    break_time = yesterday.replace(hour=23, minute=59, second=59)
+    posted_rows = []
+    for combo in posted_combinations:
+        challenge_id, user_id = combo.split('_')
+        posted_rows.append(
+            {"challenge_id": int(challenge_id), "user_id": int(user_id)})
+
+    members = models.GroupChallengeMembers
+    not_posted = ~exists().where(
+        posted_today_table.c.challenge_id == members.challenge_id,
+        posted_today_table.c.user_id == members.user_id)
+
+    summary = {}
+    for user_timezone in user_timezones:
+        # The temp table lives on the connection, so refill it per bucket
+        posted_today_table.create(db.connection(), checkfirst=True)
+        for rows in chunked(posted_rows):
+            db.execute(insert(posted_today_table), rows)
+
+        in_bucket = and_(members.user_id == models.User.id,
+                         models.User.user_timezone == user_timezone)
+
+        # Spend a breaking day for every member who did not post today
+        on_break = db.execute(
+            update(members)
+            .where(in_bucket, not_posted,
+                   members.breaking_days_left > 0, members.days_left > 0)
+            .values(breaking_days_left=members.breaking_days_left - 1,
+                    days_left=members.days_left - 1)
+            .returning(members.challenge_id, members.user_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        for rows in chunked(on_break):
+            db.execute(insert(models.Post), [
+                {
+                    "user_id": user_id,
+                    "challenge_id": challenge_id,
+                    "created_time": yesterday,
+                    "start_time": break_time,
+                    "end_time": break_time,
+                    "written_text": BREAK_POST_TEXT,
+                }
+                for challenge_id, user_id in rows
+            ])
+
+        # If breaking_days_left is -1, mark the challenge as failed
+        failed_challenge_ids = db.execute(
+            update(members)
+            .where(in_bucket, not_posted,
+                   members.breaking_days_left == -1,
+                   members.is_challenge_finished.is_(False),
+                   members.challenge_id == models.Challenge.id,
+                   models.Challenge.is_completed.isnot(True))
+            .values(is_challenge_finished=True)
+            .returning(members.challenge_id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        if failed_challenge_ids:
+            db.execute(
+                update(models.Challenge)
+                .where(models.Challenge.id.in_(set(failed_challenge_ids)))
+                .values(finished_time=datetime.now())
+                .execution_options(synchronize_session=False)
+            )
+
+        posted_today_table.drop(db.connection())
+        db.commit()
+        summary[user_timezone] = {
+            "break_posts": len(on_break),
+            "failed_challenges": len(failed_challenge_ids),
+        }
+
+    return summary
 
 
 def get_challenges(db: Session, blocked_user_list: List):
@@ -310,6 +395,49 @@ def get_finished_challenges_by_user_id(
     return finished_challenges
 
 
+async def get_finished_challenges_by_user_id_async(
+        db: AsyncSession, user_id: int) -> List[schemas.ChallengeWithBreakingDays]:
+    """ Read finished challenges list of one user by user id
+
+    Args:
+        user_id: id of user
+
+    Returns:
+        finished_challenges: list of finished challenges
+    """
+    await read_user_by_id_async(db, user_id)  # handle user not found
+    results = await db.execute(
+        select(models.Challenge, models.GroupChallengeMembers)
+        .join(models.GroupChallengeMembers,
+              models.GroupChallengeMembers.challenge_id == models.Challenge.id)
+        .where(models.GroupChallengeMembers.user_id == user_id)
+        .where(models.GroupChallengeMembers.is_challenge_finished)
+    )
+    finished_challenges = []
+    for challenge, group_challenge_members in results:
+        challenge_data = schemas.ChallengeWithBreakingDays(
+            id=challenge.id,
+            title=challenge.title,
+            description=challenge.description,
+            duration=challenge.duration,
+            breaking_days=challenge.breaking_days,
+            is_public=challenge.is_public,
+            category=challenge.category,
+            created_time=challenge.created_time,
+            finished_time=challenge.finished_time,
+            cover_location=challenge.cover_location,
+            challenge_owner_id=challenge.challenge_owner_id,
+            course_id=challenge.course_id,
+            is_completed=challenge.is_completed,
+            days_left=group_challenge_members.days_left,
+            is_group_challenge=challenge.is_group_challenge,
+            breaking_days_left=group_challenge_members.breaking_days_left
+        )
+        finished_challenges.append(challenge_data)
+
+    return finished_challenges
+
+
 def get_challenges_by_course_id(db: Session, course_id: int) -> List[models.Challenge]:
     """ Read challenges list by course id
 
@@ -420,8 +548,7 @@ def get_challenge_durations_by_category(db: Session, user_id: int):
 
 def update_challenge(db: Session, challenge_id: int, challenge: schemas.ChallengeCreate):
     """ Update challenge by id """
-    db_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == challenge_id).first()
+    db_challenge = load(db, models.Challenge, challenge_id)
     if db_challenge is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
@@ -433,13 +560,15 @@ def update_challenge(db: Session, challenge_id: int, challenge: schemas.Challeng
 
 def delete_challenge(db: Session, challenge_id: int):
     """ Delete challenge by id """
-    target_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == challenge_id).first()
+    target_challenge = load(db, models.Challenge, challenge_id)
 
     # If the challenge cannot be found, returns False indicating that the deletion failed.
     if target_challenge is None:
         return False
 
+    post_ids = [post_id for post_id, in db.query(models.Post.id).filter(
+        models.Post.challenge_id == challenge_id)]
+
     db.query(models.UserReactionLog).filter(
         models.UserReactionLog.post_id.in_(
             db.query(models.Post.id).filter(
@@ -473,6 +602,7 @@ def delete_challenge(db: Session, challenge_id: int):
     db.delete(target_challenge)
 
     db.commit()
+    counts_crud.forget_posts(post_ids)
 
     return True
 
@@ -498,8 +628,7 @@ def delete_user_account(db: Session, user_id: int):
                                      user_id).delete(synchronize_session=False)
 
     # delete user
-    target_user = db.query(models.User).filter(
-        models.User.id == user_id).first()
+    target_user = load(db, models.User, user_id)
 
     if target_user is None:
         return False
@@ -531,58 +660,94 @@ def delete_group_challenge_member(db: Session, challenge_id: int, user_id: int):
     return True
 
 
+def get_follower_avatars_by_challenge_ids(db: Session, challenge_ids: List[int]) -> dict:
+    """ Get all followers' avatars of many challenges with one query
+
+    Returns:
+        follower_avatars: {challenge_id: [avatar_location, ...]}
+    """
+    follower_avatars = {challenge_id: [] for challenge_id in challenge_ids}
+    if not challenge_ids:
+        return follower_avatars
+    tracking_rows = (db.query(models.Tracking.challenge_id, models.User.avatar_location)
+                     .join(models.User, models.User.id == models.Tracking.follower_id)
+                     .filter(models.Tracking.challenge_id.in_(challenge_ids))
+                     .order_by(models.Tracking.challenge_id, models.Tracking.id)
+                     .all())
+    for challenge_id, avatar_location in tracking_rows:
+        follower_avatars[challenge_id].append(avatar_location)
+    return follower_avatars
+
+
 def get_all_follower_avatars(db: Session, challenge_id: int):
     """ Get all followers' avatars """
-    tracking_objects = (db.query(models.Challenge, models.Tracking)
-                        .join(models.Tracking, models.Tracking.challenge_id == models.Challenge.id)
-                        .filter(models.Challenge.id == challenge_id)
-                        .all())
-    all_follower_ids = [
-        tracking_object[1].follower_id for tracking_object in tracking_objects]
-    all_follower_avatars = []
-    for i in all_follower_ids:
-        all_follower_avatars.append(read_user_by_id(db, i).avatar_location)
-    return all_follower_avatars
+    return get_follower_avatars_by_challenge_ids(db, [challenge_id])[challenge_id]
 
 
 def get_challenge_process(duration, days_left):
     """ Get the challenge process """
+    if not duration or days_left is None:
+        return None
     challenge_process = days_left / duration
     return challenge_process
 
 
+def discover_challenges_query(db: Session):
+    """ Discover card columns: challenge, owner avatar and the owner's days left """
+    return (
+        db.query(models.Challenge.id, models.Challenge.title,
+                 models.Challenge.cover_location, models.Challenge.duration,
+                 models.Challenge.challenge_owner_id, models.User.avatar_location,
+                 models.GroupChallengeMembers.days_left)
+        .join(models.User, models.Challenge.challenge_owner_id == models.User.id)
+        .outerjoin(models.GroupChallengeMembers,
+                   and_(models.GroupChallengeMembers.challenge_id == models.Challenge.id,
+                        models.GroupChallengeMembers.user_id ==
+                        models.Challenge.challenge_owner_id))
+    )
+
+
+def build_discover_challenge_cards(db: Session, rows) -> list:
+    """ Turn discover query rows into challenge details with follower avatars """
+    follower_avatars = get_follower_avatars_by_challenge_ids(
+        db, [row.id for row in rows])
+    return [
+        {"id": row.id,
+         "title": row.title,
+         "cover_location": row.cover_location,
+         "owner_id": row.challenge_owner_id,
+         "owner_avatar": row.avatar_location,
+         "follow_avatars": follower_avatars[row.id],
+         "challenge_process": get_challenge_process(row.duration, row.days_left),
+         }
+        for row in rows
+    ]
+
+
 def get_discover_challenges_by_id(db: Session, challenge_id: int):
     """ Use challenge_id to get the details of the discover challenge """
-    challenge_query_result = db.query(models.Challenge, models.GroupChallengeMembers, models.User)\
-        .join(models.User, models.Challenge.challenge_owner_id == models.User.id)\
-        .join(models.GroupChallengeMembers,
-              models.Challenge.id == models.GroupChallengeMembers.challenge_id)\
-        .filter(models.Challenge.id == challenge_id).first()
-    challenge_obj, group_challenge_members_obj, user_obj = challenge_query_result[
-        0], challenge_query_result[1], challenge_query_result[2]
-    challenge_process = get_challenge_process(
-        challenge_obj.duration, group_challenge_members_obj.days_left)
-    follower_avatars = get_all_follower_avatars(db, challenge_obj.id)
-    challenge_detail = {"id": challenge_obj.id,
-                        "title": challenge_obj.title,
-                        "cover_location": challenge_obj.cover_location,
-                        "owner_id": user_obj.id,
-                        "owner_avatar": user_obj.avatar_location,
-                        "follow_avatars": follower_avatars,
-                        "challenge_process": challenge_process,
-                        }
-    return challenge_detail
-
-
-def get_discover_challenges(db: Session):
-    """ Returns a list containing detailed information of all discover challenges. """
-    discover_challenges = []
-    challenges = db.query(models.Challenge).filter(
-        models.Challenge.finished_time is not None).all()
-    for challenge in challenges:
-        challenge_detail = get_discover_challenges_by_id(db, challenge.id)
-        discover_challenges.append(challenge_detail)
-    return discover_challenges
+    rows = discover_challenges_query(db)\
+        .filter(models.Challenge.id == challenge_id).all()
+    cards = build_discover_challenge_cards(db, rows)
+    return cards[0] if cards else None
+
+
+def get_discover_challenges(db: Session, limit: int = DISCOVER_PAGE_SIZE, cursor: int = None):
+    """ Returns a page of detailed information of discover challenges, newest first.
+
+    Args:
+        limit: maximum number of challenges on the page
+        cursor: id of the last challenge on the previous page
+
+    Returns:
+        discover_challenges: list of challenge details
+    """
+    query = discover_challenges_query(db)\
+        .filter(models.Challenge.finished_time.is_(None))
+    if cursor is not None:
+        query = query.filter(models.Challenge.id < cursor)
+    rows = query.order_by(models.Challenge.id.desc()).limit(limit).all()
+    return build_discover_challenge_cards(db, rows)
 
 
 def update_challenge_course_id(db: Session, challenge_id: int, course_id: int):
@@ -597,8 +762,7 @@ def update_challenge_course_id(db: Session, challenge_id: int, course_id: int):
         HTTPException: challenge has been already linked to course
     """
     read_course_by_id(db, course_id)  # handle course not found
-    db_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == challenge_id).first()
+    db_challenge = load(db, models.Challenge, challenge_id)
     if db_challenge is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
@@ -649,7 +813,7 @@ def challenge_details_page_first_half_by_challenge_ID(db: Session, challenge_id:
 
 def get_user_name_by_user_id(db: Session, user_id: int):
     """ Get username by user id """
-    result = db.query(models.User).filter(models.User.id == user_id).first()
+    result = load(db, models.User, user_id)
     if result:
         return result.username
     return None
@@ -657,7 +821,7 @@ def get_user_name_by_user_id(db: Session, user_id: int):
 
 def get_name_by_user_id(db: Session, user_id: int):
     """ get name by user id """
-    result = db.query(models.User).filter(models.User.id == user_id).first()
+    result = load(db, models.User, user_id)
     if result:
         return result.name
     return None
@@ -665,59 +829,59 @@ def get_name_by_user_id(db: Session, user_id: int):
 
 def get_owner_avatar_by_user_id(db: Session, user_id: int):
     """ get avatar location by user id """
-    result = db.query(models.User).filter(models.User.id == user_id).first()
+    result = load(db, models.User, user_id)
     if result:
         return result.avatar_location
     return None
 
 
-def reformat_reaction_count_list(db: Session, post_id: int):
-    """ reformat reaction count list """
-    db_reaction = reaction_crud.get_post_reactions_by_post_id(db, post_id)
-    all_reaction_count = []
-    for item in db_reaction:
-        each_block = {
-            item.emoji_image: item.count
-        }
-        all_reaction_count.append(each_block)
-
-    return all_reaction_count
-
-
 def challenge_details_page_second_half_by_challenge_ID(db: Session, challenge_id: int):
-    """ Read first half information need by challenge details page by challenge_id
+    """ Read second half information need by challenge details page by challenge_id
+
+    Served by four queries however many posts the challenge has: posts,
+    their contents, the reactions of the posts whose counts are not in
+    Redis and their authors' usernames.
 
     Args:
         challenge_id: id of challenge
 
     Returns:
-        result: first half information need by challenge details page
-
-    Raises:
-        HTTPException: challenge not found
+        result: posts of the challenge grouped by author username
     """
-    db_post_details = db.query(
-        models.Post, models.PostContent, models.PostReaction, models.GroupChallengeMembers
-    ).join(
-        models.PostContent, models.PostContent.post_id == models.Post.id
-    ).join(
-        models.PostReaction, models.PostReaction.post_id == models.Post.id
-    ).join(
-        models.GroupChallengeMembers, models.GroupChallengeMembers.challenge_id == models.Post.challenge_id
-    ).filter(
-        models.Post.challenge_id == challenge_id
-    ).all()
+    posts = (
+        db.query(models.Post)
+        .filter(models.Post.challenge_id == challenge_id)
+        .order_by(models.Post.created_time)
+        .all()
+    )
+    if not posts:
+        return []
+    post_ids = [post_obj.id for post_obj in posts]
+
+    contents_by_post = {post_id: [] for post_id in post_ids}
+    for post_content_obj in db.query(models.PostContent)\
+            .filter(models.PostContent.post_id.in_(post_ids)).all():
+        contents_by_post[post_content_obj.post_id].append(post_content_obj)
+
+    reactions_by_post = {
+        post_id: [{emoji_image: count} for emoji_image, count in counts.items()]
+        for post_id, counts in counts_crud.get_reaction_counts_many(db, post_ids).items()}
+
+    author_ids = {post_obj.user_id for post_obj in posts}
+    usernames = dict(
+        db.query(models.User.id, models.User.username)
+        .filter(models.User.id.in_(author_ids))
+        .all()
+    )
 
     grouped_posts = {}
-    for item in db_post_details:
-        post_obj, post_content_obj, post_reaction_obj, group_challenge_members_obj = item
-        username = get_user_name_by_user_id(
-            db, group_challenge_members_obj.user_id)
+    for post_obj in posts:
+        username = usernames.get(post_obj.user_id)
         post_data = {
             "id": post_obj.id,
             "written_text": post_obj.written_text,
-            "reactions": reformat_reaction_count_list(db, post_reaction_obj.post_id),
-            "PostContent": post_content_crud.get_post_contents_by_post_id(db, post_content_obj.post_id)
+            "reactions": reactions_by_post[post_obj.id],
+            "PostContent": contents_by_post[post_obj.id],
         }
 
         # Group posts by username
@@ -736,8 +900,7 @@ def challenge_details_page_second_half_by_challenge_ID(db: Session, challenge_id
 
 def compare_created_time_by_challenge_id(db: Session, challenge_id: int):
     """ Compare the created time of the challenge with today's date """
-    target_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == challenge_id).first()
+    target_challenge = load(db, models.Challenge, challenge_id)
     if target_challenge:
         target_challenge_created_time = target_challenge.created_time
         # Compare only the date part of 'created_time' with today's date
@@ -845,8 +1008,7 @@ def get_challenge_info_by_code(db: Session, unique_token: str):
     else:
         return "Can not find the token in redis"
 
-    request_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == request_challenge_id).first()
+    request_challenge = load(db, models.Challenge, request_challenge_id)
 
     return request_challenge
 
@@ -864,8 +1026,7 @@ def join_group_challenge_by_token_and_user_id(db: Session, unique_token: str, us
     else:
         return "Can not find the token in redis"
 
-    request_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == request_challenge_id).first()
+    request_challenge = load(db, models.Challenge, request_challenge_id)
 
     if request_challenge_id and db.query(models.GroupChallengeMembers)\
         .filter(models.GroupChallengeMembers.user_id == user_id)\
@@ -967,8 +1128,7 @@ def get_group_challenge_members(db: Session, challenge_id: int, blocked_user_lis
 
 def check_challenge_owner(db: Session, challenge_id: int, user_id):
     """ Check if the user is the challenge owner or not """
-    db_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == challenge_id).first()
+    db_challenge = load(db, models.Challenge, challenge_id)
     if db_challenge is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
@@ -976,7 +1136,14 @@ def check_challenge_owner(db: Session, challenge_id: int, user_id):
 
 
 def check_user_activity(db: Session):
-    """ Check user activity at 9am, 3pm, and 9pm """
+    """ Check user activity at 9am, 3pm, and 9pm
+
+    Members are streamed in chunks with only the needed columns, so memory
+    stays flat however many challenge members there are.
+
+    Returns:
+        remind_user_list: ids of users with an unfinished challenge not posted today
+    """
     current_time = datetime.now().astimezone(
         pytz.timezone("Australia/Melbourne")).date()
 
@@ -987,18 +1154,15 @@ def check_user_activity(db: Session):
     posted_combinations = {combo.decode('utf-8')
                            for combo in redis_client.smembers(redis_key)}
 
-    # get all challenges members
-    all_challenge_members = db.query(models.GroupChallengeMembers).all()
-    for group_member in all_challenge_members:
-        if not group_member.is_challenge_finished:
-            challenge_id = group_member.challenge_id
-            combo_key = f"{challenge_id}_{group_member.user_id}"
-
-            if combo_key not in posted_combinations:
-                if group_member.breaking_days_left > 0:
-                    remind_user_list.append(group_member.user_id)
-                    print(f"Combo_key: {combo_key}")
-        print(f"Reminder Debug: {remind_user_list}")
-
-        print(f"Redis data:{posted_combinations}")
+    # stream unfinished challenge members who can still take a break
+    members = models.GroupChallengeMembers
+    statement = select(members.challenge_id, members.user_id)\
+        .where(members.is_challenge_finished.is_(False),
+               members.breaking_days_left > 0)
+    for chunk in stream_rows(db, statement):
+        for challenge_id, user_id in chunk:
+            if f"{challenge_id}_{user_id}" not in posted_combinations:
+                remind_user_list.append(user_id)
+    print(f"Reminder Debug: {len(remind_user_list)} members to remind, "
+          f"{len(posted_combinations)} posted today")
     return remind_user_list
@@ -0,0 +1,194 @@
+import json
+import os
+import time
+import uuid
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+import CRUD.challenge as challenge_crud
+import models
+from database import SessionLocal
+from redis_client import redis_client
+
+# challenge ids scored by id, so a page is one ZREVRANGEBYSCORE
+DISCOVER_INDEX_KEY = "discover_challenges"
+# challenge id -> JSON challenge card
+DISCOVER_CARDS_KEY = "discover_cards"
+DISCOVER_BUILT_AT_KEY = "discover_snapshot:built_at"
+DISCOVER_LOCK_KEY = "discover_snapshot:lock"
+# ids of the challenges whose cards changed since the running rebuild started
+DISCOVER_CHANGED_KEY = "discover_snapshot:changed"
+# the rebuild refreshes its lock after every batch, so it only expires when
+# the rebuilding worker died
+DISCOVER_LOCK_SECONDS = 60
+
+# rebuild the snapshot when it is older than this many seconds
+DISCOVER_SNAPSHOT_MAX_AGE = int(
+    os.environ.get("DISCOVER_SNAPSHOT_MAX_AGE", "900"))
+REBUILD_BATCH_SIZE = 500
+
+# KEYS: rebuild lock; ARGV: token of the holder, lock seconds
+# Refreshes the lock's expiry, unless another worker holds it now.
+EXTEND_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+extend_lock_script = redis_client.register_script(EXTEND_LOCK_LUA)
+
+# KEYS: rebuild lock; ARGV: token of the holder
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+release_lock_script = redis_client.register_script(RELEASE_LOCK_LUA)
+
+
+def rebuild_discover_snapshot(db: Session) -> Optional[int]:
+    """ Rebuild the discover snapshot, unless another worker is rebuilding it
+
+    Returns:
+        number of challenge cards in the snapshot, None when the rebuild lock
+        was held or lost
+    """
+    token = uuid.uuid4().hex
+    if not redis_client.set(DISCOVER_LOCK_KEY, token, nx=True, ex=DISCOVER_LOCK_SECONDS):
+        return None
+    try:
+        return build_discover_snapshot(db, token)
+    finally:
+        release_lock_script(keys=[DISCOVER_LOCK_KEY], args=[token], client=redis_client)
+
+
+def rebuild_with_new_session() -> Optional[int]:
+    """ rebuild_discover_snapshot on a session of its own, for a background task """
+    db = SessionLocal()
+    try:
+        return rebuild_discover_snapshot(db)
+    finally:
+        db.close()
+
+
+def build_discover_snapshot(db: Session, lock_token: str = None) -> Optional[int]:
+    """ Build the whole discover snapshot and swap it in atomically
+
+    Cards refreshed or removed while the snapshot is built are recorded in
+    DISCOVER_CHANGED_KEY and refreshed again once it is swapped in, so the
+    swap does not bring back their older versions.
+
+    Args:
+        lock_token: token of the rebuild lock, refreshed after every batch;
+            the rebuild is abandoned when another worker took the lock
+
+    Returns:
+        number of challenge cards in the snapshot, None when abandoned
+    """
+    tmp_index_key = f"{DISCOVER_INDEX_KEY}:rebuild"
+    tmp_cards_key = f"{DISCOVER_CARDS_KEY}:rebuild"
+    redis_client.delete(tmp_index_key, tmp_cards_key, DISCOVER_CHANGED_KEY)
+
+    card_count = 0
+    cursor = None
+    while True:
+        cards = challenge_crud.get_discover_challenges(
+            db, limit=REBUILD_BATCH_SIZE, cursor=cursor)
+        if not cards:
+            break
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zadd(tmp_index_key, {card["id"]: card["id"] for card in cards})
+        pipe.hset(tmp_cards_key, mapping={
+            card["id"]: json.dumps(card) for card in cards})
+        pipe.execute()
+        card_count += len(cards)
+        cursor = cards[-1]["id"]
+        if lock_token and not extend_lock_script(
+                keys=[DISCOVER_LOCK_KEY], args=[lock_token, DISCOVER_LOCK_SECONDS],
+                client=redis_client):
+            redis_client.delete(tmp_index_key, tmp_cards_key)
+            return None
+
+    pipe = redis_client.pipeline(transaction=True)
+    if card_count:
+        pipe.rename(tmp_index_key, DISCOVER_INDEX_KEY)
+        pipe.rename(tmp_cards_key, DISCOVER_CARDS_KEY)
+    else:
+        pipe.delete(DISCOVER_INDEX_KEY, DISCOVER_CARDS_KEY)
+    pipe.set(DISCOVER_BUILT_AT_KEY, time.time())
+    pipe.smembers(DISCOVER_CHANGED_KEY)
+    pipe.delete(DISCOVER_CHANGED_KEY)
+    changed = pipe.execute()[-2]
+    # changes made after the swap went to the live keys already
+    for challenge_id in changed:
+        refresh_discover_card(db, int(challenge_id))
+    return card_count
+
+
+def record_changed_card(pipe, challenge_id: int) -> None:
+    """ Queue the note that a card changed, for a rebuild running meanwhile """
+    pipe.sadd(DISCOVER_CHANGED_KEY, challenge_id)
+    pipe.expire(DISCOVER_CHANGED_KEY, DISCOVER_SNAPSHOT_MAX_AGE)
+
+
+def refresh_discover_card(db: Session, challenge_id: int) -> None:
+    """ Rewrite one challenge's card, or drop it once the challenge is finished """
+    rows = challenge_crud.discover_challenges_query(db)\
+        .filter(models.Challenge.id == challenge_id)\
+        .filter(models.Challenge.finished_time.is_(None)).all()
+    if not rows:
+        remove_discover_card(challenge_id)
+        return
+    card = challenge_crud.build_discover_challenge_cards(db, rows)[0]
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zadd(DISCOVER_INDEX_KEY, {challenge_id: challenge_id})
+    pipe.hset(DISCOVER_CARDS_KEY, challenge_id, json.dumps(card))
+    record_changed_card(pipe, challenge_id)
+    pipe.execute()
+
+
+def remove_discover_card(challenge_id: int) -> None:
+    """ Remove a challenge from the discover snapshot """
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.zrem(DISCOVER_INDEX_KEY, challenge_id)
+    pipe.hdel(DISCOVER_CARDS_KEY, challenge_id)
+    record_changed_card(pipe, challenge_id)
+    pipe.execute()
+
+
+def get_discover_page(db: Session, limit: int, cursor: int = None,
+                      background_tasks=None) -> list:
+    """ Read a page of discover challenges from the snapshot, newest first
+
+    A snapshot older than DISCOVER_SNAPSHOT_MAX_AGE is still served; its
+    rebuild is added to background_tasks, and only one worker rebuilds at a
+    time. Until the first snapshot exists, pages are read from the database.
+
+    Args:
+        limit: number of challenges per page
+        cursor: id of the last challenge on the previous page
+        background_tasks: FastAPI BackgroundTasks running a needed rebuild
+
+    Returns:
+        discover_challenges: list of challenge details
+    """
+    upper_bound = f"({cursor}" if cursor is not None else "+inf"
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(DISCOVER_BUILT_AT_KEY)
+    pipe.zrevrangebyscore(DISCOVER_INDEX_KEY, upper_bound, "-inf",
+                          start=0, num=limit)
+    built_at, challenge_ids = pipe.execute()
+
+    is_stale = built_at is None or \
+        time.time() - float(built_at) > DISCOVER_SNAPSHOT_MAX_AGE
+    if is_stale and background_tasks is not None:
+        background_tasks.add_task(rebuild_with_new_session)
+    if built_at is None:
+        return challenge_crud.get_discover_challenges(db, limit=limit, cursor=cursor)
+
+    if not challenge_ids:
+        return []
+    cards = redis_client.hmget(DISCOVER_CARDS_KEY, challenge_ids)
+    return [json.loads(card) for card in cards if card is not None]
@@ -1,8 +1,10 @@
 from fastapi import HTTPException, status
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 import models
 import schemas
+from database import chunked
 
 
 def create_expo_push_token(db: Session, new_token: schemas.ExpoPushTokenBase):
@@ -47,6 +49,16 @@ def get_expo_push_token(db: Session, user_id: int):
     return expo_push_token
 
 
+def get_expo_push_tokens_by_user_ids(db: Session, user_ids) -> set:
+    """ Get the expo push tokens of many users, one IN query per chunk of user ids """
+    tokens = set()
+    for user_id_chunk in chunked(set(user_ids)):
+        tokens.update(db.execute(
+            select(models.ExpoPushToken.expo_push_token)
+            .where(models.ExpoPushToken.user_id.in_(user_id_chunk))).scalars())
+    return tokens
+
+
 def update_expo_push_token(db: Session, token: str, tokenInfo: schemas.ExpoPushTokenBase):
     """ Update expo push token """
     db_token = db.query(models.ExpoPushToken).filter(
@@ -0,0 +1,129 @@
+import datetime
+import os
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+from database import chunked, stream_rows
+from redis_client import redis_client
+
+# post ids scored by their time-decayed reaction count
+POPULAR_POSTS_KEY = "popular_posts"
+# unix time the scores are relative to, reset by every rebuild
+POPULAR_EPOCH_KEY = "popular_posts:epoch"
+
+# a reaction counts half as much after this many seconds
+POPULARITY_HALF_LIFE = int(os.environ.get("POPULARITY_HALF_LIFE", str(2 * 24 * 3600)))
+# reactions older than this are left out of a rebuild
+POPULARITY_WINDOW_DAYS = int(os.environ.get("POPULARITY_WINDOW_DAYS", "7"))
+POPULAR_POSTS_LIMIT = 500
+# a score left below this fraction of the weight just taken away is float
+# residue of the cancelled taps, and the post is removed
+SCORE_RESIDUE = 1e-9
+
+# Scores use forward decay: a reaction at time t adds 2 ** ((t - epoch) / half life).
+# Every score decays by the same factor over time, so the order never has to be
+# recomputed and a reaction is a single ZINCRBY. Scores only grow, so the nightly
+# rebuild moves the epoch forward to keep them small. A cancel is scored at the
+# time of the tap it cancels, so it takes away exactly the weight the tap added.
+# KEYS: popular_posts, popular_posts:epoch
+# ARGV: post id, +1 or -1, unix time of the reaction, half life in seconds, residue fraction
+RECORD_REACTION_LUA = """
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch then
+    epoch = tonumber(ARGV[3])
+    redis.call('SET', KEYS[2], ARGV[3])
+end
+local weight = tonumber(ARGV[2]) * 2 ^ ((tonumber(ARGV[3]) - epoch) / tonumber(ARGV[4]))
+if tonumber(redis.call('ZINCRBY', KEYS[1], weight, ARGV[1])) <= -weight * tonumber(ARGV[5]) then
+    redis.call('ZREM', KEYS[1], ARGV[1])
+end
+"""
+record_reaction_script = redis_client.register_script(RECORD_REACTION_LUA)
+
+
+def decayed_weight(timestamp: float, epoch: float) -> float:
+    """ Weight of a reaction at timestamp, relative to one at epoch """
+    return 2 ** ((timestamp - epoch) / POPULARITY_HALF_LIFE)
+
+
+def log_timestamp(created_datetime: datetime.datetime) -> float:
+    """ Unix time of a reaction log; created_datetime is stored as naive UTC """
+    return created_datetime.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def record_reaction(post_id: int, is_cancelled: bool = False, timestamp: float = None):
+    """ Add a new reaction to the post's score, or take a cancelled one away
+
+    For a cancel, timestamp is the time of the tap being cancelled.
+    """
+    record_reaction_script(
+        keys=[POPULAR_POSTS_KEY, POPULAR_EPOCH_KEY],
+        args=[post_id, -1 if is_cancelled else 1, timestamp or time.time(),
+              POPULARITY_HALF_LIFE, SCORE_RESIDUE],
+        client=redis_client)
+
+
+def record_reaction_log(log: models.UserReactionLog,
+                        previous_log: models.UserReactionLog = None):
+    """ Score a new reaction log
+
+    previous_log is the user's latest log on the post before this one; a
+    cancel takes away the weight of that tap, and is ignored when there is
+    no tap to cancel.
+    """
+    if not log.is_cancelled:
+        record_reaction(log.post_id, timestamp=log_timestamp(log.created_datetime))
+    elif previous_log is not None and not previous_log.is_cancelled:
+        record_reaction(log.post_id, True, log_timestamp(previous_log.created_datetime))
+
+
+def rebuild_popular_posts(db: Session, now: float = None) -> int:
+    """ Recompute the ranking from the recent reaction logs and swap it in atomically
+
+    Each user's logs on a post are replayed in order, so a cancel drops the
+    tap it cancels, and the ranking scores the taps still standing.
+
+    Returns:
+        number of posts in the ranking
+    """
+    now = now or time.time()
+    since = datetime.datetime.fromtimestamp(now, datetime.timezone.utc).replace(tzinfo=None) \
+        - datetime.timedelta(days=POPULARITY_WINDOW_DAYS)
+    statement = select(
+        models.UserReactionLog.post_id, models.UserReactionLog.user_id,
+        models.UserReactionLog.created_datetime, models.UserReactionLog.is_cancelled
+    ).where(models.UserReactionLog.created_datetime >= since) \
+        .order_by(models.UserReactionLog.created_datetime, models.UserReactionLog.log_id)
+
+    # (post id, user id) -> unix time of the tap still standing
+    taps = {}
+    for chunk in stream_rows(db, statement):
+        for post_id, user_id, created_datetime, is_cancelled in chunk:
+            if is_cancelled:
+                taps.pop((post_id, user_id), None)
+            else:
+                taps[post_id, user_id] = log_timestamp(created_datetime)
+    scores = {}
+    for (post_id, _), timestamp in taps.items():
+        scores[post_id] = scores.get(post_id, 0) + decayed_weight(timestamp, now)
+
+    tmp_key = f"{POPULAR_POSTS_KEY}:rebuild"
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(tmp_key)
+    if scores:
+        for batch in chunked(scores.items()):
+            pipe.zadd(tmp_key, dict(batch))
+        pipe.rename(tmp_key, POPULAR_POSTS_KEY)
+    else:
+        pipe.delete(POPULAR_POSTS_KEY)
+    pipe.set(POPULAR_EPOCH_KEY, now)
+    pipe.execute()
+    return len(scores)
+
+
+def get_popular_posts(limit: int = POPULAR_POSTS_LIMIT) -> list:
+    """ Post ids of the most popular recent posts, most popular first """
+    return [int(post_id) for post_id in redis_client.zrevrange(POPULAR_POSTS_KEY, 0, limit - 1)]
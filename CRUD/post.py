@@ -3,13 +3,16 @@ from typing import List
 
 import pytz
 from fastapi import HTTPException, status
-from sqlalchemy import desc, func
+from sqlalchemy import desc, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import CRUD.blocked_user_list as block_crud
+import CRUD.reaction_counts as reaction_counts
 import models
 import schemas
 from CRUD.user import read_user_by_id
+from database import load
 from redis_client import redis_client
 
 
@@ -64,8 +67,7 @@ def create_post(db: Session, post: schemas.PostCreate):
 
         return db_post
 
-    challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == post.challenge_id).first()
+    challenge = load(db, models.Challenge, post.challenge_id)
     current_challenge_member_DL_and_BDL = (
         db.query(models.GroupChallengeMembers)
         .filter(models.GroupChallengeMembers.challenge_id == post.challenge_id)
@@ -128,23 +130,15 @@ def create_post(db: Session, post: schemas.PostCreate):
 
 
 def get_user_timezone_by_user_id(db: Session, user_id: int):
-    """ Read challenges list by course id
+    """ Read the timezone of a user
 
     Args:
-        course_id: id of course
+        user_id: id of user
 
     Returns:
-        challenges_with_course_id: list of challenges
-
-    Raises:
-        HTTPException: Course not found
+        user_timezone: timezone name of the user
     """
-    user_timezone_with_course_id = (
-        db.query(models.User)
-        .filter(models.User.id == user_id)
-        .first().user_timezone
-    )
-    return user_timezone_with_course_id
+    return load(db, models.User, user_id).user_timezone
 
 
 def get_post(db: Session, post_id: int):
@@ -159,7 +153,28 @@ def get_post(db: Session, post_id: int):
     Raises:
         HTTPException: post not found
     """
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
+    post = load(db, models.Post, post_id)
+    if post is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
+    return post
+
+
+async def get_post_async(db: AsyncSession, post_id: int):
+    """ Return the post by post id
+
+    Args:
+        post_id (int): post id
+
+    Returns:
+        post: post object
+
+    Raises:
+        HTTPException: post not found
+    """
+    result = await db.execute(
+        select(models.Post).where(models.Post.id == post_id))
+    post = result.scalars().first()
     if post is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
@@ -260,8 +275,7 @@ def get_posts_by_challenge_id(
         HTTPException: post not found
         HTTPException: challenge not found
     """
-    challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == challenge_id).first()
+    challenge = load(db, models.Challenge, challenge_id)
     if challenge is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
@@ -277,9 +291,36 @@ def get_posts_by_challenge_id(
     return final_post_list
 
 
+async def get_posts_by_challenge_id_async(
+        db: AsyncSession, challenge_id: int, blocked_user_list: List) -> List[models.Post]:
+    """ Return the post by challenge id
+
+    Args:
+        challenge_id (int): challenge id
+
+    Returns:
+        post: post object
+
+    Raises:
+        HTTPException: challenge not found
+    """
+    challenge = await db.execute(
+        select(models.Challenge.id).where(models.Challenge.id == challenge_id))
+    if challenge.first() is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
+    challenge_id_posts = await db.execute(
+        select(models.Post)
+        .where(models.Post.challenge_id == challenge_id)
+        .order_by(desc(models.Post.created_time))
+    )
+    return [post_obj for post_obj in challenge_id_posts.scalars()
+            if post_obj.user_id not in blocked_user_list]
+
+
 def update_post(db: Session, post_id: int, post: schemas.PostCreate):
     """ Update post by post id """
-    db_post = db.query(models.Post).filter(models.Post.id == post_id).first()
+    db_post = load(db, models.Post, post_id)
     if db_post is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
@@ -291,12 +332,13 @@ def update_post(db: Session, post_id: int, post: schemas.PostCreate):
 
 def delete_post(db: Session, post_id: int):
     """ Delete post by post id """
-    db_post = db.query(models.Post).filter(models.Post.id == post_id).first()
+    db_post = load(db, models.Post, post_id)
     if db_post is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Post not found")
     db.delete(db_post)
     db.commit()
+    reaction_counts.forget_post(post_id)
     return {"detail": "Post has been deleted"}
 
 
@@ -1,9 +1,12 @@
 from typing import List
 
 from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 import CRUD.post as post_crud
+import CRUD.reaction_counts as counts_crud
 import models
 import schemas
 
@@ -26,19 +29,27 @@ def create_post_reaction(db: Session, post_reaction: schemas.PostReactionCreate)
     db.add(db_post_reaction)
     db.commit()
     db.refresh(db_post_reaction)
+    counts_crud.set_reaction_count(
+        db_post_reaction.post_id, db_post_reaction.emoji_image, db_post_reaction.count)
     return db_post_reaction
 
 
-def get_post_reactions_by_post_id(db: Session, post_id: int) -> List[models.PostReaction]:
-    """ Get post reaction by post id """
+def reaction_rows(post_id: int, counts: dict) -> List[dict]:
+    """ post_reaction rows of a post from its {emoji: count} """
+    return [{"post_id": post_id, "emoji_image": emoji_image, "count": count}
+            for emoji_image, count in counts.items()]
+
+
+def get_post_reactions_by_post_id(db: Session, post_id: int) -> List[dict]:
+    """ Get post reactions by post id, counts served from redis """
     post_crud.get_post(db, post_id)  # check if post exists
-    post_id_post_reactions = db.query(models.PostReaction).filter(
-        # return empty list if not found
-        models.PostReaction.post_id == post_id).all()
-    if post_id_post_reactions is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Post Reaction not found")
-    return post_id_post_reactions
+    return reaction_rows(post_id, counts_crud.get_reaction_counts(db, post_id))
+
+
+async def get_post_reactions_by_post_id_async(db: AsyncSession, post_id: int) -> List[dict]:
+    """ Get post reactions by post id, counts served from redis """
+    await post_crud.get_post_async(db, post_id)  # check if post exists
+    return reaction_rows(post_id, await counts_crud.get_reaction_counts_async(db, post_id))
 
 
 def get_post_reactions(db: Session, skip: int = 0, limit: int = 100):
@@ -56,12 +67,10 @@ def get_post_reaction_by_post_emoji(db: Session, post_id: int, emoji_image: str)
             .filter(models.PostReaction.emoji_image == emoji_image).all() == []:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
                             detail="Post Reaction not found")
-    reaction_post_emoji = (
-        db.query(models.PostReaction)
-        .filter(models.PostReaction.post_id == post_id,
-                models.PostReaction.emoji_image == emoji_image).first()
-    )
-    return reaction_post_emoji
+    count = counts_crud.get_reaction_counts(db, post_id).get(emoji_image)
+    if count is None:
+        return None
+    return {"post_id": post_id, "emoji_image": emoji_image, "count": count}
 
 
 def get_post_reactions_by_emoji_image(db: Session, emoji_image: str) -> List[models.PostReaction]:
@@ -102,6 +111,7 @@ def update_post_reaction(
     for key, value in post_reaction.dict(exclude_unset=True).items():
         setattr(db_post_reaction, key, value)
     db.commit()
+    counts_crud.set_reaction_count(post_id, emoji_image, db_post_reaction.count)
     return db_post_reaction
 
 
@@ -115,34 +125,67 @@ def delete_post_reaction(db: Session, post_id: int, emoji_image: str):
                             detail="Post Reaction not found")
     db.delete(db_post_reaction)
     db.commit()
+    counts_crud.forget_reaction(post_id, emoji_image)
     return {"detail": "Post Reaction has been deleted"}
 
 
 def update_count(db: Session, post_id: int, emoji_image: str, action: bool):
-    """ Update count by post id and emoji image """
-    db_reaction = db.query(models.PostReaction).filter(
-        models.PostReaction.post_id == post_id,
-        models.PostReaction.emoji_image == emoji_image).first()
-    if db_reaction is None:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Post Reaction not found")
-    if action:
-        db_reaction.count += 1
-    else:
-        db_reaction.count -= 1
-    db.commit()
-    return db_reaction
+    """ Update count by post id and emoji image
+
+    The tap is an atomic increment in redis, written to post_reaction by the
+    reaction flusher; the row is only read when the post's counts are not
+    cached yet.
+    """
+    delta = 1 if action else -1
+    not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                              detail="Post Reaction not found")
+    try:
+        count = counts_crud.tap(post_id, emoji_image, delta)
+        if count is None:
+            db_reaction = db.query(models.PostReaction).filter(
+                models.PostReaction.post_id == post_id,
+                models.PostReaction.emoji_image == emoji_image).first()
+            if db_reaction is None:
+                raise not_found
+            count = counts_crud.tap(post_id, emoji_image, delta, verified=True)
+            if count is None:
+                count = db_reaction.count + \
+                    counts_crud.pending_deltas(post_id).get(emoji_image, 0)
+    except counts_crud.ReactionNotFound as exc:
+        raise not_found from exc
+    return {"post_id": post_id, "emoji_image": emoji_image, "count": count}
 
 
 def get_counts_post(db: Session, post_id: int):
     """ Get counts of all emoji images by post id """
-    post_id_post_reactions = db.query(models.PostReaction).filter(
-        models.PostReaction.post_id == post_id).all()
-    if post_id_post_reactions is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                            detail="Post Reaction not found")
-    counts = 0
-    for item in post_id_post_reactions:
-        counts += item.count
-    return counts
+    return sum(counts_crud.get_reaction_counts(db, post_id).values())
+
+
+async def get_counts_post_async(db: AsyncSession, post_id: int):
+    """ Get counts of all emoji images by post id """
+    return sum((await counts_crud.get_reaction_counts_async(db, post_id)).values())
+
+
+def get_counts_challenge(db: Session, challenge_id: int, blocked_user_list: List[int]) -> int:
+    """ Get counts of all reactions on a challenge's posts, without the blocked users' posts """
+    return counts_crud.get_challenge_reaction_totals(
+        db, [challenge_id], {challenge_id: set(blocked_user_list)})[challenge_id]
+
+
+def get_counts_challenges(db: Session, challenge_ids: List[int]) -> dict:
+    """ Get counts of all reactions per challenge for many challenges
+
+    Posts by users the challenge owner blocked are left out, as in
+    get_counts_challenge; unknown challenge ids are left out of the result.
+    """
+    blocked = {}
+    for challenge_id, blocked_user_id in db.execute(
+            select(models.Challenge.id, models.BlockedUserList.blocked_user_id)
+            .outerjoin(models.BlockedUserList,
+                       models.BlockedUserList.blocker_user_id ==
+                       models.Challenge.challenge_owner_id)
+            .where(models.Challenge.id.in_(set(challenge_ids)))):
+        users = blocked.setdefault(challenge_id, set())
+        if blocked_user_id is not None:
+            users.add(blocked_user_id)
+    return counts_crud.get_challenge_reaction_totals(db, list(blocked), blocked)
@@ -0,0 +1,482 @@
+""" Reaction counts kept in Redis and written behind to post_reaction
+
+A tap is one HINCRBY on the post's totals (post_reactions:{post_id}, emoji ->
+count) and one on its pending delta, so concurrent taps never lose an
+update. flush_reaction_counts() moves the pending deltas of the dirty posts
+into post_reaction with INSERT ... ON CONFLICT DO UPDATE SET count = count +
+excluded.count, and seeds the totals of posts that have none yet (a cold
+cache, or after a Redis restart). Only the flusher holding the flush lock
+writes counts to the database, so seeding from the rows it just wrote plus
+the deltas arrived since is exact.
+
+Challenge totals are summed from post_reaction by one SUM ... JOIN post
+GROUP BY challenge_id query, plus the pending deltas of the dirty posts and
+of the posts a flush is writing (post_reactions:flushing_posts).
+
+Totals expire REACTION_COUNTS_TTL seconds after the post's last seed or
+tap, so the posts nobody reads any more leave Redis; an expired post is
+read from post_reaction again and seeded by the next flush.
+
+A flush interrupted between its commit and the deletion of its taken deltas
+applies them again on the next flush; anything else is retried safely.
+"""
+import asyncio
+import logging
+import os
+import uuid
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal, chunked
+from redis_client import async_redis_client, redis_client
+
+# emoji -> count of every post with seeded totals
+REACTIONS_KEY = "post_reactions:{}"
+# emoji -> taps not in post_reaction yet
+DELTA_KEY = "post_reactions:{}:delta"
+# emoji -> taps taken by a flush that has not finished
+FLUSHING_KEY = "post_reactions:{}:flushing"
+# ids of the posts with pending deltas or unseeded totals
+DIRTY_KEY = "post_reactions:dirty"
+# ids of the posts whose taken deltas a flush has not committed yet
+FLUSHING_POSTS_KEY = "post_reactions:flushing_posts"
+FLUSH_LOCK_KEY = "post_reactions:flush_lock"
+
+# seconds between two flushes of the app's flusher, 0 disables it
+REACTION_FLUSH_INTERVAL = float(os.environ.get("REACTION_FLUSH_INTERVAL", "5"))
+# dirty posts taken per flush round trip
+REACTION_FLUSH_BATCH = int(os.environ.get("REACTION_FLUSH_BATCH", "500"))
+FLUSH_LOCK_SECONDS = 60
+# seconds a post's totals are kept after its last seed or tap
+REACTION_COUNTS_TTL = int(os.environ.get("REACTION_COUNTS_TTL", str(7 * 24 * 3600)))
+
+flush_logger = logging.getLogger("reaction_counts.flush")
+
+# KEYS: totals, delta, dirty
+# ARGV: emoji, +1 or -1, post id, 1 when the database row is known to exist,
+#       totals TTL
+# Returns the new count, 0 (as a table) when a seeded post has no such
+# reaction, or nil when the totals are not seeded and the row is unverified.
+TAP_LUA = """
+local seeded = redis.call('EXISTS', KEYS[1]) == 1
+if seeded and redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then
+    return {0}
+end
+if not seeded and ARGV[4] ~= '1' then
+    return nil
+end
+redis.call('HINCRBY', KEYS[2], ARGV[1], ARGV[2])
+redis.call('SADD', KEYS[3], ARGV[3])
+if seeded then
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+return nil
+"""
+tap_script = redis_client.register_script(TAP_LUA)
+
+# KEYS: flushing posts, then the delta and flushing hash of every post, in pairs
+# ARGV: post ids
+# Adds each post's pending delta to its flushing hash (kept from an
+# interrupted flush, if any), marks the post as flushing and returns every
+# flushing hash.
+TAKE_DELTAS_LUA = """
+local taken = {}
+for index = 2, #KEYS, 2 do
+    local delta = redis.call('HGETALL', KEYS[index])
+    for field = 1, #delta, 2 do
+        redis.call('HINCRBY', KEYS[index + 1], delta[field], delta[field + 1])
+    end
+    redis.call('DEL', KEYS[index])
+    taken[#taken + 1] = redis.call('HGETALL', KEYS[index + 1])
+end
+redis.call('SADD', KEYS[1], unpack(ARGV))
+return taken
+"""
+take_deltas_script = redis_client.register_script(TAKE_DELTAS_LUA)
+
+# KEYS: totals, delta
+# ARGV: totals TTL, then emoji, count pairs of the post's rows
+# Sets the totals to the rows plus the taps that arrived after them, unless
+# another writer seeded them first.
+SEED_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local counts = {}
+for index = 2, #ARGV, 2 do
+    counts[ARGV[index]] = tonumber(ARGV[index + 1])
+end
+local delta = redis.call('HGETALL', KEYS[2])
+for index = 1, #delta, 2 do
+    counts[delta[index]] = (counts[delta[index]] or 0) + tonumber(delta[index + 1])
+end
+local fields = {}
+for emoji, count in pairs(counts) do
+    fields[#fields + 1] = emoji
+    fields[#fields + 1] = count
+end
+if #fields == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(fields))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+seed_script = redis_client.register_script(SEED_LUA)
+
+# KEYS: totals, delta, flushing; ARGV: emoji, count in post_reaction
+# Sets a seeded total to the count plus the pending taps; an expired or
+# missing total is left for the next read to seed.
+SET_COUNT_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+local count = tonumber(ARGV[2])
+    + tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or 0)
+    + tonumber(redis.call('HGET', KEYS[3], ARGV[1]) or 0)
+redis.call('HSET', KEYS[1], ARGV[1], count)
+return 1
+"""
+set_count_script = redis_client.register_script(SET_COUNT_LUA)
+
+# KEYS: flush lock; ARGV: token of the holder
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+release_lock_script = redis_client.register_script(RELEASE_LOCK_LUA)
+
+UPSERT_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+
+
+class ReactionNotFound(LookupError):
+    """ The post's seeded totals have no such reaction """
+
+
+def decode_counts(values: dict) -> dict:
+    """ {emoji: count} of a Redis hash """
+    return {emoji.decode("utf-8"): int(count) for emoji, count in values.items()}
+
+
+def tap(post_id: int, emoji_image: str, delta: int, verified: bool = False):
+    """ Add a tap (+1) or a cancelled one (-1) to a reaction
+
+    Returns:
+        the new count, or None when the totals are not seeded: the tap was
+        counted when verified is True, and not counted otherwise
+
+    Raises:
+        ReactionNotFound: the post's seeded totals have no such reaction
+    """
+    result = tap_script(
+        keys=[REACTIONS_KEY.format(post_id), DELTA_KEY.format(post_id), DIRTY_KEY],
+        args=[emoji_image, delta, post_id, int(verified), REACTION_COUNTS_TTL],
+        client=redis_client)
+    if isinstance(result, list):
+        raise ReactionNotFound(emoji_image)
+    return result
+
+
+def pending_deltas(post_id: int) -> dict:
+    """ {emoji: taps} of a post not written to post_reaction yet """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hgetall(DELTA_KEY.format(post_id))
+    pipe.hgetall(FLUSHING_KEY.format(post_id))
+    pending = {}
+    for values in pipe.execute():
+        for emoji, count in decode_counts(values).items():
+            pending[emoji] = pending.get(emoji, 0) + count
+    return pending
+
+
+def add_counts(rows: dict, pending: dict) -> dict:
+    """ Database counts plus pending deltas, for reactions with a row """
+    return {emoji: count + pending.get(emoji, 0) for emoji, count in rows.items()}
+
+
+def get_reaction_counts(db: Session, post_id: int) -> dict:
+    """ {emoji: count} of a post, from Redis when seeded
+
+    An unseeded post is read from post_reaction plus its pending deltas and
+    marked dirty, so the next flush seeds it.
+    """
+    return get_reaction_counts_many(db, [post_id])[post_id]
+
+
+def get_reaction_counts_many(db: Session, post_ids: list) -> dict:
+    """ {post_id: {emoji: count}} of many posts, as get_reaction_counts
+
+    The seeded totals are read in one round trip; the unseeded posts are
+    read by one query per chunk of ids, and their pending deltas in one more
+    round trip.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for post_id in post_ids:
+        pipe.hgetall(REACTIONS_KEY.format(post_id))
+    counts = {}
+    unseeded = []
+    for post_id, values in zip(post_ids, pipe.execute()):
+        if values:
+            counts[post_id] = decode_counts(values)
+        else:
+            unseeded.append(post_id)
+    if not unseeded:
+        return counts
+
+    rows = {post_id: {} for post_id in unseeded}
+    for chunk in chunked(unseeded):
+        for post_id, emoji_image, count in db.execute(
+                select(models.PostReaction.post_id, models.PostReaction.emoji_image,
+                       models.PostReaction.count)
+                .where(models.PostReaction.post_id.in_(chunk))):
+            rows[post_id][emoji_image] = count
+    pipe = redis_client.pipeline(transaction=False)
+    for post_id in unseeded:
+        pipe.hgetall(DELTA_KEY.format(post_id))
+        pipe.hgetall(FLUSHING_KEY.format(post_id))
+    with_rows = [post_id for post_id in unseeded if rows[post_id]]
+    if with_rows:
+        pipe.sadd(DIRTY_KEY, *with_rows)
+    pending = pipe.execute()
+    for index, post_id in enumerate(unseeded):
+        post_pending = decode_counts(pending[2 * index])
+        for emoji, count in decode_counts(pending[2 * index + 1]).items():
+            post_pending[emoji] = post_pending.get(emoji, 0) + count
+        counts[post_id] = add_counts(rows[post_id], post_pending)
+    return counts
+
+
+async def get_reaction_counts_async(db, post_id: int) -> dict:
+    """ get_reaction_counts for async endpoints, on the async Redis client """
+    counts = await async_redis_client.hgetall(REACTIONS_KEY.format(post_id))
+    if counts:
+        return decode_counts(counts)
+    rows = dict((await db.execute(
+        select(models.PostReaction.emoji_image, models.PostReaction.count)
+        .where(models.PostReaction.post_id == post_id))).all())
+    async with async_redis_client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(DELTA_KEY.format(post_id))
+        pipe.hgetall(FLUSHING_KEY.format(post_id))
+        if rows:
+            pipe.sadd(DIRTY_KEY, post_id)
+        delta, flushing = (await pipe.execute())[:2]
+    pending = decode_counts(delta)
+    for emoji, count in decode_counts(flushing).items():
+        pending[emoji] = pending.get(emoji, 0) + count
+    return add_counts(rows, pending)
+
+
+def set_reaction_count(post_id: int, emoji_image: str, count: int):
+    """ Reflect a count written to post_reaction directly in the seeded totals """
+    set_count_script(
+        keys=[REACTIONS_KEY.format(post_id), DELTA_KEY.format(post_id),
+              FLUSHING_KEY.format(post_id)],
+        args=[emoji_image, count], client=redis_client)
+
+
+def forget_reaction(post_id: int, emoji_image: str):
+    """ Drop a deleted reaction's totals and pending taps """
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hdel(REACTIONS_KEY.format(post_id), emoji_image)
+    pipe.hdel(DELTA_KEY.format(post_id), emoji_image)
+    pipe.hdel(FLUSHING_KEY.format(post_id), emoji_image)
+    pipe.execute()
+
+
+def forget_post(post_id: int):
+    """ Drop a deleted post's totals and pending taps """
+    forget_posts([post_id])
+
+
+def forget_posts(post_ids: list):
+    """ Drop the totals and pending taps of deleted posts """
+    for chunk in chunked(post_ids):
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.srem(DIRTY_KEY, *chunk)
+        pipe.srem(FLUSHING_POSTS_KEY, *chunk)
+        for post_id in chunk:
+            pipe.delete(REACTIONS_KEY.format(post_id), DELTA_KEY.format(post_id),
+                        FLUSHING_KEY.format(post_id))
+        pipe.execute()
+
+
+def pending_post_deltas(post_ids: list) -> dict:
+    """ {post_id: taps not in post_reaction yet} of those posts that are dirty or flushing """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.smismember(DIRTY_KEY, post_ids)
+    pipe.smismember(FLUSHING_POSTS_KEY, post_ids)
+    dirty, flushing = pipe.execute()
+    post_ids = [post_id for post_id, is_dirty, is_flushing in zip(post_ids, dirty, flushing)
+                if is_dirty or is_flushing]
+    for post_id in post_ids:
+        pipe.hvals(DELTA_KEY.format(post_id))
+        pipe.hvals(FLUSHING_KEY.format(post_id))
+    values = pipe.execute()
+    pending = {}
+    for index, post_id in enumerate(post_ids):
+        taps = sum(int(count) for count in values[2 * index] + values[2 * index + 1])
+        if taps:
+            pending[post_id] = taps
+    return pending
+
+
+def get_challenge_reaction_totals(db: Session, challenge_ids: list, blocked: dict = None) -> dict:
+    """ {challenge_id: reactions on its posts} of many challenges
+
+    One SUM ... JOIN post GROUP BY challenge_id query per chunk of ids sums
+    post_reaction. While any taps are not flushed yet, one more query lists
+    the chunk's posts, and the pending taps of those posts are added.
+    A post's taps are kept per post, not per challenge, so a tap needs no
+    lookup of its challenge and the blocked authors' taps can be left out.
+
+    Args:
+        blocked: challenge id -> ids of the authors whose posts are left out
+    """
+    blocked = blocked or {}
+    totals = {challenge_id: 0 for challenge_id in challenge_ids}
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.scard(DIRTY_KEY)
+    pipe.scard(FLUSHING_POSTS_KEY)
+    any_pending = any(pipe.execute())
+    for chunk in chunked(totals):
+        for challenge_id, user_id, count in db.execute(
+                select(models.Post.challenge_id, models.Post.user_id,
+                       func.sum(models.PostReaction.count))
+                .join(models.Post, models.Post.id == models.PostReaction.post_id)
+                .where(models.Post.challenge_id.in_(chunk))
+                .group_by(models.Post.challenge_id, models.Post.user_id)):
+            if user_id not in blocked.get(challenge_id, ()):
+                totals[challenge_id] += count
+        if not any_pending:
+            continue
+        posts = {post_id: challenge_id for post_id, challenge_id, user_id in db.execute(
+            select(models.Post.id, models.Post.challenge_id, models.Post.user_id)
+            .where(models.Post.challenge_id.in_(chunk)))
+            if user_id not in blocked.get(challenge_id, ())}
+        for post_chunk in chunked(posts):
+            for post_id, taps in pending_post_deltas(post_chunk).items():
+                totals[posts[post_id]] += taps
+    return totals
+
+
+def upsert_deltas(db: Session, rows: list):
+    """ Add {post_id, emoji_image, count} deltas to post_reaction in one statement """
+    insert = UPSERT_INSERTS[db.get_bind().dialect.name]
+    statement = insert(models.PostReaction).values(rows)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[models.PostReaction.post_id, models.PostReaction.emoji_image],
+        set_={"count": models.PostReaction.count + statement.excluded["count"]}))
+
+
+def seed_totals(db: Session, post_ids: list):
+    """ Seed the totals of the posts that have none from post_reaction """
+    pipe = redis_client.pipeline(transaction=False)
+    for post_id in post_ids:
+        pipe.exists(REACTIONS_KEY.format(post_id))
+    unseeded = [post_id for post_id, exists in zip(post_ids, pipe.execute()) if not exists]
+    if not unseeded:
+        return
+    rows = {}
+    for post_id, emoji_image, count in db.execute(
+            select(models.PostReaction.post_id, models.PostReaction.emoji_image,
+                   models.PostReaction.count)
+            .where(models.PostReaction.post_id.in_(unseeded))):
+        rows.setdefault(post_id, []).extend([emoji_image, count])
+    for post_id in unseeded:
+        seed_script(keys=[REACTIONS_KEY.format(post_id), DELTA_KEY.format(post_id)],
+                    args=[REACTION_COUNTS_TTL, *rows.get(post_id, [])], client=redis_client)
+
+
+def flush_batch(db: Session, post_ids: list) -> int:
+    """ Write the pending deltas of some dirty posts and seed their totals
+
+    Taps on posts deleted meanwhile are dropped, so they cannot fail the batch.
+    """
+    existing = set(db.scalars(select(models.Post.id).where(models.Post.id.in_(post_ids))))
+    forget_posts([post_id for post_id in post_ids if post_id not in existing])
+    post_ids = [post_id for post_id in post_ids if post_id in existing]
+    if not post_ids:
+        return 0
+    keys = []
+    for post_id in post_ids:
+        keys += [DELTA_KEY.format(post_id), FLUSHING_KEY.format(post_id)]
+    taken = take_deltas_script(keys=[FLUSHING_POSTS_KEY, *keys], args=post_ids,
+                               client=redis_client)
+
+    rows = []
+    for post_id, values in zip(post_ids, taken):
+        for emoji, count in zip(values[::2], values[1::2]):
+            if int(count):
+                rows.append({"post_id": post_id, "emoji_image": emoji.decode("utf-8"),
+                             "count": int(count)})
+    try:
+        for chunk in chunked(rows):
+            upsert_deltas(db, chunk)
+        db.commit()
+    except Exception:
+        db.rollback()
+        # the taken deltas stay in the flushing hashes for the next flush
+        redis_client.sadd(DIRTY_KEY, *post_ids)
+        raise
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(*keys[1::2])
+    pipe.srem(FLUSHING_POSTS_KEY, *post_ids)
+    pipe.execute()
+    seed_totals(db, post_ids)
+    return len(rows)
+
+
+def flush_reaction_counts(db: Session) -> int:
+    """ Write every pending delta to post_reaction, unless another flusher is running
+
+    Returns:
+        number of (post, emoji) rows written, -1 when the lock was held
+    """
+    token = uuid.uuid4().hex
+    if not redis_client.set(FLUSH_LOCK_KEY, token, nx=True, ex=FLUSH_LOCK_SECONDS):
+        return -1
+    written = 0
+    try:
+        # posts tapped during the flush wait for the next one, so a steady
+        # stream of taps cannot keep a flush running past its lock
+        remaining = redis_client.scard(DIRTY_KEY)
+        while remaining > 0:
+            post_ids = [int(post_id) for post_id in
+                        redis_client.spop(DIRTY_KEY, min(remaining, REACTION_FLUSH_BATCH)) or []]
+            if not post_ids:
+                break
+            remaining -= len(post_ids)
+            written += flush_batch(db, post_ids)
+        return written
+    finally:
+        release_lock_script(keys=[FLUSH_LOCK_KEY], args=[token], client=redis_client)
+
+
+def flush_with_new_session() -> int:
+    """ flush_reaction_counts on a session of its own, for the background flusher """
+    db = SessionLocal()
+    try:
+        return flush_reaction_counts(db)
+    finally:
+        db.close()
+
+
+async def run_flusher(interval: float = None):
+    """ Flush every interval seconds until cancelled, then flush once more """
+    interval = interval or REACTION_FLUSH_INTERVAL
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(flush_with_new_session)
+            except Exception:  # pylint: disable=broad-except
+                flush_logger.exception("reaction flush failed")
+    finally:
+        await asyncio.to_thread(flush_with_new_session)
@@ -5,6 +5,7 @@ import models
 import schemas
 from CRUD.challenge import get_challenge
 from CRUD.user import read_user_by_id
+from database import load, load_many
 
 
 def create_tracking(db: Session, tracking: schemas.TrackingsRequest):
@@ -21,8 +22,7 @@ def create_tracking(db: Session, tracking: schemas.TrackingsRequest):
         HTTPException: follower not found
         HTTPException: This user is not the owner of this challenge
     """
-    db_challenge = db.query(models.Challenge).filter(
-        models.Challenge.id == tracking.challenge_id).first()
+    db_challenge = load(db, models.Challenge, tracking.challenge_id)
     if db_challenge.challenge_owner_id != tracking.owner_id:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail="This user is not the owner of this challenge")
@@ -77,13 +77,8 @@ def read_follower_by_challenge_id(db: Session, challenge_id: int):
         .order_by(models.Tracking.created_time)\
         .filter(models.Tracking.challenge_id == challenge_id).limit(10).all()
     follower_ids = [record[1].follower_id for record in challenge_tracking]
-    result = []
-    for follower_id in follower_ids:
-        follower_user = db.query(models.User).filter(
-            models.User.id == follower_id).first()
-        follower_avatar = follower_user.avatar_location
-        result.append(follower_avatar)
-    return result
+    followers = load_many(db, models.User, follower_ids)
+    return [followers[follower_id].avatar_location for follower_id in follower_ids]
 
 
 def read_activated_tracking_challenge_data_by_follower_id(db: Session, follower_id: int):
@@ -1,8 +1,11 @@
 from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import models
 import schemas
+from database import load
 
 
 def create_user(db: Session, user: schemas.UsersRequest):
@@ -30,8 +33,18 @@ def read_users(db: Session):
 
 def read_user_by_id(db: Session, user_id: int):
     """ Read user by id """
-    user = db.query(models.User)\
-        .filter(models.User.id == user_id).first()
+    user = load(db, models.User, user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    return user
+
+
+async def read_user_by_id_async(db: AsyncSession, user_id: int):
+    """ Read user by id """
+    result = await db.execute(
+        select(models.User).where(models.User.id == user_id))
+    user = result.scalars().first()
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
@@ -50,7 +63,7 @@ def read_user_by_firebase_uid(db: Session, firebase_uid: str):
 
 def update_user(db: Session, user_id: int, user: schemas.UsersRequest):
     """ Update user """
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = load(db, models.User, user_id)
     if db_user is None:
         return None
     db.query(models.User).filter(models.User.id == id).update(
@@ -93,7 +106,7 @@ def update_user_is_complete(db: Session, firebase_uid: str, user: schemas.UsersR
 
 def delete_user(db: Session, user_id: int):
     """ Delete user by id """
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = load(db, models.User, user_id)
     if db_user is None:
         return None
     db.query(models.User).filter(models.User.id == user_id).delete()
@@ -15,6 +15,7 @@ import CRUD.course as course_crud
 import CRUD.user as user_crud
 from auth_dependencies import conditional_depends, verify_token
 from database import get_db
+from metrics import external_call
 
 load_dotenv()
 
@@ -80,7 +81,8 @@ def upload_user_avatar(user_id: int, file: UploadFile, db: Session = Depends(get
                         aws_secret_access_key=f"{os.environ['AWS_SECRET_ACCESS_KEY']}")
     user_id_as_file_name = f"avatars/{user_id}/{file.filename.split('.')[0]}.jpeg"
     bucket = s3.Bucket(S3_BUCKET_NAME)
-    bucket.put_object(Key=user_id_as_file_name, Body=compressed_image)
+    with external_call("s3"):
+        bucket.put_object(Key=user_id_as_file_name, Body=compressed_image)
 
     upload_file_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{user_id_as_file_name}"
 
@@ -95,7 +97,8 @@ def upload_photos(file: UploadFile):
 
     bucket = s3.Bucket(S3_BUCKET_NAME)
     new_file_name = "avatars/" + file.filename
-    bucket.upload_fileobj(file.file, new_file_name)
+    with external_call("s3"):
+        bucket.upload_fileobj(file.file, new_file_name)
     upload_file_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{new_file_name}"
 
     return upload_file_url
@@ -151,7 +154,8 @@ def upload_challenger_cover(
                         aws_secret_access_key=f"{os.environ['AWS_SECRET_ACCESS_KEY']}")
     user_id_as_file_name = f"challenge_covers/{challenge_id}/{file.filename.split('.')[0]}.jpeg"
     bucket = s3.Bucket(S3_BUCKET_NAME)
-    bucket.put_object(Key=user_id_as_file_name, Body=compressed_image)
+    with external_call("s3"):
+        bucket.put_object(Key=user_id_as_file_name, Body=compressed_image)
 
     upload_file_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{user_id_as_file_name}"
 
@@ -208,7 +212,8 @@ def upload_course_cover(
                         aws_secret_access_key=f"{os.environ['AWS_SECRET_ACCESS_KEY']}")
     user_id_as_file_name = f"course_covers/{course_id}/{file.filename.split('.')[0]}.jpeg"
     bucket = s3.Bucket(S3_BUCKET_NAME)
-    bucket.put_object(Key=user_id_as_file_name, Body=compressed_image)
+    with external_call("s3"):
+        bucket.put_object(Key=user_id_as_file_name, Body=compressed_image)
 
     upload_file_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{user_id_as_file_name}"
 
@@ -265,7 +270,8 @@ def upload_post_cover(
 
     def upload_to_s3(s3_resource, bucket_name, key, data):
         bucket = s3_resource.Bucket(bucket_name)
-        bucket.put_object(Key=key, Body=data)
+        with external_call("s3"):
+            bucket.put_object(Key=key, Body=data)
         return f"https://{bucket_name}.s3.amazonaws.com/{key}"
 
     challenge_crud.get_challenge(db, challenge_id)  # check if challenge exists
@@ -3,14 +3,21 @@ import datetime
 import pytz
 from fastapi import APIRouter, Depends, status
 from fastapi.responses import JSONResponse
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
 
 import models
-from database import get_db
+from database import get_db, stream_rows
+from r1_automation import contribution_key, parse_watermark, settled_members_filter
 from redis_client import redis_client
+from redis_codec import decode_clg_info, encode_clg_info
+from Router.post import build_recommendation_feeds
 
 router = APIRouter()
 
+# hash of the last processed primary key of every stage
+WATERMARK_KEY = 'rs_watermark'
+
 
 def decoding(item, str_split_symbol=None, error_result=None) -> str or list:  # type: ignore
     """
@@ -27,66 +34,121 @@ def decoding(item, str_split_symbol=None, error_result=None) -> str or list:  #
     return item
 
 
+def get_watermark(db: Session, stage: str, key_columns: list) -> tuple:
+    """
+    return the last processed primary key of a stage from rs_watermark.
+    a stage without a watermark starts after the first db_len rows.
+    """
+    watermark = decoding(redis_client.hget(WATERMARK_KEY, stage), str_split_symbol=',')
+    if watermark:
+        return parse_watermark(db, watermark, key_columns)
+
+    processed = int(decoding(redis_client.hget('db_len', stage), error_result=0))
+    last_row = None
+    if processed:
+        last_row = db.query(*key_columns).order_by(*key_columns)\
+            .offset(processed - 1).first() or \
+            db.query(*key_columns)\
+            .order_by(*[column.desc() for column in key_columns]).first()
+    return tuple(last_row) if last_row else (0,) * len(key_columns)
+
+
+def new_rows_in_chunks(db: Session, columns: list, stage: str, key_columns: list, where=None):
+    """
+    stream the needed columns of the rows after the stage's watermark
+    in key order, in chunks, optionally filtered by where.
+    """
+    watermark = get_watermark(db, stage, key_columns)
+    if len(key_columns) == 1:
+        after_watermark = key_columns[0] > watermark[0]
+    else:
+        after_watermark = tuple_(*key_columns) > tuple_(*watermark)
+    statement = select(*columns).where(after_watermark).order_by(*key_columns)
+    if where is not None:
+        statement = statement.where(where)
+    return stream_rows(db, statement)
+
+
+def set_watermark(pipe, stage: str, last_row, key_columns: list) -> None:
+    """
+    queue the stage's watermark on the chunk's transactional pipeline,
+    so it commits together with the chunk's writes.
+    """
+    pipe.hset(WATERMARK_KEY, stage, ','.join(
+        str(getattr(last_row, column.key)) for column in key_columns))
+
+
+def hmget_decoded(key: str, fields: list, str_split_symbol=None, decoder=None) -> dict:
+    """
+    read many hash fields in one round trip, skipping missing ones.
+    binary encoded values are read with a redis_codec decoder instead.
+    """
+    fields = list(dict.fromkeys(fields))
+    if not fields:
+        return {}
+    values = redis_client.hmget(key, fields)
+    return {field: decoder(value) if decoder else
+            decoding(value, str_split_symbol=str_split_symbol)
+            for field, value in zip(fields, values) if value}
+
+
 def add_new_ongoing_challenges_to_redis(db: Session) -> int:
     """
     this function iterate through all newly created challenges. 
     it then stores category, is_public and date info to redis.
     """
-    clg_len = decoding(redis_client.hget('db_len', 'clg'),
-                       error_result=0)
-    challenge = db.query(models.Challenge).offset(clg_len)
+    key_columns = [models.Challenge.id]
 
     clg_count = 0
 
-    for instance in challenge:
-        clg_count += 1
+    for chunk in new_rows_in_chunks(
+            db, [models.Challenge.id, models.Challenge.category, models.Challenge.is_public,
+                 models.Challenge.duration, models.Challenge.created_time],
+            'clg', key_columns):
+        clg_count += len(chunk)
 
-        challenge_id = instance.id
-        category = instance.category
-        is_public = instance.is_public
-        duration = instance.duration
-        done_by = (instance.created_time +
-                   datetime.timedelta(days=duration)).strftime("%Y-%m-%d")
+        clg_info = {}
+        for instance in chunk:
+            done_by = instance.created_time + datetime.timedelta(days=instance.duration)
+            clg_info[instance.id] = encode_clg_info(
+                instance.category, instance.is_public, instance.duration, done_by)
 
-        redis_client.hset('on_clg_info', challenge_id,
-                          f'{category},{is_public},{duration},{done_by}')
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hset('on_clg_info', mapping=clg_info)
+        set_watermark(pipe, 'clg', chunk[-1], key_columns)
+        pipe.execute()
 
     return clg_count
 
 
 def update_challenge_distribution_for_users(db: Session) -> int:
-    """ Update user contribution based on the challenge category """
-
-    mmbr_len = decoding(redis_client.hget('db_len', 'mmbr'), error_result=0)
-    member = db.query(models.GroupChallengeMembers).offset(mmbr_len)
+    """
+    Update user contribution based on the challenge category.
+    members are read by (created_time, challenge_id, user_id), so a user
+    joining an older challenge is picked up too.
+    """
+    key_columns = [models.GroupChallengeMembers.created_time,
+                   models.GroupChallengeMembers.challenge_id,
+                   models.GroupChallengeMembers.user_id]
 
     mmbr_count = 0
 
-    for instance in member:
-        mmbr_count += 1
-
-        clg_id = instance.challenge_id
-        clg_detail = decoding(redis_client.hget(
-            'on_clg_info', clg_id), str_split_symbol=',', error_result=[])
-
-        if not clg_detail:
-            continue
-
-        category = int(clg_detail[0])
-        duration = int(clg_detail[2])
-
-        user_id = instance.user_id
-
-        # get user's current contribution
-        contribution = decoding(redis_client.hget(
-            'user_contribution', user_id), str_split_symbol=',', error_result=['0']*5)
+    for chunk in new_rows_in_chunks(db, key_columns, 'mmbr', key_columns,
+                                    where=settled_members_filter(db)):
+        mmbr_count += len(chunk)
 
-        # modify user contribution according to the challenge's category
-        contribution[category] = str(int(contribution[category]) + duration)
-        contribution = ','.join(contribution)
+        clg_details = hmget_decoded(
+            'on_clg_info', [instance.challenge_id for instance in chunk], decoder=decode_clg_info)
+        ongoing = [instance for instance in chunk if clg_details.get(instance.challenge_id)]
 
-        # update change to redis
-        redis_client.hset('user_contribution', user_id, contribution)
+        # increment users' contribution in place, one field per category
+        pipe = redis_client.pipeline(transaction=True)
+        for instance in ongoing:
+            clg_detail = clg_details[instance.challenge_id]
+            pipe.hincrby(contribution_key(instance.user_id),
+                         clg_detail.category, clg_detail.duration)
+        set_watermark(pipe, 'mmbr', chunk[-1], key_columns)
+        pipe.execute()
 
     return mmbr_count
 
@@ -104,8 +166,7 @@ def classify_new_posts_by_challenge_category(db: Session) -> tuple:
         redis_client.zremrangebyscore(key_name, day, day)
 
     # retrieve new post records from data base
-    post_len = decoding(redis_client.hget('db_len', 'post'), error_result=0)
-    post = db.query(models.Post).offset(post_len)
+    key_columns = [models.Post.id]
 
     # if challenge is finished, then we should remove it from the ongoing challenge list.
     challenge_to_be_removed = []
@@ -113,69 +174,79 @@ def classify_new_posts_by_challenge_category(db: Session) -> tuple:
     # record the number of posts being processed
     post_count = 0
 
-    for instance in post:
-        post_count += 1
-
-        # get data for challenge_id, post_id, is_breaking_day
-        challenge_id = instance.challenge_id
-        post_id = instance.id
-        is_breaking_day = False
-        if instance.written_text == 'I have a break today.':
-            is_breaking_day = True
-
-        # get challenge detail
-        clg_detail = decoding(redis_client.hget(
-            'on_clg_info', challenge_id), str_split_symbol=',')
-
-        if not clg_detail:
-            raise ValueError("post not belong to any challenge")
-        category, is_public, _, finished_date = clg_detail
-        category = int(category)
-        finished_date = datetime.datetime.strptime(
-            finished_date[:], '%Y-%m-%d')
-
-        # add public, non-break post to the list
-        if is_public and not is_breaking_day:
-            redis_client.zadd(f'recent_posts_for_category{category}', {
-                              post_id: DAYS_BACK})
-            # useful in recommend_post_from_interacted_challenges()
-            redis_client.hset('post_clg_pair', post_id, challenge_id)
-
-        # check whether we should remove this challenge
-        if finished_date == DATE_TODAY:
-            challenge_to_be_removed.append(challenge_id)
+    for chunk in new_rows_in_chunks(
+            db, [models.Post.id, models.Post.challenge_id, models.Post.written_text],
+            'post', key_columns):
+        post_count += len(chunk)
+
+        # get challenge details
+        clg_details = hmget_decoded(
+            'on_clg_info', [instance.challenge_id for instance in chunk], decoder=decode_clg_info)
+
+        pipe = redis_client.pipeline(transaction=True)
+        for instance in chunk:
+            # get data for challenge_id, post_id, is_breaking_day
+            challenge_id = instance.challenge_id
+            post_id = instance.id
+            is_breaking_day = False
+            if instance.written_text == 'I have a break today.':
+                is_breaking_day = True
+
+            clg_detail = clg_details.get(challenge_id)
+            if not clg_detail:
+                raise ValueError("post not belong to any challenge")
+            category, is_public, _, finished_date = clg_detail
+
+            # add public, non-break post to the list
+            if is_public and not is_breaking_day:
+                pipe.zadd(f'recent_posts_for_category{category}', {
+                    post_id: DAYS_BACK})
+                # useful in recommend_post_from_interacted_challenges()
+                pipe.hset('post_clg_pair', post_id, challenge_id)
+
+            # check whether we should remove this challenge
+            if finished_date == DATE_TODAY:
+                challenge_to_be_removed.append(challenge_id)
+        set_watermark(pipe, 'post', chunk[-1], key_columns)
+        pipe.execute()
     return post_count, challenge_to_be_removed
 
 
 def process_recent_reaction_data(db: Session) -> tuple:
     """ Process recent reaction data and update user's liked posts and clgs preference """
-    reaction_len = decoding(redis_client.hget(
-        'db_len', 'reaction'), error_result=0)
-    reaction = db.query(models.UserReactionLog).offset(reaction_len)
+    key_columns = [models.UserReactionLog.log_id]
 
     reaction_count = 0
 
-    for instance in reaction:
-        reaction_count += 1
+    for chunk in new_rows_in_chunks(
+            db, [models.UserReactionLog.log_id, models.UserReactionLog.post_id,
+                 models.UserReactionLog.user_id, models.UserReactionLog.is_cancelled],
+            'reaction', key_columns):
+        reaction_count += len(chunk)
 
         # if user reacted to a completed clg, then skip it
-        post_id = instance.post_id
+        post_clg_pair = hmget_decoded(
+            'post_clg_pair', [instance.post_id for instance in chunk])
 
-        clg_id = int(decoding(redis_client.hget(
-            'post_clg_pair', post_id), error_result='-1'))
-        if clg_id == -1:
-            continue
+        pipe = redis_client.pipeline(transaction=True)
+        for instance in chunk:
+            post_id = instance.post_id
+            if post_id not in post_clg_pair:
+                continue
+            clg_id = int(post_clg_pair[post_id])
 
-        is_cancelled = instance.is_cancelled
-        user_id = instance.user_id
+            is_cancelled = instance.is_cancelled
+            user_id = instance.user_id
 
-        # update {user_id}_liked_posts and {user_id}_clgs_preference
-        if is_cancelled:
-            redis_client.zincrby(str(user_id)+'_clgs_preference', -0.6, clg_id)
-            continue
+            # update {user_id}_liked_posts and {user_id}_clgs_preference
+            if is_cancelled:
+                pipe.zincrby(str(user_id)+'_clgs_preference', -0.6, clg_id)
+                continue
 
-        redis_client.sadd(str(user_id)+'_liked_posts', post_id)
-        redis_client.zincrby(str(user_id)+'_clgs_preference', 1, clg_id)
+            pipe.sadd(str(user_id)+'_liked_posts', post_id)
+            pipe.zincrby(str(user_id)+'_clgs_preference', 1, clg_id)
+        set_watermark(pipe, 'reaction', chunk[-1], key_columns)
+        pipe.execute()
 
     return reaction_count
 
@@ -189,10 +260,11 @@ DAY_INDEX = int(decoding(redis_client.hget('rs_param', 'day_index'), error_resul
 DAY_INDEX = str(DAY_INDEX % DAYS_BACK)
 
 @router.get("/UpdateRecommendation/", status_code=status.HTTP_200_OK)
-async def update_recommendation(db: Session = Depends(get_db)):
+def update_recommendation(db: Session = Depends(get_db)):
     """ Update recommendation data in redis """
     update_challenge_distribution_for_users(db=db)
     classify_new_posts_by_challenge_category(db=db)
     process_recent_reaction_data(db=db)
+    build_recommendation_feeds()
 
     return JSONResponse(status_code=status.HTTP_200_OK, content={"detail": "Recommendation updated successfully"})
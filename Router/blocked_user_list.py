@@ -11,7 +11,7 @@ router = APIRouter(prefix="/blocked_user")
 
 @router.post("/create",
              response_model=schemas.BlockUserListBase, status_code=status.HTTP_201_CREATED)
-async def create_blocked_user(
+def create_blocked_user(
         blocked_user: schemas.BlockUserListBase, db: Session = Depends(get_db)):
     """ Create a new blocked user relationship """
     blocked_user = crud.create_blocked_user(db=db, blocked_user=blocked_user)
@@ -20,7 +20,7 @@ async def create_blocked_user(
 
 @router.get("/getBlockedUser/{blocker_user_id}/{blocked_user_id}",
             response_model=schemas.BlockUserListBase)
-async def get_blocked_user(
+def get_blocked_user(
         blocker_user_id: int, blocked_user_id: int, db: Session = Depends(get_db)):
     """ Get blocked user relationship by blocker user id & blocked user id """
     blocked_user = crud.get_blocked_user(
@@ -29,7 +29,7 @@ async def get_blocked_user(
 
 
 @router.get("/getBlockedUserList/{blocker_user_id}")
-async def get_blocked_user_list(blocker_user_id: int, db: Session = Depends(get_db)):
+def get_blocked_user_list(blocker_user_id: int, db: Session = Depends(get_db)):
     """ Get blocked user list by blocker user id """
     blocker_user_list = crud.get_blocked_user_list(
         db=db, blocker_user_id=blocker_user_id)
@@ -38,7 +38,7 @@ async def get_blocked_user_list(blocker_user_id: int, db: Session = Depends(get_
 
 @router.delete("/deleteBlockedUser/{blocker_user_id}/{blocked_user_id}",
                status_code=status.HTTP_204_NO_CONTENT)
-async def delete_blocked_user(
+def delete_blocked_user(
         blocker_user_id: int, blocked_user_id: int, db: Session = Depends(get_db)):
     """ Delete blocked user relationship by blocker user id & blocked user id """
     if not crud.delete_blocked_user(
@@ -49,7 +49,7 @@ async def delete_blocked_user(
 
 
 @router.get("/getBlockedUserInfoList/{blocker_user_id}")
-async def get_blocked_user_info_list(blocker_user_id: int, db: Session = Depends(get_db)):
+def get_blocked_user_info_list(blocker_user_id: int, db: Session = Depends(get_db)):
     """ Get blocked user info list by blocker user id """
     user_info_list = crud.get_username_avatar(
         db=db, blocker_user_id=blocker_user_id)
@@ -1,17 +1,19 @@
 # pylint: disable=unused-argument
 
-from typing import List
+from typing import List, Optional
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, status
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import CRUD.blocked_user_list as block_crud
 import CRUD.challenge as challenge_crud
+import CRUD.discover as discover_crud
 import schemas
-from auth_dependencies import conditional_depends, verify_token
-from database import get_db
+from auth_dependencies import conditional_depends, verify_admin, verify_token
+from database import get_async_db, get_db
 
 load_dotenv()
 
@@ -27,16 +29,18 @@ TIMEZONE_MAPPING = {
 
 @router.post("/CreateChallenge/", response_model=schemas.ChallengeRead,
              status_code=status.HTTP_201_CREATED)
-async def create_challenge_route(
+def create_challenge_route(
         challenge: schemas.ChallengeCreate, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Create challenge """
-    return challenge_crud.create_challenge(db=db, challenge=challenge)
+    new_challenge = challenge_crud.create_challenge(db=db, challenge=challenge)
+    discover_crud.refresh_discover_card(db, new_challenge.id)
+    return new_challenge
 
 
 @router.get("/GetChallenge/{challenge_id}", response_model=schemas.ChallengeRead)
 async def get_challenge_route(
-        challenge_id: int, db: Session = Depends(get_db),
+        challenge_id: int, db: AsyncSession = Depends(get_async_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read challenge by id
 
@@ -49,7 +53,7 @@ async def get_challenge_route(
     Raises:
         HTTPException: challenge not found
     """
-    challenge = challenge_crud.get_challenge(db=db, challenge_id=challenge_id)
+    challenge = await challenge_crud.get_challenge_async(db=db, challenge_id=challenge_id)
     if challenge is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
@@ -58,7 +62,7 @@ async def get_challenge_route(
 
 @router.get("/GetChallengeByUserIdAndChallengeId/{user_id}/{challenge_id}",
             response_model=schemas.ChallengeRead)
-async def get_challenge_by_user_and_challenge_route(
+def get_challenge_by_user_and_challenge_route(
         user_id: int, challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read challenge by challenge id and user id
@@ -97,12 +101,14 @@ def test_update_breaking_days(timezone: str, db: Session = Depends(get_db)):
 
     challenge_crud.update_breaking_days_for_specific_challenges(
         db, full_timezone_str)
+    # progress moved for every active challenge, so rebuild rather than patch
+    discover_crud.rebuild_discover_snapshot(db)
     return {"message": f"Breaking days updated successfully for timezone {timezone}"}
 
 
 @router.get("/GetUserChallenges/{user_id}",
             response_model=List[List[schemas.ChallengeWithBreakingDays]])
-async def get_user_challenges_route(
+def get_user_challenges_route(
         user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read all challenges of one user by user id
@@ -124,7 +130,7 @@ async def get_user_challenges_route(
 
 
 @router.get("/GetUserLastChallenges{user_id}", response_model=schemas.ChallengeRead)
-async def get_user_last_challenge(
+def get_user_last_challenge(
         user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read last challenge of one user by user id
@@ -144,7 +150,7 @@ async def get_user_last_challenge(
 
 @router.get("/GetUserActiveChallenges/{user_id}",
             response_model=List[schemas.ChallengeWithBreakingDays])
-async def get_user_active_challenges_route(
+def get_user_active_challenges_route(
         user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read active challenges list of one user by user id
@@ -164,7 +170,7 @@ async def get_user_active_challenges_route(
 
 
 @router.get("/GetChallengesWithCourseID/{course_id}", response_model=List[schemas.ChallengeRead])
-async def get_challenge_course_id(
+def get_challenge_course_id(
         course_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read challenges list by course id
@@ -186,7 +192,7 @@ async def get_challenge_course_id(
 @router.get("/GetUserFinishedChallenges/{user_id}",
             response_model=List[schemas.ChallengeWithBreakingDays])
 async def get_user_finished_challenges_route(
-        user_id: int, db: Session = Depends(get_db),
+        user_id: int, db: AsyncSession = Depends(get_async_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read finished challenges list of one user by user id
 
@@ -199,13 +205,13 @@ async def get_user_finished_challenges_route(
     Raises:
         HTTPException: user not found
     """
-    finished_challenges = challenge_crud.get_finished_challenges_by_user_id(
+    finished_challenges = await challenge_crud.get_finished_challenges_by_user_id_async(
         db, user_id)
     return finished_challenges
 
 
 @router.get("/GetAllChallenges/{user_id}", response_model=list[schemas.ChallengeRead])
-async def get_challenges_route(user_id: int, db: Session = Depends(get_db),
+def get_challenges_route(user_id: int, db: Session = Depends(get_db),
                                current_user: dict = conditional_depends(depends=verify_token)):
     """ Read all challenges of one user by user id """
     blocked_user_list = block_crud.get_blocked_user_list(
@@ -216,7 +222,7 @@ async def get_challenges_route(user_id: int, db: Session = Depends(get_db),
 
 @router.get("/GetBreakingDaysLeftByUserIdAndChallengeId/{user_id}/{challenge_id}",
             response_model=schemas.GroupChallengeMembersRead)
-async def get_challenge_breaking_days_left(
+def get_challenge_breaking_days_left(
         user_id: int, challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read challenge breaking days left by user id and challenge id
@@ -237,7 +243,7 @@ async def get_challenge_breaking_days_left(
 
 @router.put("/UpdateChallenge/{challenge_id}",
             response_model=schemas.ChallengeRead)
-async def update_challenge_route(
+def update_challenge_route(
         challenge_id: int, challenge: schemas.ChallengeCreate, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Update challenge by challenge id """
@@ -246,24 +252,26 @@ async def update_challenge_route(
     if updated_challenge is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
+    discover_crud.refresh_discover_card(db, challenge_id)
     return updated_challenge
 
 
 @router.delete("/DeleteChallenge/{challenge_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_challenge_route(
+def delete_challenge_route(
         challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Delete challenge by challenge id """
     if not challenge_crud.delete_challenge(db=db, challenge_id=challenge_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Challenge not found")
+    discover_crud.remove_discover_card(challenge_id)
     return JSONResponse(
         status_code=status.HTTP_200_OK,
         content={"detail": "Challenge deleted successfully"})
 
 
 @router.delete("/DeleteUserAccount/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_user_account(
+def delete_user_account(
         user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Delete user account by user id """
@@ -277,7 +285,7 @@ async def delete_user_account(
 
 @router.delete("/DeleteGroupChallengeMember/{challenge_id}/{user_id}",
                status_code=status.HTTP_204_NO_CONTENT)
-async def delete_group_challenge_member_route(
+def delete_group_challenge_member_route(
         challenge_id: int, user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Delete group challenge member by challenge id and user id
@@ -299,7 +307,7 @@ async def delete_group_challenge_member_route(
 
 
 @router.get("/SetInvitationCodeByChallengeID/{challenge_id}")
-async def generate_invitation_code(
+def generate_invitation_code(
         challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Generate invitation code by challenge_id
@@ -316,7 +324,7 @@ async def generate_invitation_code(
 
 
 @router.get("/GetChallengeInfoByInvitationCode/{unique_token}")
-async def get_challenge_info_by_invitation_code(
+def get_challenge_info_by_invitation_code(
         unique_token: str, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get challenge information by invitation code """
@@ -326,7 +334,7 @@ async def get_challenge_info_by_invitation_code(
 
 
 @router.post("/JoinGroupChallengeByInvite/{user_id}/{token}")
-async def invitation(
+def invitation(
         token: str, user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Join group challenge by invitation code """
@@ -336,16 +344,48 @@ async def invitation(
 
 
 @router.get("/GetDiscoverChallenges/")
-async def get_discover_challenges(
-        db: Session = Depends(get_db),
+def get_discover_challenges(
+        background_tasks: BackgroundTasks,
+        limit: int = Query(challenge_crud.DISCOVER_PAGE_SIZE, ge=1,
+                           le=challenge_crud.MAX_DISCOVER_PAGE_SIZE),
+        cursor: Optional[int] = None, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
-    """ Read discover challenges """
-    discover_challenges = challenge_crud.get_discover_challenges(db)
+    """ Read discover challenges, newest first
+
+    A stale snapshot is served while it is rebuilt after the response.
+
+    Args:
+        limit: number of challenges per page
+        cursor: id of the last challenge on the previous page
+
+    Returns:
+        discover_challenges: list of challenge details
+    """
+    discover_challenges = discover_crud.get_discover_page(
+        db, limit=limit, cursor=cursor, background_tasks=background_tasks)
     return discover_challenges
 
 
+@router.post("/admin/RebuildDiscoverSnapshot/")
+def rebuild_discover_snapshot(
+        db: Session = Depends(get_db),
+        current_user: dict = conditional_depends(depends=verify_admin)):
+    """ Force a full rebuild of the discover challenges snapshot
+
+    raise HTTPException: 409 when another worker is rebuilding it
+
+    Returns:
+        number of challenges in the rebuilt snapshot
+    """
+    challenge_count = discover_crud.rebuild_discover_snapshot(db)
+    if challenge_count is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="The discover snapshot is being rebuilt")
+    return {"challenge_count": challenge_count}
+
+
 @router.get("/GetChallengeDetailsPartA/{challenge_id}")
-async def get_challenge_details_first_half(
+def get_challenge_details_first_half(
         challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read first half information need by challenge details page by challenge_id
@@ -365,7 +405,7 @@ async def get_challenge_details_first_half(
 
 
 @router.get("/GetChallengeDetailsPartB/{challenge_id}")
-async def get_challenge_details_second_half(
+def get_challenge_details_second_half(
         challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read second half information need by challenge details page by challenge_id
@@ -403,7 +443,7 @@ def get_challenge_category_distribution(
 
 
 @router.get("/GetChallengeCard/{challenge_id}")
-async def get_challenge_card(
+def get_challenge_card(
         challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read information need by challenge card by challenge_id
@@ -422,7 +462,7 @@ async def get_challenge_card(
 
 
 @router.get("/GetGroupChallengeMembers/{challenge_id}/{user_id}")
-async def get_group_challenge_members(
+def get_group_challenge_members(
         challenge_id: int, user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read group challenge members by challenge_id
@@ -446,7 +486,7 @@ async def get_group_challenge_members(
 
 
 @router.get("/CheckOwner/{challenge_id}")
-async def check_challenge_owner(
+def check_challenge_owner(
         challenge_id: int, user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Check if the user is the owner of the challenge """
@@ -457,7 +497,7 @@ async def check_challenge_owner(
 
 @router.get("/GetUserChallengesWithToken_Testing/{user_id}",
             response_model=List[List[schemas.ChallengeWithBreakingDays]])
-async def get_user_challenges_route_with_token(user_id: int, db: Session = Depends(get_db)):
+def get_user_challenges_route_with_token(user_id: int, db: Session = Depends(get_db)):
     """ Read all challenges of one user by user id
 
     Args:
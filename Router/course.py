@@ -15,7 +15,7 @@ router = APIRouter(prefix="/courses")
 
 
 @router.get("", response_model=List[schemas.CourseResponse])
-async def get_course_data(
+def get_course_data(
         db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read all courses from database
@@ -28,7 +28,7 @@ async def get_course_data(
 
 
 @router.get("/{id}", response_model=schemas.CourseResponse)
-async def get_course_by_id(
+def get_course_by_id(
         course_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Read course by id
@@ -49,7 +49,7 @@ async def get_course_by_id(
 
 
 @router.put("/LinkCourseChallenge/{course_id}/{challenge_id}", response_model=schemas.ChallengeRead)
-async def update_challenge_course_id(
+def update_challenge_course_id(
         course_id: int, challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Update challenge course_id by challenge id and course id
@@ -12,14 +12,14 @@ router = APIRouter(prefix="/expo_token")
 
 @router.post("/create", response_model=schemas.ExpoPushTokenBase,
              status_code=status.HTTP_201_CREATED)
-async def create_expo_token(token: schemas.ExpoPushTokenBase, db: Session = Depends(get_db)):
+def create_expo_token(token: schemas.ExpoPushTokenBase, db: Session = Depends(get_db)):
     """ Create new expo push token """
     token = crud.create_expo_push_token(db=db, new_token=token)
     return token
 
 
 @router.get("/{user_id}", response_model=schemas.ExpoPushTokenBase)
-async def get_token_by_user_id(
+def get_token_by_user_id(
         user_id: int, db: Session = Depends(get_db)):
     """ Get expo push token by user id """
     token = crud.get_expo_push_token(db=db, user_id=user_id)
@@ -27,7 +27,7 @@ async def get_token_by_user_id(
 
 
 @router.put("/updateToken/{token}", response_model=schemas.ExpoPushTokenBase)
-async def update_expo_push_token(
+def update_expo_push_token(
         token: str, token_info: schemas.ExpoPushTokenBase,
         db: Session = Depends(get_db)):
     """ Update expo push token """
@@ -37,7 +37,7 @@ async def update_expo_push_token(
 
 
 @router.delete("/deleteTokenByUserId/{token}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_token(token: str, db: Session = Depends(get_db)):
+def delete_token(token: str, db: Session = Depends(get_db)):
     """ Delete expo push token """
     if not crud.delete_token_by_token(db=db, token=token):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -48,7 +48,7 @@ async def delete_token(token: str, db: Session = Depends(get_db)):
 
 
 @router.delete("/delete/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_token_user_id(user_id: int, db: Session = Depends(get_db)):
+def delete_token_user_id(user_id: int, db: Session = Depends(get_db)):
     """ Delete expo push token by user id """
     if not crud.delete_token_uid(db=db, uid=user_id):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+import auth_dependencies
+from database import get_pool_stats
+
+router = APIRouter()
+
+
+class StatsCollector:
+    """ Export the pool and token cache stats kept by other modules """
+
+    def collect(self):
+        pool = GaugeMetricFamily("db_pool", "Connection pool state and checkout telemetry",
+                                 labels=["engine", "stat"])
+        for engine, stats in get_pool_stats().items():
+            for stat, value in stats.items():
+                pool.add_metric([engine, stat], value)
+        yield pool
+
+        tokens = CounterMetricFamily("token_cache_lookups", "verify_token cache lookups",
+                                     labels=["result"])
+        for result in ("hits", "redis_hits", "misses"):
+            tokens.add_metric([result], auth_dependencies.token_cache_stats[result])
+        yield tokens
+
+
+REGISTRY.register(StatsCollector())
+
+
+@router.get("/metrics")
+def get_metrics():
+    """ Metrics of this process in the Prometheus text format """
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 
 import CRUD.challenge as crud_challenge
 import CRUD.expo_push_token as crud_token
+from metrics import external_call
 
 session = requests.Session()
 
@@ -27,12 +28,7 @@ session.headers.update(
 def get_push_tokens(db: Session):
     """ Get expo push tokens for user who do not complete daily post """
     user_id_list = crud_challenge.check_user_activity(db=db)
-    tokens = set()
-    for user_id in user_id_list:
-        token = crud_token.get_expo_push_token(db=db, user_id=user_id)
-        if token is not None:
-            tokens.add(token.expo_push_token)
-    return tokens
+    return crud_token.get_expo_push_tokens_by_user_ids(db=db, user_ids=user_id_list)
 
 
 def push_message_array(tokens):
@@ -51,8 +47,9 @@ def push_message_array(tokens):
 def send_push_notification(push_messages, db: Session):
     """ Send push notification to users who have not complete daily challenge """
     try:
-        push_tickets = PushClient(session=session).publish_multiple(
-            push_messages=push_messages)
+        with external_call("expo"):
+            push_tickets = PushClient(session=session).publish_multiple(
+                push_messages=push_messages)
     except PushServerError:  # Check if there's any error when sending message to Expo server
         raise ConnectionError('Invalid server response')
     except (ConnectionError, HTTPError) as exc:
@@ -82,7 +79,8 @@ def validate_receipts(push_tickets, db: Session):
         return token
 
     push_client = PushClient(session=session)
-    receipts = push_client.check_receipts_multiple(push_tickets=push_tickets)
+    with external_call("expo"):
+        receipts = push_client.check_receipts_multiple(push_tickets=push_tickets)
     for r in receipts:
         try:
             r.validate_response()
@@ -1,127 +1,204 @@
 # pylint: disable=unused-argument
 
 import os
-import random
+import time
 from datetime import datetime
 from typing import List
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import CRUD.blocked_user_list as block_crud
+import CRUD.discover as discover_crud
 import CRUD.post as post_crud
 import schemas
 from auth_dependencies import conditional_depends, verify_token
 from CRUD.user import read_user_by_id
-from database import get_db
-from r1_automation import byte_to_utf8
+from database import get_async_db, get_db
+from r1_automation import CLG_CATEGORY, contribution_key
+from recommender_scoring import (CATEGORY_FIELDS, parse_contribution, read_contribution,
+                                 top_categories_for_users, top_k_categories)
 from redis_client import r
+from redis_codec import decode_clg_info
 
 router = APIRouter()
 REPORT_FILE_PATH = "report_content.csv"
 
+# users who asked for recommendations, scored by the time of their last request
+ACTIVE_USERS_KEY = "recommendation_active_users"
+# feeds are only rebuilt for users active within this many days
+FEED_ACTIVE_DAYS = int(os.environ.get("FEED_ACTIVE_DAYS", "7"))
+# a feed nobody reads expires after this many seconds
+FEED_TTL = int(os.environ.get("FEED_TTL", str(2 * 24 * 3600)))
+FEED_PAGE_SIZE = 20
+MAX_FEED_PAGE_SIZE = 100
+# recent posts sampled per request from post_clg_pair and from each top category
+REACTED_SAMPLE_SIZE = 200
+CATEGORY_SAMPLE_SIZE = 100
 
-def top3categories(user_id: int) -> set:
+
+def top3categories(user_id: int, contribution=None) -> list:
     """
-        The 'user_contribution' key in redis is a hash table
-        that record user's contribution to each challenge
+        The 'user_contribution:{user_id}' hash in redis
+        records user's contribution to each challenge
         category.This function takes user_id as input and return 3
-        categories where the user has spent the most time contributing.
+        categories where the user has spent the most time contributing,
+        topped up with random categories.
+        contribution can be passed in when it was already read from redis.
     """
-    # retrive user's challenge contribution data.
-    contribution = byte_to_utf8(r.hget(
-        'user_contribution', user_id), str_split_symbol=',', error_result=['0']*5)
-    contribution = [int(num) for num in contribution]
-    top_categories = []
-
-    for category in range(5):
-
-        # if user did not contribute to category i, then move on to the next category
-        if contribution[category] == 0:
-            continue
-        # otherwise, see if user's contribution is one of the top 3 categories.
-        inserted = False
-        for i, top_category in enumerate(top_categories):
-            if contribution[category] > contribution[top_category]:
-                top_categories.insert(i, category)
-                inserted = True
-                break
-        if not inserted and len(top_categories) < 3:
-            top_categories.append(category)
-
-        elif len(top_categories) > 3:
-            contribution.pop()
+    if contribution is None:
+        contribution = read_contribution(user_id)
+    return top_k_categories(contribution)[0].tolist()
 
-    # if user contributed to less than 3 categories,
-    # then randomly pick some other categories for this user
-    n = len(top_categories)
-    if n == 3:
-        return top_categories
-    other_categories = [item for item in [
-        0, 1, 2, 3, 4] if item not in top_categories]
-    return top_categories + random.sample(other_categories, 3-n)
 
-
-def filtered_posts_from_reacted_challenges(user_id: int) -> list:
+def filtered_posts_from_reacted_challenges(
+        top3: list, sampled_pairs: list, clg_details: dict,
+        liked_posts: dict, clg_preferences: dict) -> list:
     """
         user can interact with posts, each post belongs to 1 challenge.
         so reacting to recent post is equivalent to react to a challenge.
         this function allocates new posts to users based on their interacted challenges.
+        sampled_pairs are (post_id, clg_id) pairs sampled from post_clg_pair;
+        the lookups are prefetched by get_recommended_post.
     """
     post_pool = []
-    recent_posts = r.hkeys('post_clg_pair')
-    recent_posts = random.sample(recent_posts, min(len(recent_posts), 200))
-    top3 = top3categories(user_id)
-
-    for post_id in recent_posts:
-        clg_id = r.hget('post_clg_pair', post_id)
-        category = int(byte_to_utf8(r.hget(
-            'on_clg_info', clg_id), str_split_symbol=',')[0])
+
+    for post_id, clg_id in sampled_pairs:
+        clg_detail = clg_details.get(clg_id)
+        if clg_detail is None:
+            continue
+        category = decode_clg_info(clg_detail).category
         if category not in top3:
-            interacted_post = r.sismember(
-                f'{user_id}_liked_posts', post_id)
-            interacted_clg = r.zscore(
-                f'{user_id}_clgs_preference', post_id)
+            interacted_post = liked_posts[post_id]
+            interacted_clg = clg_preferences.get(clg_id)
             if not interacted_post or interacted_clg:
-                post_pool.append(int(byte_to_utf8(post_id)))
+                post_pool.append(post_id)
 
     return post_pool
 
 
-def filtered_posts_from_top3_categories(user_id: int) -> list:
+def filtered_posts_from_top3_categories(
+        top3: list, category_samples: list, liked_posts: dict) -> list:
     """ 
         Retrieve posts from the top 3 categories where the 
         user has spent the most time contributing 
+        category_samples[c] are recent posts sampled from category c.
     """
-    top3 = top3categories(user_id)
     post_pool = []
 
     for category_code in top3:
-
-        # get all recent post from specified category
-        raw_post_pool = r.zrangebyscore(
-            f'recent_posts_for_category{category_code}', 0, float('inf'))
-        raw_post_pool = [int(post) for post in raw_post_pool]
-        raw_post_pool = random.sample(
-            raw_post_pool, min(len(raw_post_pool), 100))
-
-        for post_id in raw_post_pool:
-            if not r.sismember(f'{user_id}_liked_posts', post_id):
+        for post_id in category_samples[category_code]:
+            if not liked_posts[post_id]:
                 post_pool.append(post_id)
 
     return post_pool
 
 
-def get_recommended_post(user_id):
-    """ Generate a list of recommended posts for a user """
-    return filtered_posts_from_reacted_challenges(user_id) + \
-        filtered_posts_from_top3_categories(user_id)
+def get_recommended_post(user_id, top3: list = None):
+    """ Generate a list of recommended posts for a user
+
+    All candidates are collected first, so the request costs two pipelined
+    round trips: one for the contribution and the samples of recent posts,
+    one for challenge details, liked posts and challenge preferences.
+    top3 can be passed in when the user's categories were ranked in a batch.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.hrandfield('post_clg_pair', REACTED_SAMPLE_SIZE, withvalues=True)
+    for category_code in range(CLG_CATEGORY):
+        pipe.zrandmember(f'recent_posts_for_category{category_code}', CATEGORY_SAMPLE_SIZE)
+    if top3 is None:
+        pipe.hmget(contribution_key(user_id), CATEGORY_FIELDS)
+    raw_pairs, *raw_category_samples = pipe.execute()
+    if top3 is None:
+        top3 = top_k_categories(parse_contribution(raw_category_samples.pop()))[0].tolist()
+    raw_pairs = raw_pairs or []
+    sampled_pairs = [(int(post_id), int(clg_id))
+                     for post_id, clg_id in zip(raw_pairs[::2], raw_pairs[1::2])]
+    category_samples = [[int(post_id) for post_id in sample or []]
+                        for sample in raw_category_samples]
+
+    post_ids = list(dict.fromkeys(
+        [post_id for post_id, _ in sampled_pairs] +
+        [post_id for category_code in top3 for post_id in category_samples[category_code]]))
+    if not post_ids:
+        return []
+    clg_ids = list(dict.fromkeys(clg_id for _, clg_id in sampled_pairs))
+
+    pipe = r.pipeline(transaction=False)
+    pipe.smismember(f'{user_id}_liked_posts', post_ids)
+    if clg_ids:
+        pipe.hmget('on_clg_info', clg_ids)
+        pipe.zmscore(f'{user_id}_clgs_preference', clg_ids)
+    liked, *clg_lookups = pipe.execute()
+
+    liked_posts = dict(zip(post_ids, liked))
+    clg_details, clg_preferences = {}, {}
+    if clg_ids:
+        clg_details = dict(zip(clg_ids, clg_lookups[0]))
+        clg_preferences = dict(zip(clg_ids, clg_lookups[1]))
+
+    return filtered_posts_from_reacted_challenges(
+        top3, sampled_pairs, clg_details, liked_posts, clg_preferences) + \
+        filtered_posts_from_top3_categories(top3, category_samples, liked_posts)
+
+
+def recommended_feed_key(user_id: int) -> str:
+    """ Redis list holding the precomputed recommendation feed of a user """
+    return f"recommended_feed:{user_id}"
+
+
+def build_recommendation_feed(user_id: int, top3: list = None) -> int:
+    """ Materialize a user's ranked candidate posts into their feed list
+
+    Returns:
+        number of posts in the feed
+    """
+    post_ids = list(dict.fromkeys(get_recommended_post(user_id, top3)))
+    feed_key = recommended_feed_key(user_id)
+    pipe = r.pipeline(transaction=True)
+    pipe.delete(feed_key)
+    if post_ids:
+        pipe.rpush(feed_key, *post_ids)
+        pipe.expire(feed_key, FEED_TTL)
+    pipe.execute()
+    return len(post_ids)
+
+
+def build_recommendation_feeds(user_ids: list = None) -> int:
+    """ Rebuild the feeds of the given users, or of every recently active user
+
+    Users who have not asked for recommendations for FEED_ACTIVE_DAYS are
+    dropped from the active set; their feeds expire on their own.
+
+    Returns:
+        number of feeds built
+    """
+    if user_ids is None:
+        cutoff = time.time() - FEED_ACTIVE_DAYS * 24 * 3600
+        r.zremrangebyscore(ACTIVE_USERS_KEY, "-inf", cutoff)
+        user_ids = [int(user_id) for user_id in r.zrange(ACTIVE_USERS_KEY, 0, -1)]
+    top3_by_user = top_categories_for_users(user_ids)
+    for user_id in user_ids:
+        build_recommendation_feed(user_id, top3_by_user[user_id])
+    return len(user_ids)
+
+
+def pop_recommended_page(user_id: int, limit: int) -> list:
+    """ Pop the next page of a user's feed and mark the user active, in one round trip """
+    feed_key = recommended_feed_key(user_id)
+    pipe = r.pipeline(transaction=True)
+    pipe.lrange(feed_key, 0, limit - 1)
+    pipe.ltrim(feed_key, limit, -1)
+    pipe.zadd(ACTIVE_USERS_KEY, {user_id: time.time()})
+    page, _, _ = pipe.execute()
+    return [int(post_id) for post_id in page]
 
 
 @router.post("/CreatePost/",
              response_model=schemas.PostRead, status_code=status.HTTP_201_CREATED)
-async def create_post_router(
+def create_post_router(
         post: schemas.PostCreate, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Create a new post """
@@ -129,12 +206,14 @@ async def create_post_router(
     if isinstance(result, str) and "Cannot create post" in result:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    # the post moves the owner's progress or finishes the challenge
+    discover_crud.refresh_discover_card(db, result.challenge_id)
     return result
 
 
 @router.get("/GetPost/{post_id}", response_model=schemas.PostRead)
 async def get_post_route(
-        post_id: int, db: Session = Depends(get_db),
+        post_id: int, db: AsyncSession = Depends(get_async_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Return the post by post id
 
@@ -147,7 +226,7 @@ async def get_post_route(
     Raises:
         HTTPException: post not found
     """
-    post = post_crud.get_post(db=db, post_id=post_id)
+    post = await post_crud.get_post_async(db=db, post_id=post_id)
     if post is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="post not found")
@@ -155,7 +234,7 @@ async def get_post_route(
 
 
 @router.get("/GetPostByUserID/{user_id}", response_model=List[schemas.PostRead])
-async def get_post_route_user_id(
+def get_post_route_user_id(
         user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Return the post by user id
@@ -179,7 +258,7 @@ async def get_post_route_user_id(
 
 @router.get("/GetPostByChallengeID/{challenge_id}/{user_id}", response_model=List[schemas.PostRead])
 async def get_post_route_challenge_id(
-        challenge_id: int, user_id: int, db: Session = Depends(get_db),
+        challenge_id: int, user_id: int, db: AsyncSession = Depends(get_async_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Return the post by challenge id
 
@@ -193,9 +272,9 @@ async def get_post_route_challenge_id(
         HTTPException: post not found
         HTTPException: challenge not found
     """
-    blocked_user_list = block_crud.get_blocked_user_list(
+    blocked_user_list = await block_crud.get_blocked_user_list_async(
         db=db, blocker_user_id=user_id)
-    post = post_crud.get_posts_by_challenge_id(
+    post = await post_crud.get_posts_by_challenge_id_async(
         db=db, challenge_id=challenge_id, blocked_user_list=blocked_user_list)
     if post is None:
         raise HTTPException(
@@ -205,7 +284,7 @@ async def get_post_route_challenge_id(
 
 
 @router.get("/GetAllposts/{user_id}", response_model=list[schemas.PostRead])
-async def get_posts_route(
+def get_posts_route(
         user_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Return all posts
@@ -225,7 +304,7 @@ async def get_posts_route(
 
 
 @router.put("/Updatepost/{post_id}", response_model=schemas.PostRead)
-async def update_post_route(
+def update_post_route(
         post_id: int, post: schemas.PostCreate, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Update post by post id """
@@ -237,7 +316,7 @@ async def update_post_route(
 
 
 @router.delete("/Deletepost/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_post_route(
+def delete_post_route(
         post_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Delete post by post id """
@@ -250,7 +329,7 @@ async def delete_post_route(
 
 
 @router.get("/GetRecentPostDuration/{user_id}")
-async def get_recent_post_duration(
+def get_recent_post_duration(
         user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Return the duration of posts in the last 5 days for a user
@@ -261,22 +340,39 @@ async def get_recent_post_duration(
 
 
 @router.get("/GetRecommendedPosts/{user_id}")
-async def get_recommended_posts(
-        user_id: int, db: Session = Depends(get_db),
+def get_recommended_posts(
+        user_id: int,
+        limit: int = Query(FEED_PAGE_SIZE, ge=1, le=MAX_FEED_PAGE_SIZE),
+        db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
-    """ Return the recommended posts for a user
+    """ Return the next page of recommended posts for a user
+
+    Pages are popped from the feed precomputed by the automation run; a
+    user without a feed, or who has read all of it, gets one built online.
 
     raise HTTPException: user not found
     """
     read_user_by_id(db, user_id)  # handle user not found
-    recommended_post_ids = get_recommended_post(user_id)
-    blocked_user_list = block_crud.get_blocked_user_list(
-        db=db, blocker_user_id=user_id)
-    final_post_ids = []
-    for post_id in recommended_post_ids:
-        if post_id not in blocked_user_list:
-            final_post_ids.append(post_id)
-    return post_crud.get_posts_by_ids(db, final_post_ids)
+    blocked_user_ids = set(block_crud.get_blocked_user_list(
+        db=db, blocker_user_id=user_id))
+    page = []
+    popped_any = False
+    # posts of blocked users and deleted posts are skipped, so keep popping
+    # until the page is full or the feed runs out
+    while len(page) < limit:
+        recommended_post_ids = pop_recommended_page(user_id, limit - len(page))
+        if not recommended_post_ids:
+            if popped_any or not build_recommendation_feed(user_id):
+                break
+            recommended_post_ids = pop_recommended_page(user_id, limit - len(page))
+        popped_any = True
+        posts_by_id = {post.id: post for post in post_crud.get_posts_by_ids(
+            db, recommended_post_ids, limit=len(recommended_post_ids))}
+        # in feed order, not the created_time order of the query
+        page.extend(posts_by_id[post_id] for post_id in recommended_post_ids
+                    if post_id in posts_by_id
+                    and posts_by_id[post_id].user_id not in blocked_user_ids)
+    return page
 
 
 def create_empty_csv():
@@ -309,7 +405,7 @@ def add_record_to_csv(input_data: dict):
 
 
 @router.post("/reportPost/")
-async def create_report_post(
+def create_report_post(
         post_id: int, user_id: int, report_reason: str, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Return the report post for a user
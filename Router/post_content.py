@@ -14,7 +14,7 @@ router = APIRouter()
 
 @router.post("/CreatePostContent/",
              response_model=schemas.PostContentRead, status_code=status.HTTP_201_CREATED)
-async def create_post_content_router(
+def create_post_content_router(
         post_content: schemas.PostContentCreate, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Create a new post content in the database.
@@ -30,7 +30,7 @@ async def create_post_content_router(
 
 @router.get("/GetPostContentByID/{post_content_id}",
             response_model=schemas.PostContentRead)
-async def get_post_content_route(
+def get_post_content_route(
         post_content_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get post content by post content id """
@@ -44,7 +44,7 @@ async def get_post_content_route(
 
 @router.get("/GetPostContentByPostID/{post_id}",
             response_model=List[schemas.PostContentRead])
-async def get_post_content_route_by_post_id(
+def get_post_content_route_by_post_id(
         post_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get post content by post id """
@@ -57,7 +57,7 @@ async def get_post_content_route_by_post_id(
 
 
 @router.get("/GetAllPostContent/", response_model=list[schemas.PostContentRead])
-async def get_all_post_content_route(
+def get_all_post_content_route(
         skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get all post content """
@@ -65,7 +65,7 @@ async def get_all_post_content_route(
 
 
 @router.put("/UpdatePostContents/{post_content_id}", response_model=schemas.PostContentRead)
-async def update_post_content_route(
+def update_post_content_route(
         post_content_id: int, post_content: schemas.PostContentCreate,
         db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
@@ -80,7 +80,7 @@ async def update_post_content_route(
 
 @router.delete("/DeletePostContent/{post_content_id}",
                status_code=status.HTTP_204_NO_CONTENT)
-async def delete_post_route(
+def delete_post_route(
         post_content_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Delete post content by post content id """
@@ -1,25 +1,28 @@
 # pylint: disable=unused-argument
 
-from typing import List
+from typing import Dict, List
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import CRUD.blocked_user_list as block_crud
 import CRUD.challenge as crud_challenge
-import CRUD.post as crud_post
 import CRUD.post_reaction as crud
 import schemas
 from auth_dependencies import conditional_depends, verify_token
-from database import get_db
+from database import get_async_db, get_db
 
 router = APIRouter(prefix="/post_reaction")
 
+# most challenge ids one GetReactionsByChallenges request may ask for
+MAX_CHALLENGE_IDS = 500
+
 
 @router.post("/Create", response_model=schemas.PostReactionCreate,
              status_code=status.HTTP_201_CREATED)
-async def create_post_reaction(
+def create_post_reaction(
         post_reaction: schemas.PostReactionCreate, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Create a new post reaction log """
@@ -29,7 +32,7 @@ async def create_post_reaction(
 
 
 @router.get("", response_model=List[schemas.PostReactionCreate])
-async def get_all_reactions(
+def get_all_reactions(
         skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get all post reactions """
@@ -39,16 +42,16 @@ async def get_all_reactions(
 
 @router.get("/GetByPostId/{post_id}", response_model=List[schemas.PostReactionCreate])
 async def get_reactions_by_post_id(
-        post_id: int, db: Session = Depends(get_db),
+        post_id: int, db: AsyncSession = Depends(get_async_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get post reactions by post id """
-    reactions_post_id = crud.get_post_reactions_by_post_id(
+    reactions_post_id = await crud.get_post_reactions_by_post_id_async(
         db=db, post_id=post_id)
     return reactions_post_id
 
 
 @router.get("/GetByEmoji/{emoji_image}", response_model=List[schemas.PostReactionCreate])
-async def get_reactions_by_emoji(
+def get_reactions_by_emoji(
         emoji_image: str, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get post reactions by emoji image """
@@ -58,7 +61,7 @@ async def get_reactions_by_emoji(
 
 
 @router.get("/GetByPostnEmoji/{post_id}/{emoji_image}", response_model=schemas.PostReactionCreate)
-async def get_reaction_by_postid_emoji(
+def get_reaction_by_postid_emoji(
         post_id: int, emoji_image: str, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get post reaction by post id and emoji image """
@@ -68,7 +71,7 @@ async def get_reaction_by_postid_emoji(
 
 
 @router.put("/UpdateReaction/{post_id}/{emoji_image}", response_model=schemas.PostReactionCreate)
-async def update_post_reaction(
+def update_post_reaction(
         post_id: int, emoji_image: str, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token), post_reaction=None):
     """ Update post reaction by post id and emoji image """
@@ -79,7 +82,7 @@ async def update_post_reaction(
 
 
 @router.delete("/DeleteReaction/{post_id}/{emoji_image}", status_code=status.HTTP_204_NO_CONTENT)
-async def delet_reaction(
+def delet_reaction(
         post_id: int, emoji_image: str, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Delete post reaction by post id and emoji image """
@@ -93,7 +96,7 @@ async def delet_reaction(
 
 @router.put("/UpdateCount/{post_id}/{emoji_image}",
             response_model=schemas.PostReactionCreate)
-async def update_count(
+def update_count(
         post_id: int, emoji_image: str, action: bool, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Update count by post id and emoji image 
@@ -108,7 +111,7 @@ async def update_count(
 
 
 @router.get("/GetReactionsByChallenge/{challenge_id}")
-async def get_reaction_count_challenge_id(
+def get_reaction_count_challenge_id(
         challenge_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get reaction count by challenge id """
@@ -116,13 +119,18 @@ async def get_reaction_count_challenge_id(
         db=db, challenge_id=challenge_id)
     blocked_user_list = block_crud.get_blocked_user_list(
         db=db, blocker_user_id=current_challenge.challenge_owner_id)
-    post_list = crud_post.get_posts_by_challenge_id(
+    return crud.get_counts_challenge(
         db=db, challenge_id=challenge_id, blocked_user_list=blocked_user_list)
-    challenge_reaction_count = 0
-    post_id_list = []
-    for item in post_list:
-        post_id_list.append(item.id)
-    for post_id in post_id_list:
-        challenge_reaction_count += crud.get_counts_post(
-            db=db, post_id=post_id)
-    return challenge_reaction_count
+
+
+@router.get("/GetReactionsByChallenges", response_model=Dict[int, int])
+def get_reaction_count_challenge_ids(
+        challenge_ids: List[int] = Query(..., max_length=MAX_CHALLENGE_IDS),
+        db: Session = Depends(get_db),
+        current_user: dict = conditional_depends(depends=verify_token)):
+    """ Get reaction count of many challenges: ?challenge_ids=1&challenge_ids=2
+
+    Returns:
+        challenge id -> reaction count, for the challenges that exist
+    """
+    return crud.get_counts_challenges(db=db, challenge_ids=challenge_ids)
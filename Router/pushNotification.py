@@ -12,7 +12,7 @@ router = APIRouter()
 
 
 @router.post("/sendNotification/")
-async def test_sendNotification(db: Session = Depends(get_db)):
+def test_sendNotification(db: Session = Depends(get_db)):
     """ Send a push notification to all users """
     tokens = helper.get_push_tokens(db=db)
     push_messages = helper.push_message_array(tokens=tokens)
@@ -5,6 +5,7 @@ from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 
+import CRUD.discover as discover_crud
 import CRUD.tracking as crud
 import schemas
 from auth_dependencies import conditional_depends, verify_token
@@ -33,6 +34,8 @@ def create_tracking(
         HTTPException: This user is not the owner of this challenge
     """
     tracking = crud.create_tracking(db, tracking)
+    if tracking is not None:
+        discover_crud.refresh_discover_card(db, tracking.challenge_id)
     return tracking
 
 
@@ -6,6 +6,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
+import CRUD.popular_posts as popular_posts_crud
 import CRUD.user_reaction_log as crud
 import schemas
 from auth_dependencies import conditional_depends, verify_token
@@ -15,19 +16,22 @@ router = APIRouter(prefix="/user_reaction_log")
 
 
 @router.post("/Create", response_model=schemas.UserReactionLogCreate, status_code=status.HTTP_201_CREATED)
-async def create_user_reaction_log(
+def create_user_reaction_log(
         log: schemas.UserReactionLogCreate, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Create a new user reaction log """
+    previous_log = crud.get_recent_user_reaction_log_by_user_id(
+        db=db, user_id=log.user_id, post_id=log.post_id)
     result = crud.create_user_reaction_log(db=db, log=log)
     if isinstance(result, str):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail=result)
+    popular_posts_crud.record_reaction_log(result, previous_log)
     return result
 
 
 @router.get("", response_model=List[schemas.UserReactionLogRead])
-async def get_all_log(
+def get_all_log(
         db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get all user reaction logs """
@@ -36,7 +40,7 @@ async def get_all_log(
 
 
 @router.get("/GetByLogId/{log_id}", response_model=List[schemas.UserReactionLogRead])
-async def get_log_by_log_id(
+def get_log_by_log_id(
         log_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get user reaction log by log id """
@@ -45,7 +49,7 @@ async def get_log_by_log_id(
 
 
 @router.get("/GetByUserId/{user_id}", response_model=List[schemas.UserReactionLogRead])
-async def get_log_by_user_id(
+def get_log_by_user_id(
         user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get user reaction log by user id """
@@ -55,7 +59,7 @@ async def get_log_by_user_id(
 
 
 @router.get("/GetByPostId/{post_id}", response_model=List[schemas.UserReactionLogRead])
-async def get_log_by_post_id(
+def get_log_by_post_id(
         post_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get user reaction log by post id """
@@ -65,7 +69,7 @@ async def get_log_by_post_id(
 
 
 @router.get("/GetByEmoji/{emoji_image}", response_model=List[schemas.UserReactionLogRead])
-async def get_log_by_emoji_image(
+def get_log_by_emoji_image(
         emoji_image: str, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get user reaction log by emoji image """
@@ -75,7 +79,7 @@ async def get_log_by_emoji_image(
 
 
 @router.get("/GetLatestByUserPost/{post_id}/{user_id}")
-async def get_latest_log_of_user(
+def get_latest_log_of_user(
         post_id: int, user_id: int, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Get latest user reaction log by user id and post id """
@@ -85,7 +89,7 @@ async def get_latest_log_of_user(
 
 
 @router.put("/UpdateById/{log_id}", response_model=schemas.UserReactionLogRead)
-async def update_reaction_log(
+def update_reaction_log(
         log_id: int, log: schemas.UserReactionLogRead, db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Update user reaction log by log id """
@@ -94,7 +98,7 @@ async def update_reaction_log(
 
 
 @router.delete("/DeleteById/{log_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_log(
+def delete_log(
         log_id: int,  db: Session = Depends(get_db),
         current_user: dict = conditional_depends(depends=verify_token)):
     """ Delete user reaction log by log id """
@@ -0,0 +1,185 @@
+import os
+from contextlib import contextmanager
+from functools import partial
+
+import pytest
+import redis
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+# database.py reads these at import time; the tests below use SQLite instead
+os.environ.setdefault("DATABASE_USER", "test")
+os.environ.setdefault("DATABASE_PASSWORD", "test")
+os.environ.setdefault("DATABASE_HOST", "localhost")
+os.environ.setdefault("DATABASE_NAME", "test")
+# tests flush reaction counts themselves
+os.environ.setdefault("REACTION_FLUSH_INTERVAL", "0")
+
+from database import Base  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def db():
+    """ Session on a fresh in-memory SQLite database with every table """
+    engine = create_engine("sqlite://", poolclass=StaticPool,
+                           connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def count_queries(db):
+    """ Context manager collecting the SQL statements executed on the db engine """
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.bind, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.bind, "before_cursor_execute", before_cursor_execute)
+    return counter
+
+
+def use_fake_redis_without_server():
+    """ Serve every redis_client pool from one in-process fakeredis server,
+    when there is no local Redis
+
+    The process-wide clients already exist and connect lazily, so their pools
+    are switched over too, along with the pools the factories build later.
+    """
+    # pylint: disable=import-outside-toplevel
+    import fakeredis
+    import fakeredis.aioredis
+
+    import redis_client
+
+    probe = redis_client.create_redis_client(db=15)
+    try:
+        probe.ping()
+        return
+    except redis.ConnectionError:
+        pass
+    finally:
+        probe.close()
+
+    server = fakeredis.FakeServer()
+    redis_client.create_connection_pool = partial(
+        redis_client.create_connection_pool,
+        connection_class=fakeredis.FakeConnection, server=server)
+    # fakeredis does not answer the health check PINGs of idle async connections
+    redis_client.create_async_connection_pool = partial(
+        redis_client.create_async_connection_pool,
+        connection_class=fakeredis.aioredis.FakeConnection, server=server,
+        health_check_interval=0)
+    for pool, connection_class in (
+            (redis_client.redis_client.connection_pool, fakeredis.FakeConnection),
+            (redis_client.async_redis_client.connection_pool,
+             fakeredis.aioredis.FakeConnection)):
+        pool.connection_class = connection_class
+        pool.connection_kwargs["server"] = server
+    redis_client.async_redis_client.connection_pool.connection_kwargs[
+        "health_check_interval"] = 0
+
+
+use_fake_redis_without_server()
+
+
+@pytest.fixture
+def redis_db():
+    """ Client on database 15 of the local Redis (or of fakeredis), flushed """
+    # pylint: disable=import-outside-toplevel
+    from redis_client import create_redis_client
+
+    client = create_redis_client(db=15)
+    client.flushdb()
+    yield client
+    client.flushdb()
+    client.close()
+
+
+@pytest.fixture
+def count_round_trips(monkeypatch):
+    """ Context manager counting direct Redis commands and pipeline flushes """
+    @contextmanager
+    def counter():
+        calls = []
+        execute_command = redis.Redis.execute_command
+        execute_pipeline = redis.client.Pipeline.execute
+
+        def counted_command(client, *args, **kwargs):
+            calls.append(args[0])
+            return execute_command(client, *args, **kwargs)
+
+        def counted_pipeline(pipe, *args, **kwargs):
+            calls.append("pipeline")
+            return execute_pipeline(pipe, *args, **kwargs)
+
+        monkeypatch.setattr(redis.Redis, "execute_command", counted_command)
+        monkeypatch.setattr(redis.client.Pipeline, "execute", counted_pipeline)
+        try:
+            yield calls
+        finally:
+            monkeypatch.setattr(redis.Redis, "execute_command", execute_command)
+            monkeypatch.setattr(redis.client.Pipeline, "execute", execute_pipeline)
+    return counter
+
+
+@pytest.fixture
+def client(db):
+    """ TestClient on the app, with get_db serving the db fixture's session """
+    # pylint: disable=import-outside-toplevel
+    from fastapi.testclient import TestClient
+
+    from auth_dependencies import verify_token
+    from database import get_db
+    from main import app
+
+    def override_get_db():
+        yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[verify_token] = lambda: {"user_id": "test_user_id"}
+    with TestClient(app) as test_client:
+        yield test_client
+    app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def query_budget(db):
+    """ Context manager failing the test when a request runs more statements than allowed
+
+        with query_budget(3):
+            client.get("/GetChallengeDetailsPartA/1")
+    """
+    # pylint: disable=import-outside-toplevel
+    import query_counter
+
+    query_counter.instrument_engine(db.bind)
+
+    @contextmanager
+    def budget(max_queries: int, max_repeats: int = None):
+        requests = []
+        listener = requests.append
+        query_counter.request_listeners.append(listener)
+        try:
+            yield requests
+        finally:
+            query_counter.request_listeners.remove(listener)
+        for queries in requests:
+            shapes = "\n".join(f"{count} x {shape}" for shape, count in queries.shapes.items())
+            if queries.count > max_queries:
+                pytest.fail(f"{queries.route} ran {queries.count} statements, "
+                            f"budget {max_queries}:\n{shapes}")
+            if max_repeats and queries.repeated(max_repeats + 1):
+                pytest.fail(f"{queries.route} ran a statement more than {max_repeats} times:"
+                            f"\n{shapes}")
+    return budget
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+from firebase_admin import auth
+
+import auth_dependencies
+
+
+@pytest.fixture
+def firebase(monkeypatch):
+    """ Count verify_id_token calls; tokens look like 'user:exp' """
+    calls = []
+
+    def verify_id_token(token, check_revoked=False):
+        calls.append((token, check_revoked))
+        if token.startswith("revoked") and check_revoked:
+            raise auth.RevokedIdTokenError("revoked")
+        user_id, exp = token.split(":")
+        return {"user_id": user_id, "exp": float(exp)}
+
+    monkeypatch.setattr(auth, "verify_id_token", verify_id_token)
+    monkeypatch.setattr(auth_dependencies, "token_cache", auth_dependencies.token_cache.__class__(
+        maxsize=2, ttu=lambda _key, payload, _now: payload["exp"], timer=time.time))
+    monkeypatch.setattr(auth_dependencies, "token_cache_stats", auth_dependencies.Counter())
+    return calls
+
+
+def test_token_is_verified_once_until_it_expires(firebase):
+    token = f"alice:{time.time() + 3600}"
+    expired = f"bob:{time.time() - 1}"
+
+    for _ in range(3):
+        assert auth_dependencies.verify_token(token)["user_id"] == "alice"
+        auth_dependencies.verify_token(expired)
+
+    assert [call[0] for call in firebase] == [token, expired, expired, expired]
+    assert auth_dependencies.token_cache_stats == {"hits": 2, "misses": 4}
+    assert token not in str(dict(auth_dependencies.token_cache))
+
+
+def test_redis_tier_is_shared_between_workers(firebase, redis_db, monkeypatch):
+    monkeypatch.setattr(auth_dependencies, "redis_client", redis_db)
+    monkeypatch.setattr(auth_dependencies, "TOKEN_CACHE_REDIS", True)
+    token = f"alice:{time.time() + 3600}"
+
+    auth_dependencies.verify_token(token)
+    auth_dependencies.token_cache.clear()  # another worker
+    assert auth_dependencies.verify_token(token)["user_id"] == "alice"
+
+    assert len(firebase) == 1
+    assert auth_dependencies.token_cache_stats["redis_hits"] == 1
+    assert 0 < redis_db.ttl(f"verified_token:{auth_dependencies.token_hash(token)}") <= 3600
+
+
+def test_revocation_check_is_explicit(firebase):
+    token = f"revoked:{time.time() + 3600}"
+
+    assert auth_dependencies.verify_token(token)["user_id"] == "revoked"
+    assert firebase == [(token, False)]
+
+    with pytest.raises(HTTPException) as error:
+        auth_dependencies.verify_token_not_revoked(token)
+    assert error.value.detail == "Token has been revoked"
+    assert auth_dependencies.token_hash(token) not in auth_dependencies.token_cache
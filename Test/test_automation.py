@@ -0,0 +1,67 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import models
+import r1_automation
+from redis_codec import encode_clg_info
+
+
+@pytest.fixture
+def automation(db, redis_db, monkeypatch):
+    """ r1_automation on the test database and Redis database """
+    monkeypatch.setattr(r1_automation, "r", redis_db)
+    monkeypatch.setattr(r1_automation, "session", db, raising=False)
+    return redis_db
+
+
+def add_challenges(db, r, challenge_count: int) -> None:
+    """ Users 1..4 and challenges 1..challenge_count, challenge i of category i lasting 10 * i days """
+    for user_id in range(1, 5):
+        db.add(models.User(id=user_id, firebase_uid=f"uid{user_id}", name=f"name{user_id}",
+                           username=f"user{user_id}", user_timezone="Australia/Sydney"))
+    for challenge_id in range(1, challenge_count + 1):
+        db.add(models.Challenge(id=challenge_id, title=f"t{challenge_id}", description="d",
+                                duration=10 * challenge_id, breaking_days=3,
+                                challenge_owner_id=1, category=challenge_id))
+        r.hset("on_clg_info", challenge_id, encode_clg_info(
+            challenge_id, True, 10 * challenge_id, date(2024, 5, 1)))
+    db.commit()
+
+
+def join(db, challenge_id: int, user_id: int, created_time: datetime) -> None:
+    db.add(models.GroupChallengeMembers(
+        challenge_id=challenge_id, user_id=user_id, breaking_days_left=3,
+        days_left=30, created_time=created_time))
+    db.commit()
+
+
+def test_members_joining_an_older_challenge_are_counted(db, automation):
+    r = automation
+    add_challenges(db, r, challenge_count=2)
+    last_hour = datetime.now() - timedelta(hours=1)
+    join(db, 2, 2, last_hour)
+
+    assert r1_automation.update_challenge_distribution_for_users() == 1
+
+    # user 3 joins challenge 1, below the watermark's (challenge_id, user_id)
+    join(db, 1, 3, last_hour + timedelta(minutes=1))
+    # a join still within MEMBER_SETTLE_SECONDS waits for the next run
+    join(db, 1, 4, datetime.now())
+
+    assert r1_automation.update_challenge_distribution_for_users() == 1
+    assert r.hgetall(r1_automation.contribution_key(2)) == {b"2": b"20"}
+    assert r.hgetall(r1_automation.contribution_key(3)) == {b"1": b"10"}
+    assert r.hgetall(r1_automation.contribution_key(4)) == {}
+
+
+def test_legacy_member_watermark_continues_after_its_key(db, automation):
+    r = automation
+    add_challenges(db, r, challenge_count=1)
+    added_column = datetime.now() - timedelta(hours=1)
+    for user_id in (2, 3, 4):
+        join(db, 1, user_id, added_column)
+    r.hset(r1_automation.WATERMARK_KEY, "mmbr", "1,3")
+
+    assert r1_automation.update_challenge_distribution_for_users() == 1
+    assert r.hgetall(r1_automation.contribution_key(4)) == {b"1": b"10"}
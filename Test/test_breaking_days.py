@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import pytz
+
+import CRUD.challenge as challenge_crud
+import models
+
+
+def seed_members(db):
+    """ Two Sydney members of one challenge, one Perth member of another """
+    for user_id, user_timezone in ((1, "Australia/Sydney"), (2, "Australia/Melbourne"),
+                                   (3, "Australia/Perth")):
+        db.add(models.User(id=user_id, firebase_uid=f"uid{user_id}", name=f"name{user_id}",
+                           username=f"user{user_id}", user_timezone=user_timezone))
+    for challenge_id, owner_id in ((1, 1), (2, 3)):
+        db.add(models.Challenge(id=challenge_id, title="t", description="d", duration=30,
+                                breaking_days=3, challenge_owner_id=owner_id))
+    for challenge_id, user_id in ((1, 1), (1, 2), (2, 3)):
+        db.add(models.GroupChallengeMembers(challenge_id=challenge_id, user_id=user_id,
+                                            breaking_days_left=3, days_left=30))
+    db.commit()
+
+
+def breaking_days_left(db, challenge_id: int, user_id: int) -> int:
+    db.expire_all()
+    return db.get(models.GroupChallengeMembers, (challenge_id, user_id)).breaking_days_left
+
+
+def test_bucket_reads_the_posts_of_its_own_local_date(db, redis_db, monkeypatch):
+    monkeypatch.setattr(challenge_crud, "redis_client", redis_db)
+    seed_members(db)
+    sydney_date = datetime.now(pytz.timezone("Australia/Sydney")).strftime("%Y-%m-%d")
+    redis_db.sadd(f"posted_challenges:{sydney_date}", "1_1")
+
+    summary = challenge_crud.update_breaking_days_for_specific_challenges(
+        db, challenge_crud.TIMEZONE_MAPPING["Sydney"])
+
+    assert set(summary) == {"Australia/Sydney", "Australia/Melbourne"}
+    assert breaking_days_left(db, 1, 1) == 3
+    assert breaking_days_left(db, 1, 2) == 2
+    # Perth is not in the bucket
+    assert breaking_days_left(db, 2, 3) == 3
+
+
+def test_mapping_key_expands_to_its_timezones(db, redis_db, monkeypatch):
+    monkeypatch.setattr(challenge_crud, "redis_client", redis_db)
+    seed_members(db)
+
+    summary = challenge_crud.update_breaking_days_for_specific_challenges(db, "Perth")
+
+    assert set(summary) == {"Australia/Perth"}
+    assert breaking_days_left(db, 2, 3) == 2
@@ -0,0 +1,87 @@
+import pytest
+
+import CRUD.post_reaction as post_reaction_crud
+import CRUD.reaction_counts as reaction_counts
+import models
+from CRUD.challenge import challenge_details_page_second_half_by_challenge_ID
+
+
+def seed_challenge(db, post_count: int, member_count: int = 5):
+    """ One challenge with members, posts, contents and reactions """
+    db.add(models.Emoji(emoji_image="🔥", name="fire"))
+    db.add(models.Emoji(emoji_image="👍", name="thumbs up"))
+    for user_id in range(1, member_count + 1):
+        db.add(models.User(id=user_id, firebase_uid=f"uid{user_id}", name=f"name{user_id}",
+                           username=f"user{user_id}", user_timezone="Australia/Sydney"))
+    db.add(models.Challenge(id=1, title="t", description="d", duration=30,
+                            breaking_days=3, challenge_owner_id=1))
+    for user_id in range(1, member_count + 1):
+        db.add(models.GroupChallengeMembers(challenge_id=1, user_id=user_id,
+                                            breaking_days_left=3, days_left=30))
+    for post_id in range(1, post_count + 1):
+        db.add(models.Post(id=post_id, user_id=(post_id % member_count) + 1,
+                           challenge_id=1, written_text=f"post {post_id}"))
+        db.add(models.PostContent(post_id=post_id, image_location=f"img{post_id}"))
+        db.add(models.PostReaction(post_id=post_id, emoji_image="🔥", count=post_id))
+        db.add(models.PostReaction(post_id=post_id, emoji_image="👍", count=1))
+    db.commit()
+
+
+@pytest.fixture
+def counts(redis_db, monkeypatch):
+    """ reaction_counts on the test Redis database """
+    monkeypatch.setattr(reaction_counts, "redis_client", redis_db)
+    return redis_db
+
+
+def test_second_half_groups_each_post_once_under_its_author(db, counts):
+    seed_challenge(db, post_count=10)
+
+    result = challenge_details_page_second_half_by_challenge_ID(db, 1)
+
+    posts = [post for group in result for post in group["Posts"]]
+    assert sorted(post["id"] for post in posts) == list(range(1, 11))
+    for group in result:
+        for post in group["Posts"]:
+            author_id = db.get(models.Post, post["id"]).user_id
+            assert group["UserName"] == f"user{author_id}"
+            assert sorted(post["reactions"], key=str) == sorted(
+                [{"🔥": post["id"]}, {"👍": 1}], key=str)
+            assert [content.image_location for content in post["PostContent"]] == \
+                [f"img{post['id']}"]
+
+
+@pytest.mark.parametrize("post_count", [1, 10, 60])
+def test_second_half_query_count_does_not_grow_with_posts(db, counts, count_queries,
+                                                           post_count):
+    seed_challenge(db, post_count=post_count)
+    db.expunge_all()
+
+    with count_queries() as statements:
+        challenge_details_page_second_half_by_challenge_ID(db, 1)
+
+    assert len(statements) <= 4
+
+
+def test_second_half_without_posts(db, count_queries):
+    seed_challenge(db, post_count=0)
+
+    with count_queries() as statements:
+        assert challenge_details_page_second_half_by_challenge_ID(db, 1) == []
+    assert len(statements) == 1
+
+
+def test_second_half_counts_unflushed_taps(db, counts):
+    seed_challenge(db, post_count=2)
+    reaction_counts.get_reaction_counts(db, 1)
+    reaction_counts.flush_reaction_counts(db)
+    # post 1 is seeded in Redis, post 2 is not
+    post_reaction_crud.update_count(db, 1, "🔥", True)
+    post_reaction_crud.update_count(db, 2, "👍", True)
+
+    result = challenge_details_page_second_half_by_challenge_ID(db, 1)
+
+    reactions = {post["id"]: post["reactions"]
+                 for group in result for post in group["Posts"]}
+    assert sorted(reactions[1], key=str) == sorted([{"🔥": 2}, {"👍": 1}], key=str)
+    assert sorted(reactions[2], key=str) == sorted([{"🔥": 2}, {"👍": 2}], key=str)
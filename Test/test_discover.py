@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pytest
+from fastapi import BackgroundTasks
+
+import CRUD.challenge as challenge_crud
+import CRUD.discover as discover_crud
+import models
+from test_challenge_details import seed_challenge
+
+
+@pytest.fixture
+def discover(redis_db, monkeypatch):
+    """ CRUD.discover on the test Redis database, rebuilt in pages of two """
+    monkeypatch.setattr(discover_crud, "redis_client", redis_db)
+    monkeypatch.setattr(discover_crud, "REBUILD_BATCH_SIZE", 2)
+    return redis_db
+
+
+def add_challenges(db, count: int):
+    """ Challenges 2..count+1, owned by user 1 """
+    for challenge_id in range(2, count + 2):
+        db.add(models.Challenge(id=challenge_id, title=f"t{challenge_id}", description="d",
+                                duration=30, breaking_days=3, challenge_owner_id=1))
+    db.commit()
+
+
+def snapshot_ids(client) -> list:
+    return sorted(int(challenge_id) for challenge_id in
+                  client.zrange(discover_crud.DISCOVER_INDEX_KEY, 0, -1))
+
+
+def test_cards_changed_during_a_rebuild_survive_the_swap(db, discover, monkeypatch):
+    seed_challenge(db, post_count=1)
+    add_challenges(db, 4)
+    get_discover_challenges = challenge_crud.get_discover_challenges
+
+    def finish_challenge_meanwhile(session, limit, cursor):
+        cards = get_discover_challenges(session, limit=limit, cursor=cursor)
+        if cursor is None:
+            # challenge 5 finishes after the rebuild read its page
+            session.get(models.Challenge, 5).finished_time = datetime.now()
+            session.commit()
+            discover_crud.remove_discover_card(5)
+        return cards
+
+    monkeypatch.setattr(challenge_crud, "get_discover_challenges", finish_challenge_meanwhile)
+    assert discover_crud.rebuild_discover_snapshot(db) == 5
+
+    assert snapshot_ids(discover) == [1, 2, 3, 4]
+
+
+def test_rebuild_is_skipped_while_another_one_runs(db, discover):
+    seed_challenge(db, post_count=1)
+    discover.set(discover_crud.DISCOVER_LOCK_KEY, 1)
+
+    assert discover_crud.rebuild_discover_snapshot(db) is None
+    assert not discover.exists(discover_crud.DISCOVER_INDEX_KEY)
+
+
+def test_rebuild_stops_and_keeps_the_lock_once_another_worker_took_it(db, discover, monkeypatch):
+    seed_challenge(db, post_count=1)
+    add_challenges(db, 4)
+    get_discover_challenges = challenge_crud.get_discover_challenges
+
+    def lose_lock_meanwhile(session, limit, cursor):
+        # the lock expired during this page and another worker took it
+        discover.set(discover_crud.DISCOVER_LOCK_KEY, "other-worker")
+        return get_discover_challenges(session, limit=limit, cursor=cursor)
+
+    monkeypatch.setattr(challenge_crud, "get_discover_challenges", lose_lock_meanwhile)
+    assert discover_crud.rebuild_discover_snapshot(db) is None
+
+    assert not discover.exists(discover_crud.DISCOVER_INDEX_KEY)
+    assert discover.get(discover_crud.DISCOVER_LOCK_KEY) == b"other-worker"
+
+
+def test_stale_snapshot_is_served_and_rebuilt_in_the_background(db, discover):
+    seed_challenge(db, post_count=1)
+    assert discover_crud.rebuild_discover_snapshot(db) == 1
+    discover.set(discover_crud.DISCOVER_BUILT_AT_KEY, 0)
+    add_challenges(db, 1)
+    background_tasks = BackgroundTasks()
+
+    page = discover_crud.get_discover_page(db, limit=10, background_tasks=background_tasks)
+
+    assert [card["id"] for card in page] == [1]
+    assert [task.func for task in background_tasks.tasks] == \
+        [discover_crud.rebuild_with_new_session]
@@ -0,0 +1,58 @@
+import models
+from CRUD.challenge import challenge_details_page_first_half_by_challenge_ID
+from CRUD.tracking import read_follower_by_challenge_id
+from database import load, load_many
+from test_challenge_details import seed_challenge
+
+
+def test_load_hits_the_database_once_per_row(db, count_queries):
+    seed_challenge(db, post_count=1)
+    db.expunge_all()
+
+    with count_queries() as statements:
+        first = load(db, models.User, 1)
+        assert load(db, models.User, 1) is first
+        assert load(db, models.User, 99) is None
+
+    assert len(statements) == 2
+
+
+def test_load_many_dedupes_and_reuses_loaded_rows(db, count_queries):
+    seed_challenge(db, post_count=1)
+    db.expunge_all()
+    owner = load(db, models.User, 1)
+
+    with count_queries() as statements:
+        users = load_many(db, models.User, [1, 2, 3, 2, 99])
+
+    assert len(statements) == 1
+    assert users[1] is owner
+    assert sorted(users) == [1, 2, 3]
+
+
+def test_first_half_reads_the_owner_once(db, count_queries):
+    seed_challenge(db, post_count=1)
+    db.expunge_all()
+
+    with count_queries() as statements:
+        challenge_details_page_first_half_by_challenge_ID(db, 1)
+
+    user_selects = [statement for statement in statements
+                    if statement.lstrip().upper().startswith("SELECT")
+                    and 'FROM "User"' in statement and "JOIN" not in statement]
+    assert len(user_selects) <= 1
+
+
+def test_followers_are_loaded_in_one_query(db, count_queries):
+    seed_challenge(db, post_count=1)
+    for follower_id in range(2, 6):
+        db.add(models.Tracking(challenge_id=1, owner_id=1, follower_id=follower_id))
+    db.commit()
+    db.expunge_all()
+
+    with count_queries() as statements:
+        avatars = read_follower_by_challenge_id(db, 1)
+
+    assert len(avatars) == 4
+    assert len(statements) <= 3
+
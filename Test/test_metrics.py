@@ -0,0 +1,55 @@
+import time
+
+from fastapi import FastAPI
+
+import metrics
+from metrics import MetricsMiddleware, external_call
+from test_challenge_details import seed_challenge
+
+
+def sample(name: str, labels: dict) -> float:
+    """ Current value of a sample of the default registry, 0 when absent """
+    # pylint: disable=import-outside-toplevel
+    from prometheus_client import REGISTRY
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_requests_are_labelled_by_route_template(client, db):
+    seed_challenge(db, post_count=1)
+    labels = {"method": "GET", "route": "/GetChallengeDetailsPartA/{challenge_id}"}
+    before = sample("http_requests_total", {**labels, "status": "200"})
+
+    assert client.get("/GetChallengeDetailsPartA/1").status_code == 200
+    client.get("/no/such/path/42")
+
+    assert sample("http_requests_total", {**labels, "status": "200"}) == before + 1
+    assert sample("http_request_duration_seconds_count", labels) >= 1
+    assert sample("http_request_db_queries_count", {"route": labels["route"]}) >= 1
+    assert sample("http_requests_total",
+                  {"method": "GET", "route": "<unmatched>", "status": "404"}) >= 1
+    assert sample("http_requests_in_progress", {"method": "GET"}) == 0
+
+    body = client.get("/metrics").text
+    assert 'route="/GetChallengeDetailsPartA/{challenge_id}"' in body
+    assert "/GetChallengeDetailsPartA/1" not in body
+    assert "db_pool" in body
+
+
+def test_external_calls_are_added_to_the_request():
+    app = FastAPI()
+
+    @app.get("/upload/{item_id}")
+    def upload(item_id: int):
+        with external_call("s3"):
+            time.sleep(0.01)
+        return item_id
+
+    labels = {"route": "/upload/{item_id}", "service": "s3"}
+    before = sample("http_request_external_seconds_sum", labels)
+    # pylint: disable=import-outside-toplevel
+    from fastapi.testclient import TestClient
+    with TestClient(MetricsMiddleware(app)) as test_client:
+        assert test_client.get("/upload/3").json() == 3
+
+    assert sample("http_request_external_seconds_sum", labels) - before >= 0.01
+    assert metrics.current_timings.get() is None
@@ -0,0 +1,19 @@
+from sqlalchemy import create_engine
+
+from database import TimedQueuePool
+
+
+def test_only_checkouts_opening_an_overflow_connection_are_counted():
+    engine = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1,
+                           max_overflow=2)
+    held = [engine.connect() for _ in range(3)]
+    # checkouts from the pool while the overflow connections stay open
+    for _ in range(3):
+        held.pop(0).close()
+        held.append(engine.connect())
+
+    assert engine.pool.telemetry["checkouts"] == 6
+    assert engine.pool.telemetry["overflow_events"] == 2
+    for connection in held:
+        connection.close()
+    engine.dispose()
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import CRUD.popular_posts as popular_posts_crud
+import models
+
+
+@pytest.fixture
+def ranking_redis(redis_db, monkeypatch):
+    monkeypatch.setattr(popular_posts_crud, "redis_client", redis_db)
+    return redis_db
+
+
+def add_reaction_logs(db, reactions):
+    db.add(models.Emoji(emoji_image="🔥", name="fire"))
+    db.add_all(models.UserReactionLog(post_id=post_id, user_id=1, emoji_image="🔥",
+                                      created_datetime=created, is_cancelled=cancelled)
+               for post_id, created, cancelled in reactions)
+    db.commit()
+
+
+def test_recent_reactions_outrank_older_ones(ranking_redis):
+    now = datetime(2024, 5, 10, tzinfo=timezone.utc).timestamp()
+    half_life = popular_posts_crud.POPULARITY_HALF_LIFE
+    for _ in range(3):
+        popular_posts_crud.record_reaction(1, timestamp=now - 3 * half_life)
+    for _ in range(2):
+        popular_posts_crud.record_reaction(2, timestamp=now)
+    popular_posts_crud.record_reaction(3, timestamp=now)
+    popular_posts_crud.record_reaction(3, is_cancelled=True, timestamp=now)
+
+    # 3 reactions three half lives ago weigh 3/8 of one reaction now
+    assert popular_posts_crud.get_popular_posts() == [2, 1]
+    assert popular_posts_crud.get_popular_posts(limit=1) == [2]
+
+
+def test_rebuild_matches_incremental_ranking(db, ranking_redis):
+    now = datetime(2024, 5, 10)
+    reactions = [(1, now - timedelta(days=2), False)] * 5 + \
+        [(2, now - timedelta(hours=1), False)] * 3 + \
+        [(3, now, False), (3, now, True)] + \
+        [(4, now - timedelta(days=30), False)] * 10
+    add_reaction_logs(db, reactions)
+    for post_id, created, cancelled in reactions:
+        popular_posts_crud.record_reaction(
+            post_id, cancelled, popular_posts_crud.log_timestamp(created))
+    incremental = popular_posts_crud.get_popular_posts()
+
+    assert popular_posts_crud.rebuild_popular_posts(
+        db, now=popular_posts_crud.log_timestamp(now)) == 2
+    assert popular_posts_crud.get_popular_posts() == [2, 1]
+    # the rebuild drops post 4, whose reactions are older than the window
+    assert incremental == [2, 1, 4]
+
+
+def test_cancel_takes_away_the_weight_of_its_tap(db, ranking_redis):
+    now = datetime(2024, 5, 10)
+    # post 1 was tapped a day ago, cancelled and tapped again now; post 2 tapped now
+    reactions = [(1, now - timedelta(days=1), False), (1, now, True), (1, now, False),
+                 (2, now, False)]
+    add_reaction_logs(db, reactions)
+    previous_log = None
+    for log in db.query(models.UserReactionLog).order_by(models.UserReactionLog.log_id):
+        popular_posts_crud.record_reaction_log(
+            log, previous_log if previous_log and previous_log.post_id == log.post_id else None)
+        previous_log = log
+
+    def scores():
+        return [ranking_redis.zscore(popular_posts_crud.POPULAR_POSTS_KEY, post_id)
+                for post_id in (1, 2)]
+
+    incremental = scores()
+    popular_posts_crud.rebuild_popular_posts(db, now=popular_posts_crud.log_timestamp(now))
+    assert incremental[0] == pytest.approx(incremental[1])
+    assert scores() == [1, 1]
+
+
+def test_post_whose_taps_are_all_cancelled_leaves_the_ranking(ranking_redis):
+    epoch = datetime(2024, 5, 10, tzinfo=timezone.utc).timestamp()
+    ranking_redis.set(popular_posts_crud.POPULAR_EPOCH_KEY, epoch)
+    # these two weights leave float residue once both are taken away again
+    tapped = [epoch + 3600, epoch + 7 * 3600]
+    for timestamp in tapped:
+        popular_posts_crud.record_reaction(1, timestamp=timestamp)
+    for timestamp in tapped:
+        popular_posts_crud.record_reaction(1, is_cancelled=True, timestamp=timestamp)
+
+    assert ranking_redis.zscore(popular_posts_crud.POPULAR_POSTS_KEY, 1) is None
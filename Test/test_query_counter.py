@@ -0,0 +1,53 @@
+import pytest
+
+import models
+import query_counter
+from database import load
+from query_counter import statement_shape, track_queries
+from test_challenge_details import seed_challenge
+
+
+def test_statement_shape_folds_parameters():
+    assert statement_shape("SELECT * FROM t WHERE id IN (?, ?, ?)") == \
+        statement_shape("SELECT *\n  FROM t WHERE id IN (?)")
+    assert statement_shape("SELECT * FROM t WHERE id = 3 AND name = 'a'") == \
+        statement_shape("SELECT * FROM t WHERE id = 12 AND name = 'b'")
+    assert statement_shape("SELECT * FROM t WHERE id IN (%(id_1_1)s, %(id_1_2)s)") == \
+        "SELECT * FROM t WHERE id IN (?)"
+
+
+def test_repeated_statement_shapes_are_reported(db):
+    seed_challenge(db, post_count=1, member_count=6)
+    db.expunge_all()
+    query_counter.instrument_engine(db.bind)
+
+    with track_queries() as queries:
+        for user_id in range(1, 7):
+            load(db, models.User, user_id)
+
+    assert queries.count == 6
+    assert list(queries.repeated(5).values()) == [6]
+    assert queries.repeated(7) == {}
+
+
+def test_endpoint_headers_and_route(client, db, query_budget, monkeypatch):
+    monkeypatch.setattr(query_counter, "QUERY_COUNT_HEADERS", True)
+    seed_challenge(db, post_count=1)
+    db.expunge_all()
+
+    with query_budget(5, max_repeats=1) as requests:
+        response = client.get("/GetChallengeDetailsPartA/1")
+
+    assert response.status_code == 200
+    assert int(response.headers["x-query-count"]) == requests[0].count
+    assert response.headers["x-query-repeated"] == "0"
+    assert requests[0].route == "/GetChallengeDetailsPartA/{challenge_id}"
+
+
+def test_query_budget_fails_an_endpoint_over_budget(client, db, query_budget):
+    seed_challenge(db, post_count=1)
+    db.expunge_all()
+
+    with pytest.raises(pytest.fail.Exception, match="budget 1"):
+        with query_budget(1):
+            client.get("/GetChallengeDetailsPartA/1")
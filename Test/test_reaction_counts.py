@@ -0,0 +1,300 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi import HTTPException
+
+import CRUD.challenge as challenge_crud
+import CRUD.post_reaction as post_reaction_crud
+import CRUD.reaction_counts as reaction_counts
+import models
+import schemas
+from redis_client import create_async_redis_client
+from test_challenge_details import seed_challenge
+
+
+@pytest.fixture
+def counts(redis_db, monkeypatch):
+    """ reaction_counts on the test Redis database """
+    monkeypatch.setattr(reaction_counts, "redis_client", redis_db)
+    return redis_db
+
+
+def row_count(db, post_id: int, emoji_image: str) -> int:
+    db.expire_all()
+    return db.get(models.PostReaction, (post_id, emoji_image)).count
+
+
+def test_cold_tap_counts_and_flush_seeds_totals(db, counts):
+    seed_challenge(db, post_count=3)
+
+    updated = post_reaction_crud.update_count(db, 3, "🔥", True)
+
+    assert updated == {"post_id": 3, "emoji_image": "🔥", "count": 4}
+    assert not counts.exists(reaction_counts.REACTIONS_KEY.format(3))
+    assert reaction_counts.flush_reaction_counts(db) == 1
+    assert row_count(db, 3, "🔥") == 4
+    assert reaction_counts.get_reaction_counts(db, 3) == {"🔥": 4, "👍": 1}
+    assert counts.hgetall(reaction_counts.REACTIONS_KEY.format(3)) == {
+        "🔥".encode(): b"4", "👍".encode(): b"1"}
+    assert 0 < counts.ttl(reaction_counts.REACTIONS_KEY.format(3)) <= \
+        reaction_counts.REACTION_COUNTS_TTL
+
+
+def test_taps_refresh_the_totals_expiry(db, counts):
+    seed_challenge(db, post_count=1)
+    reaction_counts.get_reaction_counts(db, 1)
+    reaction_counts.flush_reaction_counts(db)
+    totals = reaction_counts.REACTIONS_KEY.format(1)
+    counts.expire(totals, 10)
+
+    assert reaction_counts.tap(1, "🔥", 1) == 2
+    assert counts.ttl(totals) > 10
+    with pytest.raises(reaction_counts.ReactionNotFound):
+        reaction_counts.tap(1, "😀", 1)
+
+
+def test_tap_on_a_missing_reaction_is_not_found(db, counts):
+    seed_challenge(db, post_count=1)
+
+    with pytest.raises(HTTPException) as cold:
+        post_reaction_crud.update_count(db, 1, "😀", True)
+    reaction_counts.get_reaction_counts(db, 1)
+    reaction_counts.flush_reaction_counts(db)
+    with pytest.raises(HTTPException) as seeded:
+        post_reaction_crud.update_count(db, 1, "😀", True)
+
+    assert cold.value.status_code == seeded.value.status_code == 404
+    assert reaction_counts.pending_deltas(1) == {}
+
+
+def test_concurrent_taps_and_flushes_lose_no_update(db, counts):
+    seed_challenge(db, post_count=2)
+    reaction_counts.get_reaction_counts(db, 2)
+    reaction_counts.flush_reaction_counts(db)
+
+    def tap(index):
+        return reaction_counts.tap(2, "🔥", -1 if index % 4 == 0 else 1)
+
+    # the flusher keeps writing while 16 threads tap
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        taps = [pool.submit(tap, index) for index in range(400)]
+        while not all(future.done() for future in taps):
+            reaction_counts.flush_reaction_counts(db)
+        results = [future.result() for future in taps]
+    reaction_counts.flush_reaction_counts(db)
+
+    # 300 taps and 100 cancelled ones on top of the seeded 2
+    assert None not in results
+    assert reaction_counts.get_reaction_counts(db, 2)["🔥"] == 202
+    assert row_count(db, 2, "🔥") == 202
+    assert reaction_counts.pending_deltas(2) == {}
+
+
+def test_taps_during_a_flush_are_kept(db, counts, monkeypatch):
+    seed_challenge(db, post_count=1)
+    reaction_counts.get_reaction_counts(db, 1)
+    reaction_counts.flush_reaction_counts(db)
+    reaction_counts.tap(1, "👍", 1)
+
+    upsert_deltas = reaction_counts.upsert_deltas
+
+    def tap_while_writing(session, rows):
+        reaction_counts.tap(1, "👍", 1)
+        upsert_deltas(session, rows)
+        # the flush ends with the posts dirty when it started
+        monkeypatch.setattr(reaction_counts, "upsert_deltas", upsert_deltas)
+
+    monkeypatch.setattr(reaction_counts, "upsert_deltas", tap_while_writing)
+    assert reaction_counts.flush_reaction_counts(db) == 1
+
+    assert row_count(db, 1, "👍") == 2
+    assert reaction_counts.pending_deltas(1) == {"👍": 1}
+    assert reaction_counts.get_reaction_counts(db, 1)["👍"] == 3
+    reaction_counts.flush_reaction_counts(db)
+    assert row_count(db, 1, "👍") == 3
+
+
+def test_failed_flush_keeps_its_deltas(db, counts, monkeypatch):
+    seed_challenge(db, post_count=1)
+    post_reaction_crud.update_count(db, 1, "🔥", True)
+
+    def broken(_session, _rows):
+        raise RuntimeError("database down")
+
+    upsert_deltas = reaction_counts.upsert_deltas
+    monkeypatch.setattr(reaction_counts, "upsert_deltas", broken)
+    with pytest.raises(RuntimeError):
+        reaction_counts.flush_reaction_counts(db)
+    monkeypatch.setattr(reaction_counts, "upsert_deltas", upsert_deltas)
+
+    assert reaction_counts.flush_reaction_counts(db) == 1
+    assert row_count(db, 1, "🔥") == 2
+
+
+def test_deleting_a_challenge_drops_its_pending_taps(db, counts):
+    seed_challenge(db, post_count=2)
+    post_reaction_crud.update_count(db, 1, "🔥", True)
+
+    assert challenge_crud.delete_challenge(db, 1)
+
+    assert not counts.exists(reaction_counts.DIRTY_KEY, reaction_counts.DELTA_KEY.format(1))
+    assert reaction_counts.flush_reaction_counts(db) == 0
+
+
+def test_flush_drops_taps_on_posts_deleted_meanwhile(db, counts):
+    seed_challenge(db, post_count=2)
+    post_reaction_crud.update_count(db, 1, "🔥", True)
+    post_reaction_crud.update_count(db, 2, "🔥", True)
+    # deleted without forgetting its taps, e.g. by a script
+    db.query(models.PostReaction).filter(models.PostReaction.post_id == 1).delete()
+    db.query(models.PostContent).filter(models.PostContent.post_id == 1).delete()
+    db.query(models.Post).filter(models.Post.id == 1).delete()
+    db.commit()
+
+    assert reaction_counts.flush_reaction_counts(db) == 1
+    assert row_count(db, 2, "🔥") == 3
+    assert not counts.exists(reaction_counts.DELTA_KEY.format(1),
+                             reaction_counts.FLUSHING_KEY.format(1))
+    assert not counts.sismember(reaction_counts.FLUSHING_POSTS_KEY, 1)
+
+
+def test_count_written_after_the_totals_expired_seeds_nothing(db, counts):
+    seed_challenge(db, post_count=1)
+    post_reaction_crud.update_count(db, 1, "🔥", True)
+
+    reaction_counts.set_reaction_count(1, "🔥", 5)
+    assert not counts.exists(reaction_counts.REACTIONS_KEY.format(1))
+
+    reaction_counts.flush_reaction_counts(db)
+    reaction_counts.set_reaction_count(1, "🔥", 5)
+    assert counts.hget(reaction_counts.REACTIONS_KEY.format(1), "🔥") == b"5"
+
+
+def test_async_reads_match_sync_reads(db, counts, monkeypatch):
+    seed_challenge(db, post_count=2)
+    post_reaction_crud.update_count(db, 2, "👍", True)
+    async_client = create_async_redis_client(db=15)
+    monkeypatch.setattr(reaction_counts, "async_redis_client", async_client)
+
+    class AsyncSession:
+        """ Just enough of an AsyncSession over the sync test session """
+        async def execute(self, statement):
+            return db.execute(statement)
+
+    async def read():
+        try:
+            return await reaction_counts.get_reaction_counts_async(AsyncSession(), 2)
+        finally:
+            await async_client.aclose()
+            await async_client.connection_pool.disconnect()
+
+    assert asyncio.run(read()) == reaction_counts.get_reaction_counts(db, 2) == \
+        {"🔥": 2, "👍": 2}
+
+
+def test_challenge_totals_are_one_query_and_count_unflushed_taps(db, counts, count_queries):
+    seed_challenge(db, post_count=20)
+    db.add(models.BlockedUserList(blocker_user_id=1, blocked_user_id=2))
+    db.commit()
+    # 🔥 counts are the post ids, 👍 counts are 1; user 2 wrote posts 1, 6, 11 and 16
+    expected = sum(range(1, 21)) + 20 - (1 + 6 + 11 + 16) - 4
+
+    with count_queries() as statements:
+        assert post_reaction_crud.get_counts_challenge(db, 1, [2]) == expected
+    post_reaction_crud.update_count(db, 3, "🔥", True)
+    reaction_counts.flush_reaction_counts(db)
+    post_reaction_crud.update_count(db, 4, "👍", True)
+    post_reaction_crud.update_count(db, 6, "👍", True)
+
+    assert len(statements) == 1
+    assert post_reaction_crud.get_counts_challenge(db, 1, [2]) == expected + 2
+    assert post_reaction_crud.get_counts_challenge(db, 1, []) == expected + 34 + 4 + 3
+
+
+def test_challenge_totals_count_taps_a_flush_is_writing(db, counts, monkeypatch):
+    seed_challenge(db, post_count=3)
+    post_reaction_crud.update_count(db, 2, "🔥", True)
+    upsert_deltas = reaction_counts.upsert_deltas
+    during_flush = []
+
+    def read_while_writing(session, rows):
+        during_flush.append(post_reaction_crud.get_counts_challenge(session, 1, []))
+        upsert_deltas(session, rows)
+
+    monkeypatch.setattr(reaction_counts, "upsert_deltas", read_while_writing)
+    reaction_counts.flush_reaction_counts(db)
+
+    assert during_flush == [6 + 3 + 1]
+    assert post_reaction_crud.get_counts_challenge(db, 1, []) == 6 + 3 + 1
+    assert not counts.exists(reaction_counts.FLUSHING_POSTS_KEY)
+
+
+def test_challenge_totals_read_only_the_requested_posts_pending_taps(db, counts, monkeypatch):
+    seed_challenge(db, post_count=2)
+    db.add(models.Challenge(id=2, title="t2", description="d", duration=30,
+                            breaking_days=3, challenge_owner_id=2))
+    db.add(models.Post(id=3, user_id=1, challenge_id=2, written_text="post 3"))
+    db.add(models.PostReaction(post_id=3, emoji_image="🔥", count=7))
+    db.commit()
+    post_reaction_crud.update_count(db, 1, "🔥", True)
+    post_reaction_crud.update_count(db, 3, "🔥", True)
+    pending_post_deltas = reaction_counts.pending_post_deltas
+    read = []
+
+    def recorded(post_ids):
+        read.extend(post_ids)
+        return pending_post_deltas(post_ids)
+
+    monkeypatch.setattr(reaction_counts, "pending_post_deltas", recorded)
+
+    assert post_reaction_crud.get_counts_challenge(db, 1, []) == 1 + 2 + 2 + 1
+    assert sorted(read) == [1, 2]
+
+
+def test_batch_totals_use_each_owners_blocked_users(db, counts, count_queries):
+    seed_challenge(db, post_count=4)
+    db.add(models.Challenge(id=2, title="t2", description="d", duration=30,
+                            breaking_days=3, challenge_owner_id=2))
+    db.add(models.Post(id=5, user_id=1, challenge_id=2, written_text="post 5"))
+    db.add(models.PostReaction(post_id=5, emoji_image="🔥", count=7))
+    db.add(models.Challenge(id=3, title="t3", description="d", duration=30,
+                            breaking_days=3, challenge_owner_id=1))
+    db.add(models.BlockedUserList(blocker_user_id=1, blocked_user_id=3))
+    db.commit()
+
+    with count_queries() as statements:
+        totals = post_reaction_crud.get_counts_challenges(db, [1, 2, 3, 99])
+    post_reaction_crud.update_count(db, 5, "🔥", True)
+    post_reaction_crud.update_count(db, 2, "🔥", True)
+
+    # user 3 wrote post 2 of challenge 1
+    assert totals == {1: (1 + 2 + 3 + 4) + 4 - 2 - 1, 2: 7, 3: 0}
+    assert len(statements) == 2
+    assert post_reaction_crud.get_counts_challenges(db, [1, 2, 3, 99]) == \
+        {**totals, 2: 8}
+
+
+def test_flusher_logs_a_failed_flush_and_keeps_running(monkeypatch, caplog):
+    flushes = []
+
+    def flush():
+        flushes.append(1)
+        if len(flushes) == 1:
+            raise RuntimeError("database down")
+        return 0
+
+    monkeypatch.setattr(reaction_counts, "flush_with_new_session", flush)
+
+    async def run():
+        flusher = asyncio.create_task(reaction_counts.run_flusher(interval=0.01))
+        while len(flushes) < 2:
+            await asyncio.sleep(0.01)
+        flusher.cancel()
+        await asyncio.gather(flusher, return_exceptions=True)
+
+    with caplog.at_level(logging.ERROR, logger="reaction_counts.flush"):
+        asyncio.run(run())
+
+    assert [record.exc_info[0] for record in caplog.records] == [RuntimeError]
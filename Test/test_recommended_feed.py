@@ -0,0 +1,19 @@
+import Router.post as post_router
+import models
+from test_challenge_details import seed_challenge
+
+
+def test_page_keeps_feed_order_and_is_filled_past_blocked_posts(db, redis_db, monkeypatch):
+    monkeypatch.setattr(post_router, "r", redis_db)
+    seed_challenge(db, post_count=8)
+    # user 2 wrote posts 1 and 6
+    db.add(models.BlockedUserList(blocker_user_id=3, blocked_user_id=2))
+    db.commit()
+    redis_db.rpush(post_router.recommended_feed_key(3), 5, 1, 3, 6, 2, 8, 4)
+
+    first = post_router.get_recommended_posts(3, limit=3, db=db)
+    second = post_router.get_recommended_posts(3, limit=3, db=db)
+
+    assert [post.id for post in first] == [5, 3, 2]
+    # the feed runs out before the page is full
+    assert [post.id for post in second] == [8, 4]
@@ -0,0 +1,33 @@
+import numpy as np
+
+from recommender_scoring import parse_contribution, top_k_categories
+
+
+def test_top_k_orders_contributed_categories_first():
+    contributions = np.array([
+        [0, 30, 5, 60, 10],
+        [7, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0],
+    ])
+
+    ranked = top_k_categories(contributions, rng=np.random.default_rng(0))
+
+    assert ranked[0].tolist() == [3, 1, 4]
+    assert ranked[1][0] == 0
+    for row in ranked:
+        assert len(set(row.tolist())) == 3
+
+
+def test_top_k_breaks_ties_at_random():
+    contributions = np.tile([5, 5, 5, 5, 5], (2000, 1))
+
+    ranked = top_k_categories(contributions, rng=np.random.default_rng(1))
+
+    assert set(np.unique(ranked[:, 0]).tolist()) == {0, 1, 2, 3, 4}
+
+
+def test_parse_contribution_handles_missing_and_short_values():
+    assert parse_contribution(None).tolist() == [0, 0, 0, 0, 0]
+    assert parse_contribution([None] * 5).tolist() == [0, 0, 0, 0, 0]
+    assert parse_contribution([b"1", None, b"3", b"-1", b"5"]).tolist() == [1, 0, 3, -1, 5]
+    assert parse_contribution(["3", "4"]).tolist() == [3, 4, 0, 0, 0]
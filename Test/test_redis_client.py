@@ -0,0 +1,81 @@
+import asyncio
+import logging
+
+import redis
+
+import redis_client
+from prometheus_client import REGISTRY
+
+
+def commands_sent(command: str, caller: str) -> float:
+    return REGISTRY.get_sample_value(
+        "redis_commands_total", {"command": command, "caller": caller}) or 0.0
+
+
+def write_pair(client):
+    """ One command and a pipeline of two, sent from this function """
+    client.set("a", 1)
+    pipe = client.pipeline()
+    pipe.incr("a")
+    pipe.get("a")
+    return pipe.execute()
+
+
+def test_commands_are_counted_by_name_and_caller(redis_db):
+    client = redis_client.create_redis_client(db=15)
+    caller = f"{__name__}.write_pair"
+    before = {name: commands_sent(name, caller) for name in ("SET", "INCRBY", "GET")}
+
+    assert write_pair(client) == [2, b"2"]
+
+    for name, count in before.items():
+        assert commands_sent(name, caller) == count + 1
+    assert REGISTRY.get_sample_value(
+        "redis_command_duration_seconds_count", {"command": "PIPELINE"}) >= 1
+
+
+def test_slow_round_trips_are_logged(redis_db, monkeypatch, caplog):
+    client = redis_client.create_redis_client(db=15)
+    monkeypatch.setattr(redis_client, "REDIS_SLOW_COMMAND_MS", -1)
+
+    with caplog.at_level(logging.WARNING, logger="redis.slow"):
+        write_pair(client)
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith("slow redis SET from") for message in messages)
+    assert any("PIPELINE of 2 commands" in message for message in messages)
+
+
+def test_clients_share_the_pool_settings(redis_db):
+    pool = redis_db.connection_pool
+
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.max_connections == redis_client.REDIS_MAX_CONNECTIONS
+    assert pool.connection_kwargs["health_check_interval"] == \
+        redis_client.REDIS_HEALTH_CHECK_INTERVAL
+    # pylint: disable=protected-access
+    assert pool.connection_kwargs["retry"]._retries == redis_client.REDIS_RETRIES
+
+
+async def async_write_pair(client):
+    """ The async counterpart of write_pair """
+    await client.set("a", 1)
+    async with client.pipeline() as pipe:
+        pipe.incr("a")
+        pipe.get("a")
+        return await pipe.execute()
+
+
+def test_async_client_is_instrumented(redis_db):
+    caller = f"{__name__}.async_write_pair"
+    before = commands_sent("INCRBY", caller)
+
+    async def run():
+        client = redis_client.create_async_redis_client(db=15)
+        try:
+            return await async_write_pair(client)
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(run()) == [2, b"2"]
+    assert commands_sent("INCRBY", caller) == before + 1
@@ -0,0 +1,24 @@
+from datetime import date, datetime
+
+from redis_codec import (ClgInfo, decode_clg_info, decode_contribution, encode_clg_info,
+                         encode_contribution, is_encoded)
+
+
+def test_clg_info_round_trip():
+    value = encode_clg_info(3, True, 30, datetime(2024, 5, 1, 13, 45))
+
+    assert is_encoded(value)
+    assert decode_clg_info(value) == ClgInfo(3, True, 30, date(2024, 5, 1))
+    assert decode_clg_info(encode_clg_info(None, 0, 7, date(2024, 5, 1))).category is None
+
+
+def test_clg_info_reads_both_legacy_writers():
+    assert decode_clg_info(b"2,1,14,2024-05-01") == ClgInfo(2, True, 14, date(2024, 5, 1))
+    assert decode_clg_info(b"2,False,14,2024-05-01").is_public is False
+    assert decode_clg_info(None) is None
+
+
+def test_contribution_round_trip_and_legacy():
+    assert decode_contribution(encode_contribution([0, 300, -1, 5, 0])) == [0, 300, -1, 5, 0]
+    assert decode_contribution(b"1,0,10,0,20") == [1, 0, 10, 0, 20]
+    assert len(encode_contribution([1, 0, 10, 0, 20])) < len(b"1,0,10,0,20")
@@ -0,0 +1,67 @@
+from datetime import date
+
+import pytest
+
+import r1_automation
+from redis_codec import encode_clg_info
+
+
+@pytest.fixture
+def automation_redis(redis_db, monkeypatch):
+    monkeypatch.setattr(r1_automation, "r", redis_db)
+    return redis_db
+
+
+def seed_challenges(r, challenge_count: int, posts_per_challenge: int, due_day: int):
+    """ Ongoing challenges with posts, every other one completed and due on due_day """
+    for challenge_id in range(1, challenge_count + 1):
+        category = challenge_id % 5
+        r.hset("on_clg_info", challenge_id, encode_clg_info(category, True, 30, date(2024, 5, 1)))
+        post_ids = [challenge_id * 1000 + offset for offset in range(posts_per_challenge)]
+        r.lpush(f"clg{challenge_id}posts", *post_ids)
+        r.zadd(f"category{category}post", {post_id: 3 for post_id in post_ids})
+        r.hset("post_clg_pair", mapping={post_id: challenge_id for post_id in post_ids})
+        if challenge_id % 2:
+            r.zadd("completed_clg", {challenge_id: due_day})
+
+
+def test_cleanup_removes_due_challenges_in_one_round_trip(automation_redis, count_round_trips):
+    r = automation_redis
+    seed_challenges(r, challenge_count=40, posts_per_challenge=25, due_day=0)
+    r.hset("on_clg_info", 3, "3,1,30,2024-05-01")  # not migrated yet
+    r.set("day_index", 0)
+    # a server that has not seen the script yet takes a SCRIPT LOAD first
+    r.script_load(r1_automation.CLEANUP_LUA)
+
+    with count_round_trips() as calls:
+        removed = r1_automation.remove_outdated_clg_and_post_from_redis()
+
+    # the per-challenge loop took LRANGE, ZREM, HDEL and three deletes per challenge
+    assert removed == 20
+    assert len(calls) == 1
+    assert r.zcard("completed_clg") == 0
+    assert r.hlen("on_clg_info") == 20
+    assert r.hlen("post_clg_pair") == 20 * 25
+    assert not r.exists("clg1posts", "clg3posts")
+    assert r.zscore("category3post", 3000) is None
+    assert r.zscore("category2post", 2000) == 3
+
+
+def test_cleanup_works_through_challenges_in_chunks(automation_redis, monkeypatch):
+    r = automation_redis
+    seed_challenges(r, challenge_count=10, posts_per_challenge=3, due_day=4)
+    r.set("day_index", 4)
+    monkeypatch.setattr(r1_automation, "CHUNK_SIZE", 2)
+
+    assert r1_automation.remove_outdated_clg_and_post_from_redis() == 5
+    assert r.hlen("on_clg_info") == 5
+
+
+def test_day_index_advances_once_per_date(automation_redis):
+    r = automation_redis
+    r.set("day_index", r1_automation.MAX_POST_AGE - 1)
+
+    assert r1_automation.advance_day_index(date(2024, 5, 1)) == 0
+    assert r1_automation.advance_day_index(date(2024, 5, 1)) == 0
+    assert r1_automation.advance_day_index(date(2024, 5, 2)) == 1
+    assert r.get("day_index_date") == b"2024-05-02"
@@ -1,39 +1,132 @@
+import hashlib
+import json
 import os
+import threading
+import time
+from collections import Counter
 
+from cachetools import TLRUCache
 from firebase_admin import auth
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 
+from metrics import external_call
+from redis_client import redis_client
+
 
 # Set OAuth2 Bearer authentication mode
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# verified tokens kept per worker, each until its 'exp' claim
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+# share verified tokens between workers through redis
+TOKEN_CACHE_REDIS = os.environ.get("TOKEN_CACHE_REDIS", "0") == "1"
+TOKEN_CACHE_KEY = "verified_token:{}"
 
-def verify_token(token: str = Depends(oauth2_scheme)):
-    """ Verify the token and return the payload """
+# token hash -> decoded payload, expiring at the payload's exp
+token_cache = TLRUCache(maxsize=TOKEN_CACHE_SIZE,
+                        ttu=lambda _key, payload, _now: payload["exp"], timer=time.time)
+token_cache_lock = threading.Lock()
+# hits, redis_hits and misses of verify_token
+token_cache_stats = Counter()
+
+
+def token_hash(token: str) -> str:
+    """ Cache key of a token, so tokens themselves are never stored """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def unauthorized(detail: str = 'Could not validate credentials') -> HTTPException:
+    """ 401 response for a token that cannot be used """
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def verify_with_firebase(token: str, check_revoked: bool = False) -> dict:
+    """ Verify the token signature (and revocation if asked) with firebase """
     try:
-        # Simulate the verification of JWT
-        # Example payload: payload = {"user_id": "some_user_id"}
-        payload = auth.verify_id_token(token)
-        return payload
-    except auth.InvalidTokenError as ex:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Could not validate credentials',
-            headers={"WWW-Authenticate": "Bearer"},
-        ) from ex
-    except auth.ExpiredTokenError as ex:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Token has expired',
-            headers={"WWW-Authenticate": "Bearer"},
-        ) from ex
+        with external_call("firebase"):
+            return auth.verify_id_token(token, check_revoked=check_revoked)
+    except auth.ExpiredIdTokenError as ex:
+        raise unauthorized('Token has expired') from ex
+    except auth.RevokedIdTokenError as ex:
+        raise unauthorized('Token has been revoked') from ex
     except Exception as ex:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Could not validate credentials',
-            headers={"WWW-Authenticate": "Bearer"},
-        ) from ex
+        raise unauthorized() from ex
+
+
+def cached_payload(key: str):
+    """ Payload of a verified token from this worker, then from redis """
+    with token_cache_lock:
+        payload = token_cache.get(key)
+    if payload is not None:
+        token_cache_stats["hits"] += 1
+        return payload
+
+    if TOKEN_CACHE_REDIS:
+        cached = redis_client.get(TOKEN_CACHE_KEY.format(key))
+        if cached is not None:
+            payload = json.loads(cached)
+            if payload["exp"] > time.time():
+                with token_cache_lock:
+                    token_cache[key] = payload
+                token_cache_stats["redis_hits"] += 1
+                return payload
+    return None
+
+
+def cache_payload(key: str, payload: dict) -> None:
+    """ Keep a verified token's payload until it expires """
+    with token_cache_lock:
+        token_cache[key] = payload
+    if TOKEN_CACHE_REDIS:
+        redis_client.set(TOKEN_CACHE_KEY.format(key), json.dumps(payload),
+                         exat=int(payload["exp"]))
+
+
+def verify_token(token: str = Depends(oauth2_scheme)):
+    """ Verify the token and return the payload
+
+    Verified tokens are cached until their exp claim, so a client reusing its
+    ID token is verified once per worker (or once overall with TOKEN_CACHE_REDIS).
+    Revocation is not checked; use verify_token_not_revoked where it matters.
+    """
+    key = token_hash(token)
+    payload = cached_payload(key)
+    if payload is not None:
+        return payload
+
+    token_cache_stats["misses"] += 1
+    payload = verify_with_firebase(token)
+    cache_payload(key, payload)
+    return payload
+
+
+def verify_token_not_revoked(token: str = Depends(oauth2_scheme)):
+    """ Verify the token with firebase, including the revocation check, without the cache """
+    try:
+        return verify_with_firebase(token, check_revoked=True)
+    except HTTPException:
+        key = token_hash(token)
+        with token_cache_lock:
+            token_cache.pop(key, None)
+        if TOKEN_CACHE_REDIS:
+            redis_client.delete(TOKEN_CACHE_KEY.format(key))
+        raise
+
+
+def verify_admin(payload: dict = Depends(verify_token_not_revoked)):
+    """ Verify the token, including revocation, and require the admin custom claim
+
+    raise HTTPException: 403 when the user is not an admin
+    """
+    if not payload.get("admin"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="Admin privileges required")
+    return payload
 
 
 def conditional_depends(depends=Depends):
@@ -1,10 +1,19 @@
+import logging
 import os
+import threading
+import time
+from itertools import islice
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from dotenv import load_dotenv
 
+from query_counter import instrument_engine
+
 # loads environment variables from .env file
 load_dotenv()
 
@@ -16,23 +25,236 @@ DATABASE_NAME = os.environ['DATABASE_NAME']
 SQLALCHEMY_DATABASE_URL = (
     f"postgresql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
 )
+ASYNC_SQLALCHEMY_DATABASE_URL = (
+    f"postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
+)
+
+# Pool settings are per process, so size them per uvicorn worker / job
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# 0 disables the server-side statement timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '0'))
+# checkouts waiting longer than this are logged
+DB_POOL_SLOW_CHECKOUT_MS = float(
+    os.environ.get('DB_POOL_SLOW_CHECKOUT_MS', '100'))
+# rows fetched per round trip by the streaming bulk jobs
+DB_STREAM_CHUNK_SIZE = int(os.environ.get('DB_STREAM_CHUNK_SIZE', '1000'))
+
+pool_logger = logging.getLogger("database.pool")
+
+
+class TimedCheckoutMixin:
+    """ Record checkout wait time, checked-out count and overflow events on a pool """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._telemetry_lock = threading.Lock()
+        self.telemetry = {
+            "checkouts": 0,
+            "checkout_wait_total_ms": 0.0,
+            "checkout_wait_max_ms": 0.0,
+            "overflow_events": 0,
+        }
+
+    def _do_get(self):
+        overflow_before = self.overflow()
+        start = time.perf_counter()
+        connection_record = super()._do_get()
+        wait_ms = (time.perf_counter() - start) * 1000
+        self._record_checkout(wait_ms, overflow_before)
+        return connection_record
+
+    def _record_checkout(self, wait_ms: float, overflow_before: int):
+        # only a checkout that opened a new overflow connection is an overflow
+        # event, not every checkout while overflow connections are open
+        opened_overflow = self.overflow() > max(overflow_before, 0)
+        with self._telemetry_lock:
+            self.telemetry["checkouts"] += 1
+            self.telemetry["checkout_wait_total_ms"] += wait_ms
+            self.telemetry["checkout_wait_max_ms"] = max(
+                self.telemetry["checkout_wait_max_ms"], wait_ms)
+            if opened_overflow:
+                self.telemetry["overflow_events"] += 1
+        if opened_overflow:
+            pool_logger.warning(
+                "pool overflow: %d overflow connection(s), %d checked out",
+                self.overflow(), self.checkedout())
+        if wait_ms > DB_POOL_SLOW_CHECKOUT_MS:
+            pool_logger.warning(
+                "slow pool checkout: waited %.1f ms, %d checked out",
+                wait_ms, self.checkedout())
+
+
+class TimedQueuePool(TimedCheckoutMixin, QueuePool):
+    """ QueuePool with checkout telemetry """
+
+
+class TimedAsyncAdaptedQueuePool(TimedCheckoutMixin, AsyncAdaptedQueuePool):
+    """ AsyncAdaptedQueuePool with checkout telemetry """
+
+
+def pool_options() -> dict:
+    """ Environment-driven pool settings shared by every engine """
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, **engine_kwargs):
+    """ Create a psycopg2 engine with the shared pool settings and telemetry """
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    options = {**pool_options(), "poolclass": TimedQueuePool,
+               "connect_args": connect_args, **engine_kwargs}
+    return create_engine(url, **options)
+
+
+def create_async_db_engine(url: str = ASYNC_SQLALCHEMY_DATABASE_URL, **engine_kwargs):
+    """ Create an asyncpg engine with the shared pool settings and telemetry """
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        connect_args["server_settings"] = {
+            "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    options = {**pool_options(), "poolclass": TimedAsyncAdaptedQueuePool,
+               "connect_args": connect_args, **engine_kwargs}
+    return create_async_engine(url, **options)
+
+
+def pool_status(pool) -> dict:
+    """ Snapshot of a pool's size, usage and checkout telemetry """
+    status = {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
+    status.update(pool.telemetry)
+    return status
+
 
 # create a SQLAlchemy engine
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
-)
+engine = create_db_engine()
 
 # create a SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# create an async engine and AsyncSessionLocal class for async endpoints
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False)
+
+# count every statement towards the request that ran it
+instrument_engine(engine)
+instrument_engine(async_engine)
+
 # create a Base class to create database classes
 Base = declarative_base()
 
 
+def get_pool_stats() -> dict:
+    """ Pool telemetry for the sync and async engines of this process """
+    return {
+        "sync": pool_status(engine.pool),
+        "async": pool_status(async_engine.sync_engine.pool),
+    }
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def release_loaded_rows(session):
+    """ Let rows kept by load() go once their transaction ends """
+    session.info.pop("loaded_rows", None)
+
+
 def get_db():
-    """ Get a database session """
+    """ Get a database session
+
+    The session lives for one request, so its identity map is the request's
+    identity map: load() and load_many() fetch every row at most once.
+    """
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """ Get an async database session """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def stream_rows(db, statement, chunk_size: int = None):
+    """ Stream the rows of a select in lists of at most chunk_size rows
+
+    Rows come from a server-side cursor (stream_results + yield_per), so a
+    bulk job holds one chunk in memory however large the table is. Select
+    only the columns the job needs: plain rows are not tracked by the
+    session's identity map the way ORM entities are.
+    """
+    chunk_size = chunk_size or DB_STREAM_CHUNK_SIZE
+    result = db.execute(statement.execution_options(
+        stream_results=True, yield_per=chunk_size))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+
+def chunked(items, chunk_size: int = None):
+    """ Split any iterable into lists of at most chunk_size items, e.g. for IN lists """
+    chunk_size = chunk_size or DB_STREAM_CHUNK_SIZE
+    iterator = iter(items)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def keep_loaded(db, rows):
+    """ Hold rows for the rest of the transaction
+
+    The identity map only references rows weakly, so without this a row a
+    helper looked up and dropped would be fetched again by the next one.
+    """
+    db.info.setdefault("loaded_rows", []).extend(rows)
+
+
+def load(db, model, primary_key):
+    """ Row by primary key, or None
+
+    A row this transaction already loaded comes from the session's identity
+    map without a query, so helpers can look up the same User, Challenge or
+    Post freely.
+    """
+    row = db.get(model, primary_key)
+    if row is not None:
+        keep_loaded(db, [row])
+    return row
+
+
+def load_many(db, model, primary_keys) -> dict:
+    """ Rows by primary key as {primary key: row}, missing rows left out
+
+    Keys are deduplicated, rows already in the session's identity map are
+    reused, and the rest are fetched with one IN query per chunk.
+    """
+    rows, missing = {}, []
+    for primary_key in dict.fromkeys(primary_keys):
+        row = db.identity_map.get(identity_key(model, primary_key))
+        if row is not None:
+            rows[primary_key] = row
+        else:
+            missing.append(primary_key)
+    column = inspect(model).primary_key[0]
+    for chunk in chunked(missing):
+        for row in db.query(model).filter(column.in_(chunk)):
+            rows[getattr(row, column.key)] = row
+    keep_loaded(db, rows.values())
+    return rows
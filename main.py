@@ -1,13 +1,21 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import PlainTextResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
+from CRUD.reaction_counts import REACTION_FLUSH_INTERVAL, run_flusher
+from metrics import MetricsMiddleware
+from query_counter import QueryCountMiddleware
+
 from Router.automation import router as automation_router
 from Router.blocked_user_list import router as blocked_user_router
 from Router.challenge import router as challenge_router
 from Router.course import router as course_router
 from Router.expo_push_token import router as expo_push_token_router
+from Router.metrics import router as metrics_router
 from Router.post import router as post_router
 from Router.post_content import router as post_content_router
 from Router.post_reaction import router as post_reaction_router
@@ -17,7 +25,22 @@ from Router.tracking import router as tracking_router
 from Router.user import router as user_router
 from Router.user_reaction_log import router as user_reaction_log_router
 
-app = FastAPI()
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """ Run the reaction count flusher while the app is up """
+    if REACTION_FLUSH_INTERVAL <= 0:
+        yield
+        return
+    flusher = asyncio.create_task(run_flusher(REACTION_FLUSH_INTERVAL))
+    yield
+    flusher.cancel()
+    with suppress(asyncio.CancelledError):
+        await flusher
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(user_router)
 app.include_router(course_router)
 app.include_router(tracking_router)
@@ -31,12 +54,15 @@ app.include_router(automation_router)
 app.include_router(expo_push_token_router)
 app.include_router(send_notification)
 app.include_router(blocked_user_router)
+app.include_router(metrics_router)
 
 
 origins = [
     "http://localhost:3000",
 ]
 
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryCountMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -47,7 +73,7 @@ app.add_middleware(
 
 
 @app.exception_handler(StarletteHTTPException)
-async def http_exception_handler(exc: StarletteHTTPException):
+async def http_exception_handler(_request, exc: StarletteHTTPException):
     """ Handle HTTPException """
     print(f"{repr(exc)}")
     return PlainTextResponse(str(exc.detail), status_code=exc.status_code)
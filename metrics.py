@@ -0,0 +1,155 @@
+""" Prometheus metrics for the API
+
+MetricsMiddleware counts requests, tracks the requests in flight and times
+every request, labelled by route template (/GetChallenge/{challenge_id})
+rather than by raw path. Within a request, Redis commands (redis_client.py)
+and external calls wrapped in external_call() add their time to the request,
+which is observed per route next to the DB time counted by query_counter.
+
+The Redis client (redis_client.py) also counts commands by name and caller
+and times every round trip.
+
+Metrics live in this process's registry: with several uvicorn workers every
+worker serves its own /metrics.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from prometheus_client import Counter, Gauge, Histogram
+
+import query_counter
+
+# request latencies, in seconds
+LATENCY_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10)
+# time spent in one backend during a request, in seconds
+BACKEND_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests served", ["method", "route", "status"])
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being served", ["method"])
+LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+    buckets=LATENCY_BUCKETS)
+DB_TIME = Histogram(
+    "http_request_db_seconds", "Time a request spent in SQL statements", ["route"],
+    buckets=BACKEND_BUCKETS)
+DB_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements run by a request", ["route"],
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+REDIS_TIME = Histogram(
+    "http_request_redis_seconds", "Time a request spent in Redis commands", ["route"],
+    buckets=BACKEND_BUCKETS)
+EXTERNAL_TIME = Histogram(
+    "http_request_external_seconds", "Time a request spent calling an external service",
+    ["route", "service"], buckets=LATENCY_BUCKETS)
+EXTERNAL_CALLS = Histogram(
+    "external_call_duration_seconds", "Latency of calls to S3, Expo and Firebase",
+    ["service"], buckets=LATENCY_BUCKETS)
+
+REDIS_COMMANDS = Counter(
+    "redis_commands_total", "Redis commands sent, pipelined ones included",
+    ["command", "caller"])
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Latency of a Redis round trip: a command, or a whole pipeline as PIPELINE",
+    ["command"], buckets=BACKEND_BUCKETS)
+
+# kind ('redis' or an external service) -> seconds spent by the current request
+current_timings: ContextVar = ContextVar("current_timings", default=None)
+
+
+def add_request_time(kind: str, seconds: float):
+    """ Add time spent in a backend to the current request, if any """
+    timings = current_timings.get()
+    if timings is not None:
+        timings[kind] = timings.get(kind, 0.0) + seconds
+
+
+@contextmanager
+def external_call(service: str):
+    """ Time a call to an external service ('s3', 'expo', 'firebase') """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        EXTERNAL_CALLS.labels(service).observe(seconds)
+        add_request_time(service, seconds)
+
+
+# labels() locks and hashes on every call; routes and methods are a small
+# fixed set, so the labelled children are looked up once and kept
+@lru_cache(maxsize=None)
+def request_counter(method: str, route: str, status: int):
+    """ http_requests_total child of a method, route and status """
+    return REQUESTS.labels(method, route, status)
+
+
+@lru_cache(maxsize=None)
+def in_progress_gauge(method: str):
+    """ http_requests_in_progress child of a method """
+    return IN_PROGRESS.labels(method)
+
+
+@lru_cache(maxsize=None)
+def route_histograms(method: str, route: str) -> tuple:
+    """ (latency, Redis time) children of a method and route """
+    return LATENCY.labels(method, route), REDIS_TIME.labels(route)
+
+
+@lru_cache(maxsize=None)
+def query_histograms(route: str) -> tuple:
+    """ (DB time, DB queries) children of a route """
+    return DB_TIME.labels(route), DB_QUERIES.labels(route)
+
+
+def observe_queries(queries: query_counter.RequestQueries):
+    """ Observe a finished request's SQL statements under its route """
+    db_time, db_queries = query_histograms(queries.route)
+    db_time.observe(queries.seconds)
+    db_queries.observe(queries.count)
+
+
+query_counter.request_listeners.append(observe_queries)
+
+
+class MetricsMiddleware:
+    """ ASGI middleware recording the request metrics above """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        timings = {}
+        token = current_timings.set(timings)
+        in_progress = in_progress_gauge(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - start
+            in_progress.dec()
+            current_timings.reset(token)
+            route = query_counter.route_template(scope)
+            request_counter(method, route, status[0]).inc()
+            latency, redis_time = route_histograms(method, route)
+            latency.observe(seconds)
+            redis_time.observe(timings.pop("redis", 0.0))
+            for service, service_seconds in timings.items():
+                EXTERNAL_TIME.labels(route, service).observe(service_seconds)
@@ -67,6 +67,8 @@ class GroupChallengeMembers(Base):
     breaking_days_left = Column(Integer, nullable=False)
     is_challenge_finished = Column(Boolean, default=False, nullable=False)
     days_left = Column(Integer, nullable=False)
+    # leads the automation's keyset, so members joining old challenges are read too
+    created_time = Column(DateTime, default=func.now(), nullable=False, index=True)
 
 
 class Post(Base):
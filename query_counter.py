@@ -0,0 +1,165 @@
+""" Per-request SQL query counting and N+1 detection
+
+QueryCountMiddleware gives every HTTP request a RequestQueries record, and
+the cursor events of every instrumented engine add each statement and its
+time to the record of the request that ran it. A statement shape (the SQL
+with its IN lists and literals folded) run QUERY_REPEAT_THRESHOLD times or
+more in one request is reported as a likely N+1.
+
+Outside production (MODE set to anything but 'production') the counts are
+returned as X-Query-* response headers; in every mode N+1 requests are
+logged and each finished request goes to request_listeners, where metrics.py
+observes it in the http_request_db_queries histogram.
+"""
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# the same statement shape this many times in one request is reported as N+1
+QUERY_REPEAT_THRESHOLD = int(os.environ.get("QUERY_REPEAT_THRESHOLD", "5"))
+# X-Query-* headers are only sent outside production
+QUERY_COUNT_HEADERS = os.environ.get("MODE", "production") != "production"
+
+query_logger = logging.getLogger("database.queries")
+
+PLACEHOLDER = r"(?:\?|%s|%\([^)]*\)s|\$\d+|:\w+)"
+IN_LIST = re.compile(rf"\(\s*{PLACEHOLDER}(?:\s*,\s*{PLACEHOLDER})*\s*\)")
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+
+
+class RequestQueries:
+    """ Statements one request ran: count, time spent and how often each shape ran """
+
+    __slots__ = ("count", "seconds", "shapes", "route")
+
+    def __init__(self, route: str = None):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.route = route
+
+    def add(self, statement: str, seconds: float):
+        """ Record one statement """
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold: int = None) -> dict:
+        """ {shape: times run} for the shapes run at least threshold times """
+        threshold = threshold or QUERY_REPEAT_THRESHOLD
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+
+current_queries: ContextVar = ContextVar("current_queries", default=None)
+
+# finished requests go to these callbacks, e.g. metrics.py and the query_budget fixture
+request_listeners = []
+
+
+def statement_shape(statement: str) -> str:
+    """ The statement with IN lists, literals and whitespace folded
+
+    Statements differing only in their parameters have the same shape, so a
+    loop running one query per row shows up as one shape run many times.
+    """
+    shape = IN_LIST.sub("(?)", statement)
+    shape = LITERAL.sub("?", shape)
+    return WHITESPACE.sub(" ", shape).strip()
+
+
+def before_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    """ Remember when the statement was sent """
+    if current_queries.get() is not None:
+        context.query_counter_start = time.perf_counter()
+
+
+def after_cursor_execute(_conn, _cursor, statement, _parameters, context, _executemany):
+    """ Add the statement to the current request, if any """
+    queries = current_queries.get()
+    start = getattr(context, "query_counter_start", None)
+    if queries is not None and start is not None:
+        queries.add(statement, time.perf_counter() - start)
+
+
+def instrument_engine(engine):
+    """ Count the statements of a sync engine, or of an AsyncEngine's sync_engine """
+    engine = getattr(engine, "sync_engine", engine)
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+@contextmanager
+def track_queries(route: str = None):
+    """ Collect the statements run in this context into a new RequestQueries """
+    queries = RequestQueries(route)
+    token = current_queries.set(queries)
+    try:
+        yield queries
+    finally:
+        current_queries.reset(token)
+
+
+def record_route_queries(queries: RequestQueries):
+    """ Report an N+1 and hand a finished request to the request listeners """
+    for shape, count in queries.repeated().items():
+        query_logger.warning("possible N+1 on %s: %d x %s", queries.route, count, shape)
+    for listener in request_listeners:
+        listener(queries)
+
+
+def route_template(scope) -> str:
+    """ Path template of the matched route, e.g. /GetChallenge/{challenge_id}
+
+    Requests matching no route share one label, so stray paths cannot grow
+    the per-route stats without bound.
+    """
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or "<unmatched>"
+
+
+def query_headers(queries: RequestQueries) -> list:
+    """ X-Query-* headers describing the request's statements """
+    return [
+        (b"x-query-count", str(queries.count).encode()),
+        (b"x-query-time-ms", f"{queries.seconds * 1000:.1f}".encode()),
+        (b"x-query-repeated", str(len(queries.repeated())).encode()),
+    ]
+
+
+class QueryCountMiddleware:
+    """ ASGI middleware counting the SQL statements of every HTTP request
+
+    headers: send the X-Query-* headers; None follows QUERY_COUNT_HEADERS
+    """
+
+    def __init__(self, app, headers: bool = None):
+        self.app = app
+        self.headers = headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as queries:
+            headers = QUERY_COUNT_HEADERS if self.headers is None else self.headers
+
+            async def send_with_counts(message):
+                if message["type"] == "http.response.start" and headers:
+                    message = {**message,
+                               "headers": [*message.get("headers", []), *query_headers(queries)]}
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_counts)
+            finally:
+                queries.route = route_template(scope)
+                record_route_queries(queries)
@@ -1,20 +1,88 @@
 import datetime
 import os
+import time
 from typing import Union
 
 import pytz
-import redis
-from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import session, sessionmaker
+from sqlalchemy import DateTime, func, select, tuple_
+from sqlalchemy.orm import session
 from redis_client import r
 
+import CRUD.discover as discover_crud
+import CRUD.popular_posts as popular_posts_crud
 import models
+from database import SessionLocal, stream_rows
+from redis_codec import decode_clg_info, encode_clg_info
 
 CLG_CATEGORY = 5
 MAX_POST_AGE = 30
-r = redis.Redis(host='localhost', port=6379, db=0)
+# rows streamed from the database and flushed to redis per round trip
+CHUNK_SIZE = int(os.environ.get('AUTOMATION_CHUNK_SIZE', '1000'))
+# hash of the last processed primary key of every stage
+WATERMARK_KEY = 'db_watermark'
+# members are read once they are this old, so joins still being committed
+# with an earlier created_time are not passed by the watermark
+MEMBER_SETTLE_SECONDS = int(os.environ.get('MEMBER_SETTLE_SECONDS', '300'))
+# per-user hash of days spent on every challenge category
+CONTRIBUTION_KEY = 'user_contribution:{}'
+
+# KEYS: day_index, completed_clg, on_clg_info, post_clg_pair
+# ARGV: maximum number of challenges to remove
+# Removes challenges due at the current day index with all their posts, each call atomic.
+# The category is the first element of the redis_codec array, a msgpack positive fixint.
+CLEANUP_LUA = """
+local function category_of(info)
+    if string.byte(info, 1) == 1 then
+        local category = string.byte(info, 3)
+        if category < 128 then return category end
+        return nil
+    end
+    return tonumber(string.match(info, '^(%d+),'))
+end
+
+local day_index = redis.call('GET', KEYS[1]) or '-1'
+local challenges = redis.call('ZRANGEBYSCORE', KEYS[2], day_index, day_index, 'LIMIT', 0, ARGV[1])
+local categories = {}
+for index, challenge_id in ipairs(challenges) do
+    local info = redis.call('HGET', KEYS[3], challenge_id)
+    if not info then
+        return redis.error_reply('challenge ' .. challenge_id .. ' is not found')
+    end
+    categories[index] = category_of(info) or false
+end
+
+for index, challenge_id in ipairs(challenges) do
+    local posts_key = 'clg' .. challenge_id .. 'posts'
+    local posts = redis.call('LRANGE', posts_key, 0, -1)
+    for first = 1, #posts, 5000 do
+        local last = math.min(first + 4999, #posts)
+        if categories[index] then
+            redis.call('ZREM', 'category' .. categories[index] .. 'post', unpack(posts, first, last))
+        end
+        redis.call('HDEL', KEYS[4], unpack(posts, first, last))
+    end
+    redis.call('HDEL', KEYS[3], challenge_id)
+    redis.call('DEL', posts_key)
+    redis.call('ZREM', KEYS[2], challenge_id)
+end
+return #challenges
+"""
+
+# KEYS: day_index, day_index_date
+# ARGV: today's date, MAX_POST_AGE
+# Advances the day index once per date, so a resumed run keeps the index of the failed one.
+ROLLOVER_LUA = """
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+    local day_index = tonumber(redis.call('GET', KEYS[1])) or -1
+    redis.call('SET', KEYS[1], (day_index + 1) % tonumber(ARGV[2]))
+    redis.call('SET', KEYS[2], ARGV[1])
+end
+return tonumber(redis.call('GET', KEYS[1]))
+"""
+
+# loaded on first use and then called by EVALSHA
+cleanup_script = r.register_script(CLEANUP_LUA)
+rollover_script = r.register_script(ROLLOVER_LUA)
 
 
 def byte_to_utf8(item: Union[str, bytes], multiple_items=False, str_split_symbol: str = None, error_result=None):
@@ -73,24 +141,25 @@ def get_redis_value(
     """
 
     value = None
-    if r.type(getting_key) == b'string':
+    key_type = r.type(getting_key)
+    if key_type == b'string':
         value = r.get(getting_key)
         value = byte_to_utf8(value)
-    elif r.type(getting_key) == b'hash':
+    elif key_type == b'hash':
         value = r.hget(getting_key, hash_field)
         value = byte_to_utf8(value, str_split_symbol=split_symbol)
-    elif r.type(getting_key) == b'list':
+    elif key_type == b'list':
         if ranges:
             value = r.lrange(getting_key, ranges[0], ranges[1])
         else:
             value = r.lrange(getting_key, 0, -1)
         value = byte_to_utf8(value, multiple_items=True)
-    elif r.type(getting_key) == b'set':
+    elif key_type == b'set':
         value = r.smembers(getting_key)
         value = list(value)
         value = byte_to_utf8(value, multiple_items=True)
         value = set(value)
-    elif r.type(getting_key) == b'zset':
+    elif key_type == b'zset':
         if score:
             value = r.zrangebyscore(getting_key, score[0], score[1])
         elif ranges:
@@ -140,109 +209,227 @@ def set_redis_value(
             r.zincrby(setting_key, value[1], value[0])
 
 
-def remove_outdated_clg_and_post_from_redis() -> None:
-    """ Remove outdated challenges and posts from redis. """
-    day_index = get_redis_value('day_index', error_result=-1)
+def get_watermark(stage: str, key_columns: list) -> tuple:
+    """
+    param stage: field of the stage in db_watermark, one of 'clg', 'mmbr', 'post', 'reaction'.
+    param key_columns: primary key column(s) the stage reads new rows by.
 
-    outdated_clg = get_redis_value('completed_clg', score=[
-        day_index, day_index], error_result=[])
+    return: the last processed primary key of the stage.
+    A stage without a watermark starts after the first db_len rows, the row count
+    recorded by earlier versions of this job.
+    """
+    watermark = get_redis_value(WATERMARK_KEY, stage, split_symbol=',')
+    if watermark:
+        return parse_watermark(session, watermark, key_columns)
 
-    # Removed outdated challenges and posts from redis.
-    for challenge_id in outdated_clg:
-        # get challenge category
-        try:
-            category = get_redis_value(
-                'on_clg_info', challenge_id, split_symbol=',')[0]
-        except IndexError as inner_e:
-            raise KeyError(
-                f'challenge {challenge_id} is not found') from inner_e
+    processed = get_redis_value('db_len', stage, error_result=0)
+    last_row = None
+    if processed:
+        last_row = session.query(*key_columns).order_by(*key_columns)\
+            .offset(processed - 1).first() or \
+            session.query(*key_columns)\
+            .order_by(*[column.desc() for column in key_columns]).first()
+    return tuple(last_row) if last_row else (0,) * len(key_columns)
+
+
+def parse_watermark(db, watermark, key_columns: list) -> tuple:
+    """
+    param db: the session of the stage.
+    param watermark: the stored watermark values, one per key column.
+    param key_columns: key column(s) the stage reads new rows by.
+
+    return: the watermark with date values parsed back to datetimes.
+    A member watermark from before created_time led its key lacks the date;
+    the rows it covers all got the date the column was added, the oldest one.
+    """
+    watermark = list(watermark)
+    if len(watermark) == len(key_columns) - 1:
+        watermark.insert(0, db.query(func.min(key_columns[0])).scalar() or datetime.datetime.min)
+    return tuple(
+        datetime.datetime.fromisoformat(str(value)) if isinstance(column.type, DateTime)
+        else int(value) for value, column in zip(watermark, key_columns))
+
+
+def settled_members_filter(db):
+    """
+    param db: the session of the stage.
+
+    return: a filter on members older than MEMBER_SETTLE_SECONDS by the database clock.
+    """
+    now = db.query(func.now()).scalar()
+    return models.GroupChallengeMembers.created_time <= \
+        now - datetime.timedelta(seconds=MEMBER_SETTLE_SECONDS)
+
+
+def new_rows_in_chunks(columns: list, stage: str, key_columns: list, where=None):
+    """
+    param columns: the columns the stage needs, including key_columns.
+    param stage: field of the stage in db_watermark.
+    param key_columns: key column(s) the stage reads new rows by.
+    param where: an extra filter on the rows.
+
+    Stream the rows after the stage's watermark in key order,
+    in chunks of CHUNK_SIZE rows from a server-side cursor.
+    """
+    watermark = get_watermark(stage, key_columns)
+    if len(key_columns) == 1:
+        after_watermark = key_columns[0] > watermark[0]
+    else:
+        after_watermark = tuple_(*key_columns) > tuple_(*watermark)
+    statement = select(*columns).where(after_watermark).order_by(*key_columns)
+    if where is not None:
+        statement = statement.where(where)
+    return stream_rows(session, statement, CHUNK_SIZE)
+
+
+def set_watermark(pipe, stage: str, last_row, key_columns: list) -> None:
+    """
+    param pipe: the transactional pipeline holding the writes of a chunk.
+    param stage: field of the stage in db_watermark.
+    param last_row: the last row of the chunk.
+    param key_columns: primary key column(s) of the table.
 
-        # remove posts of this challenge from redis
-        for post in get_redis_value(f'clg{challenge_id}posts'):
-            r.zrem(f'category{category}post', post)
-            r.hdel('post_clg_pair', post)
+    Queue the watermark update, so it commits together with the chunk's writes.
+    """
+    pipe.hset(WATERMARK_KEY, stage, ','.join(
+        str(getattr(last_row, column.key)) for column in key_columns))
+
+
+def get_redis_hash_values(
+        getting_key: str, hash_fields, split_symbol: str = None, decoder=None) -> dict:
+    """
+    param getting_key: a redis hash key
+    param hash_fields: fields to read from the hash
+    param split_symbol: a string used as splitting character in the stored values.
+    param decoder: a redis_codec decode function for binary encoded values.
 
-        # remove challenge detail from redis
-        r.hdel('on_clg_info', challenge_id)
-        r.delete(f'clg{challenge_id}posts')
-        r.zrem('completed_clg', challenge_id)
+    Read many fields of a hash in one HMGET round trip.
+    return: {field: value in utf8 format, or decoded} for every field that exists.
+    """
+    hash_fields = list(dict.fromkeys(hash_fields))
+    if not hash_fields:
+        return {}
+    values = r.hmget(getting_key, hash_fields)
+    return {field: decoder(value) if decoder else
+            byte_to_utf8(value, str_split_symbol=split_symbol)
+            for field, value in zip(hash_fields, values) if value is not None}
+
+
+def contribution_key(user_id) -> str:
+    """ Redis hash of a user's contribution, one field per category code """
+    return CONTRIBUTION_KEY.format(user_id)
+
+
+def remove_outdated_clg_and_post_from_redis() -> int:
+    """
+    Remove outdated challenges and posts from redis.
+
+    CLEANUP_LUA removes up to CHUNK_SIZE challenges with all their posts per call,
+    so the stage costs one round trip per CHUNK_SIZE challenges.
+    """
+    removed = 0
+    while True:
+        count = cleanup_script(
+            keys=['day_index', 'completed_clg', 'on_clg_info', 'post_clg_pair'],
+            args=[CHUNK_SIZE], client=r)
+        removed += count
+        if count < CHUNK_SIZE:
+            return removed
 
 
-def add_new_ongoing_challenges_to_redis() -> None:
+def advance_day_index(date_today: datetime.date) -> int:
     """
-    For every new challenges, this function add {challenge_id: 'category,is_public,
-    duration,done_by' as field value pair to redis object called on_clg_info/
+    param date_today: today's date.
 
-    Record the updated table length in the end. 
+    Move day_index to the next slot the first time it is called on a date.
+    return: the day index of today's run.
     """
-    clg_len = get_redis_value('db_len', 'clg', error_result=0)
-    challenges = session.query(models.Challenge).offset(clg_len)
+    return rollover_script(
+        keys=['day_index', 'day_index_date'], args=[str(date_today), MAX_POST_AGE], client=r)
+
+
+def add_new_ongoing_challenges_to_redis() -> int:
+    """
+    For every new challenges, this function add {challenge_id: (category, is_public,
+    duration, done_by)} as field value pair to redis object called on_clg_info,
+    encoded by redis_codec.encode_clg_info.
+
+    Every chunk commits its last challenge id as the stage's watermark.
+    """
+    key_columns = [models.Challenge.id]
+    challenges = new_rows_in_chunks(
+        [models.Challenge.id, models.Challenge.category, models.Challenge.is_public,
+         models.Challenge.duration, models.Challenge.created_time], 'clg', key_columns)
 
     clg_count = 0
 
-    for instance in challenges:
-        clg_count += 1
+    for chunk in challenges:
+        clg_count += len(chunk)
 
-        challenge_id = instance.id
-        category = instance.category
-        is_public = 1 if instance.is_public else 0
-        duration = instance.duration
-        done_by = (instance.created_time +
-                   datetime.timedelta(days=duration)).strftime("%Y-%m-%d")
+        clg_info = {}
+        for instance in chunk:
+            done_by = instance.created_time + datetime.timedelta(days=instance.duration)
+            clg_info[instance.id] = encode_clg_info(
+                instance.category, instance.is_public, instance.duration, done_by)
 
-        value = f'{category},{is_public},{duration},{done_by}'
-        set_redis_value(['on_clg_info', challenge_id], 'hash', value)
+        pipe = r.pipeline(transaction=True)
+        pipe.hset('on_clg_info', mapping=clg_info)
+        set_watermark(pipe, 'clg', chunk[-1], key_columns)
+        pipe.execute()
 
-    # update table CHALLENGE's length
-    set_redis_value(['db_len', 'clg'], 'hash', clg_count, 'incr')
+    return clg_count
 
 
-def update_challenge_distribution_for_users() -> None:
+def update_challenge_distribution_for_users() -> int:
     """
     This function iterate through new records in GroupChallengeMembers. 
     For users with new challenges, update his/her contribution on challenge 
     categories based on the duration of the new challenge. 
 
-    Record the updated table length in the end. 
+    Rows are read by (created_time, challenge_id, user_id), so a user joining
+    an older challenge is picked up too. Every chunk commits its last key as
+    the stage's watermark.
     """
 
-    mmbr_len = get_redis_value('db_len', 'mmbr', error_result=0)
-    members = session.query(models.GroupChallengeMembers).offset(mmbr_len)
+    key_columns = [models.GroupChallengeMembers.created_time,
+                   models.GroupChallengeMembers.challenge_id,
+                   models.GroupChallengeMembers.user_id]
+    members = new_rows_in_chunks(key_columns, 'mmbr', key_columns,
+                                 where=settled_members_filter(session))
 
     mmbr_count = 0
 
-    for instance in members:
-        mmbr_count += 1
+    for chunk in members:
+        mmbr_count += len(chunk)
 
-        challenge_id = instance.challenge_id
-        clg_detail = get_redis_value(
-            'on_clg_info', challenge_id, split_symbol=',', error_result=[])
+        clg_info = get_redis_hash_values(
+            'on_clg_info', [instance.challenge_id for instance in chunk],
+            decoder=decode_clg_info)
+        ongoing = [instance for instance in chunk if clg_info.get(instance.challenge_id)]
 
-        if not clg_detail:
-            continue
+        # increment every user's contribution in place, so overlapping runs cannot lose updates
+        pipe = r.pipeline(transaction=True)
+        for instance in ongoing:
+            details = clg_info[instance.challenge_id]
+            pipe.hincrby(contribution_key(instance.user_id), details.category, details.duration)
+        set_watermark(pipe, 'mmbr', chunk[-1], key_columns)
+        pipe.execute()
 
-        category = clg_detail[0]
-        duration = clg_detail[2]
+    return mmbr_count
 
-        user_id = instance.user_id
 
-        # get user's current contribution
-        contribution = get_redis_value(
-            'user_contribution', user_id, split_symbol=',', error_result=[0]*5)
+def get_due_day_index(day_index: int, duration: int) -> int:
+    """ Day index at which a completed challenge's posts leave the recommendation pool """
+    if duration <= 14:
+        return (day_index + MAX_POST_AGE//5) % MAX_POST_AGE
+    if duration <= 35:
+        return (day_index + MAX_POST_AGE//4) % MAX_POST_AGE
+    if duration <= 49:
+        return (day_index + MAX_POST_AGE//3) % MAX_POST_AGE
+    return (day_index + MAX_POST_AGE//2) % MAX_POST_AGE
 
-        # modify user contribution according to the challenge's category
-        contribution[category] += duration
-        contribution = [str(num) for num in contribution]
-        contribution = ','.join(contribution)
 
-        # update change to redis
-        set_redis_value(['user_contribution', user_id], 'hash', contribution)
-
-    # update table MEMBER's length
-    set_redis_value(['db_len', 'mmbr'], mmbr_count, 'incr')
-
-
-def classify_new_posts() -> None:
+def classify_new_posts() -> int:
     """
     Each post is associated with one challenge, and each challenge has a category code.
     This function examines newly created posts. If a post is public and not mean to be break, 
@@ -254,195 +441,177 @@ def classify_new_posts() -> None:
     """
 
     # remove posts that are older than max_post_age from redis.
-    day_index = get_redis_value('day_index', error_result=-1)
+    day_index = byte_to_utf8(r.get('day_index'), error_result=-1)
 
-    for category_index in range(CLG_CATEGORY):
-        key_name = f'category{category_index}post'
-        r.zremrangebyscore(key_name, day_index, day_index)
+    # new posts reuse this day index, so a resumed run must not expire it again
+    if byte_to_utf8(r.get('expired_day_index')) != day_index:
+        pipe = r.pipeline(transaction=True)
+        for category_index in range(CLG_CATEGORY):
+            pipe.zremrangebyscore(f'category{category_index}post', day_index, day_index)
+        pipe.set('expired_day_index', day_index)
+        pipe.execute()
 
     # retrieve new post records from data base
-    post_len = get_redis_value('db_len', 'post', error_result=0)
-    posts = session.query(models.Post).offset(post_len)
+    key_columns = [models.Post.id]
+    posts = new_rows_in_chunks(
+        [models.Post.id, models.Post.challenge_id, models.Post.user_id,
+         models.Post.written_text], 'post', key_columns)
+    today = datetime.datetime.now().date()
 
     # record the number of posts being processed
     post_count = 0
 
-    for instance in posts:
-        post_count += 1
-
-        # get data for challenge_id, post_id, is_breaking_day
-        challenge_id = instance.challenge_id
-        post_id = instance.id
-        user_id = instance.user_id
+    for chunk in posts:
+        post_count += len(chunk)
 
-        # check whether this post belong to an ongoing challenge
-        try:  # retrieve challenge data
-            category, is_public, duration, finish_date = get_redis_value(
-                'on_clg_info', challenge_id, split_symbol=',')
-        except (TypeError, ValueError) as inner_e:
-            raise KeyError(
-                f'post_id: {post_id}, challenge_id: {challenge_id}.\nThis challenge is not ongoing.') from inner_e
+        # check whether these posts belong to ongoing challenges
+        clg_info = get_redis_hash_values(
+            'on_clg_info', [instance.challenge_id for instance in chunk],
+            decoder=decode_clg_info)
+        for instance in chunk:
+            if instance.challenge_id not in clg_info:
+                raise KeyError(
+                    f'post_id: {instance.id}, challenge_id: {instance.challenge_id}.'
+                    '\nThis challenge is not ongoing.')
 
         # if breaking day, decrement user's contribution
-        if instance.written_text == 'I have a break today.':
-            contribution = get_redis_value(
-                'user_contribution', user_id, split_symbol=',', error_result=[0]*5)
-            try:
-                contribution[category] -= 1
-            except IndexError as inner_e:
+        pipe = r.pipeline(transaction=True)
+        for instance in chunk:
+            if instance.written_text != 'I have a break today.':
+                continue
+            category = clg_info[instance.challenge_id].category
+            if category not in range(CLG_CATEGORY):
                 raise IndexError(
-                    f'challenge category are from 0 to 4 included, got {category}') from inner_e
-            else:
-                contribution = [str(num) for num in contribution]
-                contribution = ','.join(contribution)
-                set_redis_value(['user_contribution', user_id],
-                                'hash', contribution)
+                    f'challenge category are from 0 to 4 included, got {category}')
+            pipe.hincrby(contribution_key(instance.user_id), category, -1)
+
+        for instance in chunk:
+            if instance.written_text == 'I have a break today.':
                 continue
+            challenge_id = instance.challenge_id
+            post_id = instance.id
+            category, is_public, duration, finish_date = clg_info[challenge_id]
 
-        ##### testing #####
-        if not os.path.exists('redis_output'):
-            os.makedirs('redis_output')
-        if not r.exists(f'clg{challenge_id}posts'):
-            with open('./redis_output/clg_posts.txt', 'a', encoding="utf-8") as clg_posts_file:
-                clg_posts_file.write(f'clg{challenge_id}posts')
-                clg_posts_file.write(',')
-        ##### testing #####
-
-        # if not breaking day and public, add post_id to redis
-        if is_public:
-            set_redis_value(f'category{category}post',
-                            'zset', [post_id, day_index])
-            set_redis_value(['post_clg_pair', post_id], 'hash', challenge_id)
-            set_redis_value(f'clg{challenge_id}posts',
-                            'list', post_id, 'push left')
-
-        # check whether current challenge is completed, record completed challenge
-        # so we can remove related posts from recommended_post_pool soon.
-        if datetime.datetime.strptime(finish_date[:], '%Y-%m-%d').date() == datetime.datetime.now().date():
-            if duration <= 14:
-                due_day_index = (day_index + MAX_POST_AGE//5) % MAX_POST_AGE
-            elif duration <= 35:
-                due_day_index = (day_index + MAX_POST_AGE//4) % MAX_POST_AGE
-            elif duration <= 49:
-                due_day_index = (day_index + MAX_POST_AGE//3) % MAX_POST_AGE
-            else:
-                due_day_index = (day_index + MAX_POST_AGE//2) % MAX_POST_AGE
-            set_redis_value('completed_clg', 'zset', [
-                challenge_id, due_day_index])
+            # if not breaking day and public, add post_id to redis
+            if is_public:
+                pipe.zadd(f'category{category}post', {post_id: day_index})
+                pipe.hset('post_clg_pair', post_id, challenge_id)
+                pipe.lpush(f'clg{challenge_id}posts', post_id)
 
-    # update table POST's length
-    set_redis_value(['db_len', 'post'], 'hash', post_count, 'incr')
+            # check whether current challenge is completed, record completed challenge
+            # so we can remove related posts from recommended_post_pool soon.
+            if finish_date == today:
+                pipe.zadd('completed_clg', {
+                    challenge_id: get_due_day_index(day_index, duration)})
+        set_watermark(pipe, 'post', chunk[-1], key_columns)
+        pipe.execute()
 
+    return post_count
 
-def process_recent_reaction_data() -> None:
+
+def process_recent_reaction_data() -> int:
     """
     this function add post_id and challenge_id of newly generated reaction data to 
     the corresponding Redis set with user_id as main part of the key.
     """
     # read UserReactionLog table
-    reaction_len = get_redis_value('db_len', 'reaction', error_result=0)
-    reactions = session.query(models.UserReactionLog).offset(reaction_len)
+    key_columns = [models.UserReactionLog.log_id]
+    reactions = new_rows_in_chunks(
+        [models.UserReactionLog.log_id, models.UserReactionLog.post_id,
+         models.UserReactionLog.user_id, models.UserReactionLog.is_cancelled],
+        'reaction', key_columns)
 
     reaction_count = 0
 
-    for instance in reactions:
-        reaction_count += 1
-
-        # get post_id, challenge_id, user_id, reaction_status (is_cancelled)
-        post_id = instance.post_id
-        challenge_id = get_redis_value('post_clg_pair', post_id)
-        if challenge_id is None:
-            continue
-        user_id = instance.user_id
-        is_cancelled = instance.is_cancelled
-
-        ##### testing #####
-        if not os.path.exists('redis_output'):
-            os.makedirs('redis_output')
-        if not r.exists(f'{user_id}_clgs_preference'):
-            with open('./redis_output/user_clgs_preference.txt', 'a', encoding="utf-8") as clg_file:
-                clg_file.write(f'{user_id}_clgs_preference')
-                clg_file.write(',')
-        if not r.exists(f'{user_id}_reacted_post_pool'):
-            with open('./redis_output/user_reacted_post_pool.txt', 'a', encoding="utf-8") as post_file:
-                post_file.write(f'{user_id}_reacted_post_pool')
-                post_file.write(',')
-        ##### testing #####
-
-        # recalling a reaction is something negative, so decrement challenge preference
-        if is_cancelled:
-            set_redis_value(f'{user_id}_clgs_preference',
-                            'zset', [challenge_id, -0.6], 'incr')
-        else:
-            set_redis_value(f'{user_id}_reacted_post_pool', 'set', post_id)
-            set_redis_value(f'{user_id}_clgs_preference',
-                            'zset', [challenge_id, 1], 'incr')
+    for chunk in reactions:
+        reaction_count += len(chunk)
 
-    set_redis_value(['db_len', 'reaction'], 'hash', reaction_count, 'incr')
+        # get challenge_id of every reacted post in one round trip
+        post_clg_pair = get_redis_hash_values(
+            'post_clg_pair', [instance.post_id for instance in chunk])
+        reacted = [instance for instance in chunk if instance.post_id in post_clg_pair]
 
+        pipe = r.pipeline(transaction=True)
+        for instance in reacted:
+            post_id = instance.post_id
+            challenge_id = post_clg_pair[post_id]
+            user_id = instance.user_id
 
-if __name__ == "__main__":
-    load_dotenv()
+            # recalling a reaction is something negative, so decrement challenge preference
+            if instance.is_cancelled:
+                pipe.zincrby(f'{user_id}_clgs_preference', -0.6, challenge_id)
+            else:
+                pipe.sadd(f'{user_id}_reacted_post_pool', post_id)
+                pipe.zincrby(f'{user_id}_clgs_preference', 1, challenge_id)
+        set_watermark(pipe, 'reaction', chunk[-1], key_columns)
+        pipe.execute()
 
-    DATABASE_USER = os.environ['DATABASE_USER']
-    DATABASE_PASSWORD = os.environ['DATABASE_PASSWORD']
-    DATABASE_HOST = os.environ['DATABASE_HOST']
-    DATABASE_NAME = os.environ['DATABASE_NAME']
+    return reaction_count
 
-    SQLALCHEMY_DATABASE_URL = (
-        f"postgresql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
-    )
-    # Define your database connection here (SQLite for example)
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
-    # Base class for your model classes
-    Base = declarative_base()
+def rebuild_popular_posts() -> int:
+    """
+    Recompute the time-decayed popular_posts ranking from the recent reaction logs.
+    Reactions update it during the day; the rebuild also resets its epoch.
+    """
+    return popular_posts_crud.rebuild_popular_posts(session)
+
+
+def rebuild_discover_snapshot() -> int:
+    """
+    Rebuild the discover challenges snapshot from the day's challenges.
+    Skipped (0 rows) when an API worker is rebuilding it at the same time.
+    """
+    return discover_crud.rebuild_discover_snapshot(session) or 0
+
+
+def run_stages(stages: list) -> list:
+    """
+    param stages: functions to run in order, each returning the number of rows it handled.
+
+    return: [(stage name, rows, seconds)] for every stage.
+    """
+    report = []
+    for stage in stages:
+        start = time.perf_counter()
+        rows = stage()
+        report.append((stage.__name__, rows, time.perf_counter() - start))
+    return report
+
 
-    # Create a session to interact with the database
-    Session = sessionmaker(bind=engine)
-    session = Session()
+def print_timing_report(report: list) -> None:
+    """ Print rows, elapsed time and throughput of every stage """
+    print(f'{"stage":<45}{"rows":>10}{"seconds":>10}{"rows/s":>12}')
+    for name, rows, seconds in report:
+        rate = rows / seconds if seconds else 0
+        print(f'{name:<45}{rows:>10}{seconds:>10.3f}{rate:>12.0f}')
+    print(f'{"total":<45}{sum(row[1] for row in report):>10}'
+          f'{sum(row[2] for row in report):>10.3f}')
 
-    # # get redis cache
-    r = redis.Redis(host='localhost', port=6379, db=0)
+
+if __name__ == "__main__":
+    # Create a session on the shared engine
+    session = SessionLocal()
 
     sydney_tz = pytz.timezone('Australia/Sydney')
     DATE_TODAY = datetime.datetime.now(sydney_tz).date()
 
-    DAY_INDEX = (get_redis_value(
-        'day_index', error_result=-1) + 1) % MAX_POST_AGE
-    set_redis_value('day_index', 'str', DAY_INDEX)
-
-    try:
-        remove_outdated_clg_and_post_from_redis()
-        add_new_ongoing_challenges_to_redis()
-        update_challenge_distribution_for_users()
-        classify_new_posts()
-        process_recent_reaction_data()
-
-    except Exception as e:
-
-        keys = ['db_len', 'day_index', 'on_clg_info',
-                'user_contribution', 'post_clg_pair', 'completed_clg']
-        for key in keys:
-            r.delete(key)
-        for i in range(5):
-            r.delete(f'category{i}post')
-
-        folder = "./redis_output"
-        file_list = os.listdir(folder)
-        for filename in file_list:
-            file = f'{folder}/{filename}'
-            with open(file, 'r') as f:
-                keys = f.readline().split(',')
-                for key in keys:
-                    if key:
-                        r.delete(key)
-            if os.path.exists(file):
-                os.remove(file)
-        raise (e)
-
-    else:
-        print('Automation process is completed!')
+    # a resumed run on the same day keeps the day index of the failed run
+    DAY_INDEX = advance_day_index(DATE_TODAY)
+
+    # every chunk commits its redis writes together with the stage watermark,
+    # so a failed run is resumed by running the job again
+    timing_report = run_stages([
+        remove_outdated_clg_and_post_from_redis,
+        add_new_ongoing_challenges_to_redis,
+        update_challenge_distribution_for_users,
+        classify_new_posts,
+        process_recent_reaction_data,
+        rebuild_popular_posts,
+        rebuild_discover_snapshot,
+    ])
+    print_timing_report(timing_report)
+    print('Automation process is completed!')
 
     # Close the session
     session.close()
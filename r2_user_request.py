@@ -1,82 +1,30 @@
-import os
 import random
 
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, desc, func
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-
-import models
-from r1_automation import CLG_CATEGORY, get_redis_value
+import CRUD.popular_posts as popular_posts_crud
+from database import SessionLocal
+from r1_automation import get_redis_value
+from recommender_scoring import read_contribution, top_k_categories
 from redis_client import r
 
-# Load environment variables
-load_dotenv()
-
-# Connect to the database
-DATABASE_USER = os.environ['DATABASE_USER']
-DATABASE_PASSWORD = os.environ['DATABASE_PASSWORD']
-DATABASE_HOST = os.environ['DATABASE_HOST']
-DATABASE_NAME = os.environ['DATABASE_NAME']
-
-SQLALCHEMY_DATABASE_URL = (
-    f"postgresql://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}/{DATABASE_NAME}"
-)
-
-# Set up SQLAlchemy
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-Base = declarative_base()
-Session = sessionmaker(bind=engine)
-session = Session()
+# Session on the shared engine
+session = SessionLocal()
 
 
 def top3_categories(user_id: int) -> list:
     """
-    the 'user_contribution' key in redis is a hash table 
-    that record user's contribution to each challenge category.
+    the 'user_contribution:{user_id}' hash in redis
+    records user's contribution to each challenge category.
 
     this function takes user_id as input and return 3 
-    categories where the user has spent the most time contributing.
+    categories where the user has spent the most time contributing,
+    topped up with random categories. users without any record get [].
     """
 
     # retrive user's challenge contribution data.
-
-    contribution = get_redis_value(
-        'user_contribution', user_id, split_symbol=',')
-    if not contribution:
+    contribution = read_contribution(user_id)
+    if not contribution.any():
         return []
-    contribution = {idx: item for idx, item in enumerate(contribution)}
-
-    # randomly shuffle category code
-    categories = list(range(CLG_CATEGORY))
-    random.shuffle(categories)
-
-    top_categories = []
-
-    for category in categories:
-
-        # if user did not contribute to category i, then move on to the next category
-        if contribution[category] == 0:
-            continue
-
-        # otherwise, see if user's contribution is one of the top 3 cateogries.
-        for i, top_category in enumerate(top_categories):
-            if contribution[category] > contribution[top_category]:
-                top_categories.insert(i, category)
-                continue
-        if len(top_categories) < 3:
-            top_categories.append(category)
-        elif len(top_categories) > 3:
-            top_categories.pop()
-
-    # if user contributed to less than 3 categories,
-    # then randomly pick some other categories for this user
-    n = len(top_categories)
-    if n == 3:
-        return top_categories
-    other_categories = [item for item in [
-        0, 1, 2, 3, 4] if item not in top_categories]
-    return top_categories + random.sample(other_categories, 3-n)
+    return top_k_categories(contribution)[0].tolist()
 
 
 def remove_outdated_clg_from_user_records(user_id: int, reacted_clgs: list) -> list:
@@ -85,7 +33,8 @@ def remove_outdated_clg_from_user_records(user_id: int, reacted_clgs: list) -> l
 
     for challenge_id in reacted_clgs:
 
-        if not get_redis_value('on_clg_info', challenge_id, error_result=None):
+        # on_clg_info values are binary encoded, only their presence matters here
+        if not r.hexists('on_clg_info', challenge_id):
             r.zrem(f'{user_id}_clg_preference', challenge_id)
         else:
             ongoing_clg.append(challenge_id)
@@ -138,9 +87,9 @@ def get_unreacted_posts_from_reacted_challenges(user_id: int) -> set:
         if n == 0:
             continue
 
+        challenge_posts = [int(post) for post in r.lrange(f'clg{challenge_id}posts', 0, -1)]
         post_pool = post_pool.union(filter_posts(
-            new_posts=random.sample(
-                r.lrange(f'clg{challenge_id}posts', 0, -1), min(int(n/10)+1, 10)),
+            new_posts=random.sample(challenge_posts, min(int(n/10)+1, 10)),
             existing_posts=get_redis_value(f'{user_id}_reacted_post_pool', error_result=set()))
         )
 
@@ -171,23 +120,10 @@ def get_unreacted_posts_from_top3_categories(user_id: int, top3) -> set:
 
 def get_popular_posts() -> list:
     """
-    this function get recent popular posts from PostReaction database. 
+    this function get recent popular posts from the popular_posts ranking,
+    kept up to date by every reaction and rebuilt by the nightly job.
     """
-    # step 1: skip rows
-    k = get_redis_value('postReaction', ranges=[0, 0], error_result=0)
-    recent_posts = session.query(models.PostReaction).offset(k).subquery()
-
-    # step 2: group by post_id, sum the count column, order by popularity
-    post_by_popularity = session.query(
-        recent_posts.c.post_id,
-        func.sum(recent_posts.c.count).label(  # pylint: disable=not-callable
-            'total_count')
-    ).group_by(recent_posts.c.post_id
-               ).order_by(desc('total_count'))
-
-    # step 3: limit to the first 500 records (or less if there are fewer rows)
-    #         then filter for unreacted posts
-    return [instance.post_id for instance in post_by_popularity.limit(500).all()]
+    return popular_posts_crud.get_popular_posts()
 
 
 def get_unreacted_popular_posts(user_id: int, n: int):
@@ -220,7 +156,7 @@ def get_recommended_post(user_id):
 
     # get posts from top 3 categories
     top3_posts = top3_categories(user_id)
-    if len(top3_posts) == 0:
+    if top3_posts:
         post_pool = post_pool.union(
             get_unreacted_posts_from_top3_categories(user_id, top3_posts))
 
@@ -230,7 +166,7 @@ def get_recommended_post(user_id):
 
     # get recent posts that are popular in general
     post_pool = post_pool.union(get_unreacted_popular_posts(
-        user_id, min(30, 100-len(post_pool))))
+        user_id, max(0, min(30, 100-len(post_pool)))))
 
     return post_pool
 
@@ -0,0 +1,64 @@
+""" One-shot migration of on_clg_info to redis_codec
+
+Rewrites every legacy comma-joined value of the hash in the compact
+encoding. Values already encoded are left alone, so the script can be run
+again, and the reader accepts both formats while it runs.
+user_contribution is moved to per-user hashes by r4_split_user_contribution.py.
+
+    python r3_migrate_redis_codec.py [--dry-run]
+"""
+import argparse
+
+import redis
+
+from redis_client import r
+from redis_codec import decode_clg_info, encode_clg_info, is_encoded
+
+# hash fields read per HSCAN call
+SCAN_BATCH_SIZE = 1000
+
+CONVERTERS = {
+    'on_clg_info': lambda value: encode_clg_info(*decode_clg_info(value)),
+}
+
+
+def migrate_hash(key: str, convert, dry_run: bool = False) -> tuple:
+    """
+    param key: redis hash to migrate
+    param convert: function turning a legacy value into its encoded form
+    param dry_run: count legacy values without writing them
+
+    Every HSCAN batch is rewritten in a MULTI watched on the hash, so a value
+    the automation updates concurrently is read again instead of overwritten.
+    return: (fields scanned, fields rewritten)
+    """
+    scanned = migrated = 0
+    cursor = None
+    with r.pipeline(transaction=True) as pipe:
+        while cursor != 0:
+            try:
+                pipe.watch(key)
+                next_cursor, values = pipe.hscan(key, cursor or 0, count=SCAN_BATCH_SIZE)
+                legacy = {field: convert(value) for field, value in values.items()
+                          if not is_encoded(value)}
+                pipe.multi()
+                if legacy and not dry_run:
+                    pipe.hset(key, mapping=legacy)
+                pipe.execute()
+            except redis.WatchError:
+                continue
+            scanned += len(values)
+            migrated += len(legacy)
+            cursor = next_cursor
+    return scanned, migrated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    for hash_key, converter in CONVERTERS.items():
+        fields, rewritten = migrate_hash(hash_key, converter, args.dry_run)
+        print(f'{hash_key}: {fields} fields scanned, {rewritten} legacy values '
+              f'{"found" if args.dry_run else "rewritten"}')
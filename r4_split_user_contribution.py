@@ -0,0 +1,73 @@
+""" One-shot migration of the user_contribution hash to per-user hashes
+
+Moves every user's value of the old user_contribution hash, encoded or a
+legacy comma-joined string, into user_contribution:{user_id} with one field
+per category. Every batch adds the old values with HINCRBY and deletes them
+in the same MULTI, so increments the automation made in the meantime are
+kept and the script can be run again. A run holds MIGRATION_LOCK_KEY, so two
+concurrent runs cannot both add the same batch.
+
+    python r4_split_user_contribution.py [--dry-run]
+"""
+import argparse
+from typing import Optional
+
+from r1_automation import contribution_key
+from redis_client import r
+from redis_codec import decode_contribution
+
+LEGACY_KEY = 'user_contribution'
+MIGRATION_LOCK_KEY = 'user_contribution:migration_lock'
+# the lock is refreshed on every batch, so it only expires when a run died
+MIGRATION_LOCK_SECONDS = 300
+# hash fields read per HSCAN call
+SCAN_BATCH_SIZE = 1000
+
+
+def split_user_contribution(dry_run: bool = False) -> Optional[int]:
+    """
+    param dry_run: count users without moving them
+
+    return: number of users moved, None when another run holds the lock
+    """
+    if dry_run:
+        return r.hlen(LEGACY_KEY)
+    if not r.set(MIGRATION_LOCK_KEY, 1, nx=True, ex=MIGRATION_LOCK_SECONDS):
+        return None
+    try:
+        return move_batches()
+    finally:
+        r.delete(MIGRATION_LOCK_KEY)
+
+
+def move_batches() -> int:
+    """
+    return: number of users moved
+    """
+    moved = 0
+    cursor = None
+    while cursor != 0:
+        cursor, values = r.hscan(LEGACY_KEY, cursor or 0, count=SCAN_BATCH_SIZE)
+        if not values:
+            continue
+        pipe = r.pipeline(transaction=True)
+        for user_id, value in values.items():
+            for category, days in enumerate(decode_contribution(value)):
+                if days:
+                    pipe.hincrby(contribution_key(user_id.decode('utf-8')), category, days)
+        pipe.hdel(LEGACY_KEY, *values)
+        pipe.expire(MIGRATION_LOCK_KEY, MIGRATION_LOCK_SECONDS)
+        pipe.execute()
+        moved += len(values)
+    return moved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    users = split_user_contribution(args.dry_run)
+    if users is None:
+        parser.exit(1, f'{LEGACY_KEY}: another migration is running\n')
+    print(f'{LEGACY_KEY}: {users} users {"found" if args.dry_run else "moved"}')
@@ -0,0 +1,89 @@
+""" Vectorized category scoring for the recommender
+
+Every user has a user_contribution:{id} hash holding the days spent on each
+of the CLG_CATEGORY challenge categories, one field per category. This module
+loads many users' contributions into one NumPy matrix and ranks categories
+for the whole batch at once, for both the online endpoint and the nightly
+feed builder.
+"""
+import numpy as np
+
+from r1_automation import CLG_CATEGORY, contribution_key
+from redis_client import r
+
+TOP_K = 3
+# users read per pipeline when loading contributions
+LOAD_BATCH_SIZE = 1000
+CATEGORY_FIELDS = list(range(CLG_CATEGORY))
+# contributions are whole days, so noise below 1 only reorders equal ones
+TIE_BREAK_NOISE = 0.5
+
+
+def parse_contribution(value) -> np.ndarray:
+    """ Parse the HMGET of a user's contribution fields; missing fields are zeros """
+    contribution = np.zeros(CLG_CATEGORY)
+    if value:
+        parsed = [float(days) if days is not None else 0.0 for days in value[:CLG_CATEGORY]]
+        contribution[:len(parsed)] = parsed
+    return contribution
+
+
+def read_contribution(user_id: int) -> np.ndarray:
+    """ Load one user's contribution vector """
+    return parse_contribution(r.hmget(contribution_key(user_id), CATEGORY_FIELDS))
+
+
+def load_contributions(user_ids: list) -> np.ndarray:
+    """ Load the contribution vectors of many users
+
+    Args:
+        user_ids: users to load, one pipeline of HMGETs per LOAD_BATCH_SIZE users
+
+    Returns:
+        (len(user_ids), CLG_CATEGORY) matrix, zero rows for unknown users
+    """
+    contributions = np.zeros((len(user_ids), CLG_CATEGORY))
+    for start in range(0, len(user_ids), LOAD_BATCH_SIZE):
+        pipe = r.pipeline(transaction=False)
+        for user_id in user_ids[start:start + LOAD_BATCH_SIZE]:
+            pipe.hmget(contribution_key(user_id), CATEGORY_FIELDS)
+        for offset, value in enumerate(pipe.execute()):
+            contributions[start + offset] = parse_contribution(value)
+    return contributions
+
+
+def top_k_categories(contributions: np.ndarray, k: int = TOP_K, rng=None) -> np.ndarray:
+    """ Rank the top k categories of every user in a batch
+
+    Categories a user contributed to come first, by contribution, with
+    equal contributions in random order. Users with fewer than k such
+    categories are filled up with random other categories.
+
+    Args:
+        contributions: (n_users, CLG_CATEGORY) contribution matrix
+        k: number of categories per user
+        rng: numpy Generator, for reproducible tie-breaking
+
+    Returns:
+        (n_users, k) matrix of category codes, best first
+    """
+    rng = rng or np.random.default_rng()
+    contributions = np.atleast_2d(contributions)
+    noise = rng.random(contributions.shape) * TIE_BREAK_NOISE
+    # non-contributed categories rank below every contributed one, in random order
+    scores = np.where(contributions > 0, contributions, -1.0) + noise
+
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def top_categories_for_users(user_ids: list, k: int = TOP_K) -> dict:
+    """ Load and rank a batch of users
+
+    Returns:
+        {user_id: [category codes, best first]}
+    """
+    ranked = top_k_categories(load_contributions(user_ids), k)
+    return dict(zip(user_ids, ranked.tolist()))
@@ -1,13 +1,216 @@
+""" Shared, instrumented Redis clients and connection pools
+
+create_redis_client() builds every sync client of the API and the automation
+jobs, and create_async_redis_client() the redis.asyncio clients for async
+endpoints. Each process uses one blocking connection pool per client, sized
+and timed by the REDIS_* settings below, and retries connection errors with
+exponential backoff.
+
+The clients count each command by name and by the function that sent it
+(redis_commands_total), time every command and pipeline round trip
+(redis_command_duration_seconds), add the time to the current request's
+metrics, and log any round trip slower than REDIS_SLOW_COMMAND_MS.
+"""
+import logging
 import os
+import sys
+import time
+from functools import lru_cache
 
 import redis
+import redis.asyncio
 from dotenv import load_dotenv
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+
+from metrics import REDIS_COMMANDS, REDIS_LATENCY, add_request_time
 
 load_dotenv()
 
 # Remote server has REDIS_ENDPOINT set in the environment
 # Local development uses localhost
 REDIS_ENDPOINT = os.environ.get("REDIS_ENDPOINT")
+# round trips slower than this are logged with their caller
+REDIS_SLOW_COMMAND_MS = float(os.environ.get("REDIS_SLOW_COMMAND_MS", "10"))
+
+# Pool settings are per process and per client, so size them per uvicorn worker / job
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "50"))
+# seconds to wait for a free connection when all of them are in use
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", "5"))
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", "5"))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", "2"))
+# idle connections are PINGed before use after this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_RETRIES = int(os.environ.get("REDIS_RETRIES", "3"))
+# first and largest delay between retries, in seconds
+REDIS_RETRY_BACKOFF_BASE = float(os.environ.get("REDIS_RETRY_BACKOFF_BASE", "0.01"))
+REDIS_RETRY_BACKOFF_CAP = float(os.environ.get("REDIS_RETRY_BACKOFF_CAP", "0.5"))
+
+slow_logger = logging.getLogger("redis.slow")
+
+REDIS_PACKAGE_DIR = os.path.dirname(redis.__file__)
+
+
+def redis_caller() -> str:
+    """ module.function of the first frame outside redis-py and this module """
+    frame = sys._getframe(2)  # pylint: disable=protected-access
+    while frame is not None and (frame.f_code.co_filename == __file__ or
+                                 frame.f_code.co_filename.startswith(REDIS_PACKAGE_DIR)):
+        frame = frame.f_back
+    if frame is None:
+        return "<unknown>"
+    return f"{frame.f_globals.get('__name__', '?')}.{frame.f_code.co_name}"
+
+
+@lru_cache(maxsize=None)
+def command_counter(command: str, caller: str):
+    """ redis_commands_total child, looked up once per command and caller """
+    return REDIS_COMMANDS.labels(command, caller)
+
+
+@lru_cache(maxsize=None)
+def latency_histogram(command: str):
+    """ redis_command_duration_seconds child, looked up once per command """
+    return REDIS_LATENCY.labels(command)
+
+
+def command_name(args) -> str:
+    """ Upper-case name of a command from its arguments """
+    name = args[0]
+    return (name.decode() if isinstance(name, bytes) else str(name)).upper()
+
+
+def record_round_trip(command: str, caller: str, seconds: float, detail: str = ""):
+    """ Time one round trip, add it to the current request and log it if slow """
+    latency_histogram(command).observe(seconds)
+    add_request_time("redis", seconds)
+    if seconds * 1000 > REDIS_SLOW_COMMAND_MS:
+        slow_logger.warning("slow redis %s%s from %s: %.1f ms",
+                            command, detail, caller, seconds * 1000)
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """ Pipeline counting its queued commands and timing every flush """
+
+    def execute(self, raise_on_error=True):
+        caller = redis_caller()
+        names = [command_name(args) for args, _options in self.command_stack]
+        for name in names:
+            command_counter(name, caller).inc()
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            record_round_trip("PIPELINE", caller, time.perf_counter() - start,
+                              f" of {len(names)} commands")
+
+
+class InstrumentedRedis(redis.StrictRedis):
+    """ StrictRedis counting and timing every command """
+
+    def execute_command(self, *args, **options):
+        caller = redis_caller()
+        name = command_name(args)
+        command_counter(name, caller).inc()
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            record_round_trip(name, caller, time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks,
+                                    transaction, shard_hint)
+
+
+class InstrumentedAsyncPipeline(redis.asyncio.client.Pipeline):
+    """ redis.asyncio Pipeline counting its queued commands and timing every flush """
+
+    async def execute(self, raise_on_error: bool = True):
+        caller = redis_caller()
+        names = [command_name(args) for args, _options in self.command_stack]
+        for name in names:
+            command_counter(name, caller).inc()
+        start = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            record_round_trip("PIPELINE", caller, time.perf_counter() - start,
+                              f" of {len(names)} commands")
+
+
+class InstrumentedAsyncRedis(redis.asyncio.Redis):
+    """ redis.asyncio.Redis counting and timing every command """
+
+    async def execute_command(self, *args, **options):
+        caller = redis_caller()
+        name = command_name(args)
+        command_counter(name, caller).inc()
+        start = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            record_round_trip(name, caller, time.perf_counter() - start)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str = None):
+        return InstrumentedAsyncPipeline(self.connection_pool, self.response_callbacks,
+                                         transaction, shard_hint)
+
+
+def pool_options(retry_class) -> dict:
+    """ Environment-driven connection settings shared by every pool
+
+    Only connection errors are retried: a command that timed out may still
+    have been applied, and retrying an HINCRBY would count it twice.
+    """
+    return {
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "timeout": REDIS_POOL_TIMEOUT,
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "retry": retry_class(
+            ExponentialBackoff(cap=REDIS_RETRY_BACKOFF_CAP, base=REDIS_RETRY_BACKOFF_BASE),
+            REDIS_RETRIES, supported_errors=(redis.ConnectionError,)),
+    }
+
+
+def create_connection_pool(url: str = None, host: str = REDIS_ENDPOINT, port: int = 6379,
+                           db: int = 0, **kwargs) -> redis.BlockingConnectionPool:
+    """ Blocking pool with the shared settings, for a redis:// URL or a host """
+    options = {**pool_options(Retry), **kwargs}
+    if url:
+        return redis.BlockingConnectionPool.from_url(url, **options)
+    return redis.BlockingConnectionPool(host=host or "localhost", port=port, db=db, **options)
+
+
+def create_async_connection_pool(url: str = None, host: str = REDIS_ENDPOINT, port: int = 6379,
+                                 db: int = 0, **kwargs) -> redis.asyncio.BlockingConnectionPool:
+    """ redis.asyncio counterpart of create_connection_pool """
+    options = {**pool_options(AsyncRetry), **kwargs}
+    if url:
+        return redis.asyncio.BlockingConnectionPool.from_url(url, **options)
+    return redis.asyncio.BlockingConnectionPool(
+        host=host or "localhost", port=port, db=db, **options)
+
+
+def create_redis_client(url: str = None, **kwargs) -> InstrumentedRedis:
+    """ Instrumented client on its own pool; use this instead of redis.Redis
+
+    Modules share the process-wide r / redis_client below; build another
+    client only for another server or database, e.g. in the benchmarks.
+    """
+    return InstrumentedRedis(connection_pool=create_connection_pool(url, **kwargs))
+
+
+def create_async_redis_client(url: str = None, **kwargs) -> InstrumentedAsyncRedis:
+    """ Instrumented redis.asyncio client on its own pool, for async endpoints """
+    return InstrumentedAsyncRedis(connection_pool=create_async_connection_pool(url, **kwargs))
+
 
-# Create a Redis client instance
-r = redis.StrictRedis(host=REDIS_ENDPOINT, port=6379, db=0)
+# the process-wide clients, one pool each
+r = create_redis_client()
+redis_client = r
+async_redis_client = create_async_redis_client()
@@ -0,0 +1,95 @@
+""" Compact encoding of the recommender's Redis hash values
+
+on_clg_info and user_contribution values used to be comma-joined strings
+('category,is_public,duration,done_by' and 'c0,c1,c2,c3,c4'). They are now
+stored as one version byte followed by a msgpack array of small ints, which
+is smaller and decodes without any string splitting or float() parsing.
+
+The decoders still read the legacy comma strings, so values can be
+migrated (see r3_migrate_redis_codec.py) while the app is running.
+user_contribution has since moved to one hash per user; its decoder is
+kept for r4_split_user_contribution.py.
+"""
+from collections import namedtuple
+from datetime import date, datetime
+
+import msgpack
+
+CODEC_VERSION = 1
+VERSION_PREFIX = bytes([CODEC_VERSION])
+
+ClgInfo = namedtuple("ClgInfo", ["category", "is_public", "duration", "done_by"])
+
+
+def _pack(values: list) -> bytes:
+    return VERSION_PREFIX + msgpack.packb(values)
+
+
+def _unpack(value: bytes) -> list:
+    if value[:1] != VERSION_PREFIX:
+        raise ValueError(f"unsupported codec version {value[:1]!r}")
+    return msgpack.unpackb(value[1:])
+
+
+def is_encoded(value) -> bool:
+    """ True if value is in the current encoding, False for legacy strings """
+    return isinstance(value, bytes) and value[:1] == VERSION_PREFIX
+
+
+def _legacy_int(token: str):
+    return None if token in ("", "None") else int(float(token))
+
+
+def encode_clg_info(category, is_public, duration: int, done_by) -> bytes:
+    """ Encode an on_clg_info value
+
+    Args:
+        category: category code, or None
+        is_public: truthy if the challenge is public
+        duration: challenge duration in days
+        done_by: date (or datetime) the challenge finishes
+    """
+    if isinstance(done_by, datetime):
+        done_by = done_by.date()
+    category = None if category in (None, "", "None") else int(category)
+    return _pack([category, bool(is_public), int(duration), done_by.toordinal()])
+
+
+def decode_clg_info(value):
+    """ Decode an on_clg_info value, new or legacy; None stays None
+
+    Returns:
+        ClgInfo(category, is_public, duration, done_by)
+    """
+    if value is None:
+        return None
+    if is_encoded(value):
+        category, is_public, duration, done_by = _unpack(value)
+        return ClgInfo(category, is_public, duration, date.fromordinal(done_by))
+
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    category, is_public, duration, done_by = value.split(",")
+    return ClgInfo(_legacy_int(category), is_public not in ("0", "False", "None", ""),
+                   _legacy_int(duration), datetime.strptime(done_by, "%Y-%m-%d").date())
+
+
+def encode_contribution(contribution) -> bytes:
+    """ Encode a user_contribution value, one int per category """
+    return _pack([int(days) for days in contribution])
+
+
+def decode_contribution(value):
+    """ Decode a user_contribution value, new or legacy; None stays None
+
+    Returns:
+        list of ints, one per category
+    """
+    if value is None:
+        return None
+    if is_encoded(value):
+        return _unpack(value)
+
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return [_legacy_int(days) or 0 for days in value.split(",")]
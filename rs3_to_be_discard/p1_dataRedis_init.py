@@ -1,6 +1,4 @@
-import redis
-
-r = redis.Redis(host='localhost', port=6379, db=0)
+from redis_client import r
 
 print()
 print('r.keys() =', r.keys())
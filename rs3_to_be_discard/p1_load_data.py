@@ -1,27 +1,9 @@
-import redis
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 import models
-import os
-from dotenv import load_dotenv
+from database import SessionLocal
+from redis_client import r
 
-load_dotenv()
-
-SQLALCHEMY_DATABASE_URL = f"postgresql://{os.environ['DATABASE_USER']}:{os.environ['DATABASE_PASSWORD']}@{os.environ['DATABASE_HOST']}/{os.environ['DATABASE_NAME']}"
-
-# Define your database connection here (SQLite for example)
-engine = create_engine(SQLALCHEMY_DATABASE_URL)  
-
-# Base class for your model classes
-Base = declarative_base()
-
-# Create a session to interact with the database
-Session = sessionmaker(bind=engine)
-session = Session()
-
-# # get redis cache 
-r = redis.Redis(host='localhost', port=6379, db=0)
+# Create a session on the shared engine
+session = SessionLocal()
 
 
 
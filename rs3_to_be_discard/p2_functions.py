@@ -5,8 +5,6 @@ import pytz
 import random 
 
 
-r = redis.Redis(host='localhost', port=6379, db=0)
-
 
 sydney_tz = pytz.timezone('Australia/Sydney')
 DATE_TODAY = datetime.datetime.now(sydney_tz).date()